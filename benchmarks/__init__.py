@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the MacCMS Security Tool
+Synthetic fleet generator and per-subsystem benchmark harness
+"""
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Synthetic MacCMS fleet generator
+Builds N realistic-looking MacCMS sites with seeded infections for benchmarks
+"""
+
+import json
+import os
+import random
+import shutil
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_DIR = os.path.join(REPO_DIR, "demo")
+
+# Virus samples shipped with the repository
+SAMPLE_PHP = {
+    name: os.path.join(DEMO_DIR, "application", "extra", name)
+    for name in ("active.php", "system.php", "addones.php")
+}
+SAMPLE_JS = os.path.join(DEMO_DIR, "static", "js", "jquery-1.12.4.min.js")
+
+# Where generated files go inside a site: (directory, extension, share)
+LAYOUT = [
+    ("static/js", ".js", 0.30),
+    ("template/default/js", ".js", 0.10),
+    ("template/default/html", ".html", 0.20),
+    ("application/index/controller", ".php", 0.15),
+    ("application/admin/controller", ".php", 0.10),
+    ("thinkphp/library/think", ".php", 0.10),
+    ("vendor/lib", ".php", 0.05),
+]
+
+# Identifiers for clean code; none of them (alone or joined by the
+# punctuation used below) spells a detection literal
+WORDS = ("var", "function", "return", "this", "data", "item", "list", "node", "value", "index",
+         "render", "update", "player", "video", "title", "config", "state", "event", "handler",
+         "width", "height", "page", "query", "result", "options", "cache", "timer", "click")
+
+
+class FleetGenerator:
+    """Writes a fleet of synthetic MacCMS sites below root
+
+    File sizes follow a log-normal distribution (a few KB, long tail),
+    every site can get large_per_site minified bundles of large_size
+    bytes, and infected_ratio of the JS files are replaced by the infected
+    jQuery sample. The same fraction of sites gets the active.php,
+    system.php and addones.php samples. generate() returns a summary with
+    the expected findings so benchmark results can be checked.
+    """
+
+    def __init__(self, root, sites=10, files_per_site=200, infected_ratio=0.02,
+                 large_per_site=0, large_size=4 * 1024 * 1024, seed=1):
+        self.root = root
+        self.sites = sites
+        self.files_per_site = files_per_site
+        self.infected_ratio = infected_ratio
+        self.large_per_site = large_per_site
+        self.large_size = large_size
+        self.random = random.Random(seed)
+        self._chunk = None
+
+    def clean_text(self, size, html=False):
+        """Deterministic clean minified-looking code of about size bytes"""
+        if self._chunk is None:
+            parts = []
+            while sum(len(part) for part in parts) < 64 * 1024:
+                a, b, c = (self.random.choice(WORDS) for _ in range(3))
+                parts.append(f"{a}.{b}=function({c}){{return {c}.{a}+{self.random.randint(0, 999)}}};")
+            self._chunk = "".join(parts)
+
+        start = self.random.randrange(len(self._chunk))
+        text = (self._chunk[start:] + self._chunk) * (size // len(self._chunk) + 1)
+        text = text[:max(size, 1)]
+        if html:
+            return f"<html><head><title>page</title></head><body><script>{text}</script></body></html>\n"
+        return text
+
+    def file_size(self):
+        return int(min(max(self.random.lognormvariate(8.5, 1.0), 200), 512 * 1024))
+
+    def write_site(self, site_dir, summary):
+        infected_site = self.random.random() < self.infected_ratio
+        for directory in ("runtime/cache", "upload", "application/extra", "public"):
+            os.makedirs(os.path.join(site_dir, directory), exist_ok=True)
+        for name in ("api.php", "index.php", "install.php"):
+            with open(os.path.join(site_dir, name), 'w', encoding='utf-8') as f:
+                f.write("<?php\n// entry\nrequire __DIR__ . '/thinkphp/start.php';\n")
+
+        # Infected sites get the samples, where the hijacked addones.php
+        # replaces the clean addons.php
+        if infected_site:
+            for name, sample in SAMPLE_PHP.items():
+                shutil.copyfile(sample, os.path.join(site_dir, "application", "extra", name))
+            summary['infected_sites'] += 1
+        else:
+            with open(os.path.join(site_dir, "application", "extra", "addons.php"), 'w', encoding='utf-8') as f:
+                f.write("<?php\n\nreturn array (\n  'autoload' => false,\n  'hooks' => array (),\n);\n")
+
+        for i in range(self.files_per_site):
+            roll = self.random.random()
+            for directory, extension, share in LAYOUT:
+                roll -= share
+                if roll <= 0:
+                    break
+            target_dir = os.path.join(site_dir, *directory.split('/'))
+            os.makedirs(target_dir, exist_ok=True)
+            path = os.path.join(target_dir, f"f{i:05d}{extension}")
+
+            if extension == ".js" and self.random.random() < self.infected_ratio:
+                shutil.copyfile(SAMPLE_JS, path)
+                summary['infected_js'] += 1
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(self.clean_text(self.file_size(), html=extension == ".html"))
+            summary['files'] += 1
+            summary['bytes'] += os.path.getsize(path)
+
+        for i in range(self.large_per_site):
+            path = os.path.join(site_dir, "static", "js", f"bundle{i}.min.js")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.clean_text(self.large_size))
+            summary['files'] += 1
+            summary['bytes'] += self.large_size
+
+    def generate(self):
+        """Write the fleet and return its summary (also saved as fleet.json)"""
+        os.makedirs(self.root, exist_ok=True)
+        summary = {'root': self.root, 'sites': [], 'files': 0, 'bytes': 0,
+                   'infected_js': 0, 'infected_sites': 0}
+        for n in range(self.sites):
+            site_dir = os.path.join(self.root, f"site{n:04d}", "wwwroot")
+            self.write_site(site_dir, summary)
+            summary['sites'].append(site_dir)
+
+        with open(os.path.join(self.root, "fleet.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=1)
+        return summary
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS benchmark harness
+Generates a synthetic fleet and times each subsystem in its own process
+
+Usage:
+    python3 benchmarks/run.py --sites 20 --files 300 --large 1 --jobs 4
+    python3 benchmarks/run.py --json > bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from benchmarks.fleet import FleetGenerator  # noqa: E402
+
+
+SUBSYSTEMS = ("discover", "php", "js", "full", "lock")
+
+
+def peak_rss_mb(who):
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux)"""
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def fleet_targets(summary, checker, php=False):
+    """Count the files and bytes the JS check (and with php the webshell check) looks at"""
+    files = 0
+    size = 0
+    for site in summary['sites']:
+        walk = checker.walk_site(site, php=php)
+        for file_path in walk.js + walk.php:
+            files += 1
+            size += file_path.stat().st_size
+    return files, size
+
+
+def bench_discover(summary, args):
+    from safemac.core import MacCMSSiteScanner
+    scanner = MacCMSSiteScanner()
+    started = time.perf_counter()
+    sites = scanner.find_sites_in_path(summary['root'])
+    # Discovery never opens files, so its rate is reported in sites/s
+    return [{'subsystem': 'discover', 'wall': time.perf_counter() - started,
+             'files': len(sites), 'unit': 'sites', 'bytes': 0,
+             'found': len(sites), 'expected': len(summary['sites'])}]
+
+
+def bench_php(summary, args):
+    from safemac.core import MacCMSVirusChecker
+    checker = MacCMSVirusChecker()
+    checker.assume_yes = False
+    paths = sum(len(rule.paths) for rule in checker.rules.rules if rule.check.startswith('php_'))
+    started = time.perf_counter()
+    found = checker.check_php_active_system(summary['sites'])
+    found += checker.check_php_addons_hijack(summary['sites'])
+    return [{'subsystem': 'php', 'wall': time.perf_counter() - started,
+             'files': len(summary['sites']) * paths, 'unit': 'paths', 'bytes': 0,
+             'found': found, 'expected': summary['infected_sites'] * 3}]
+
+
+def bench_js(summary, args):
+    from safemac.core import MacCMSVirusChecker
+    checker = MacCMSVirusChecker()
+    checker.jobs = args.jobs
+    checker.read_ahead = args.read_ahead
+    checker.use_scan_cache = False
+    checker.use_allowlist = False
+    checker.log_dir = os.path.join(args.workdir, "log")
+    files, size = fleet_targets(summary, checker)
+    started = time.perf_counter()
+    found = checker.check_javascript_virus(summary['sites'])
+    return [{'subsystem': 'js', 'wall': time.perf_counter() - started,
+             'files': files, 'bytes': size,
+             'found': found, 'expected': summary['infected_js']}]
+
+
+def bench_full(summary, args):
+    from safemac.core import MacCMSVirusChecker
+    from safemac.core.pipeline import SiteCheckPipeline
+    checker = MacCMSVirusChecker()
+    checker.assume_yes = False
+    checker.jobs = args.jobs
+    checker.read_ahead = args.read_ahead
+    checker.use_scan_cache = False
+    checker.use_allowlist = False
+    checker.log_dir = os.path.join(args.workdir, "log")
+    files, size = fleet_targets(summary, checker, php=True)
+    started = time.perf_counter()
+    found = sum(SiteCheckPipeline(checker).run(summary['sites']).values())
+    return [{'subsystem': 'full', 'wall': time.perf_counter() - started,
+             'files': files, 'bytes': size,
+             'found': found, 'expected': summary['infected_js'] + summary['infected_sites'] * 3}]
+
+
+def bench_lock(summary, args):
+    from safemac.core import MacCMSFileLocker
+    locker = MacCMSFileLocker()
+    locker.manifest_dir = os.path.join(args.workdir, "lock_manifest")
+    if not locker.check_chattr_support() or not locker.flag_engine.is_supported(summary['root']):
+        return [{'subsystem': 'lock', 'skipped': "不支持 immutable 标志（需要 root 和 ext4/xfs 等文件系统）"}]
+
+    records = []
+    for operation in ('lock', 'unlock'):
+        started = time.perf_counter()
+        results = locker.process_sites_in_parallel(summary['sites'], operation, max_workers=args.jobs)
+        wall = time.perf_counter() - started
+        total = [result.total() for result in results.values()]
+        records.append({'subsystem': operation, 'wall': wall,
+                        'files': sum(t.changed + t.skipped for t in total), 'bytes': 0,
+                        'failed': sum(t.failed for t in total)})
+    return records
+
+
+BENCHMARKS = {
+    'discover': bench_discover,
+    'php': bench_php,
+    'js': bench_js,
+    'full': bench_full,
+    'lock': bench_lock,
+}
+
+
+def run_child(args):
+    """Run one subsystem in this process and print its records as JSON"""
+    with open(os.path.join(args.workdir, "fleet", "fleet.json"), 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+
+    # Tool output is not part of the measurement
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        records = BENCHMARKS[args.child](summary, args)
+
+    for record in records:
+        if 'wall' not in record:
+            continue
+        record['peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_SELF)
+        record['workers_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+        record['files_per_s'] = round(record['files'] / record['wall'], 1) if record['wall'] else None
+        record['mb_per_s'] = round(record['bytes'] / 1048576 / record['wall'], 2) if record['wall'] else None
+        record['wall'] = round(record['wall'], 3)
+    print(json.dumps(records))
+
+
+def run_subsystem(name, args):
+    """Run one subsystem in a fresh interpreter so peak RSS is its own"""
+    command = [sys.executable, os.path.abspath(__file__), "--child", name,
+               "--workdir", args.workdir, "--jobs", str(args.jobs), "--read-ahead", str(args.read_ahead)]
+    proc = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        return [{'subsystem': name, 'error': f"exit code {proc.returncode}"}]
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def format_table(records):
+    header = f"{'subsystem':<10}{'wall s':>9}{'files':>9}{'files/s':>11}{'MB/s':>9}{'RSS MB':>9}{'workers':>9}  result"
+    lines = [header, "-" * len(header)]
+    for record in records:
+        if 'wall' not in record:
+            lines.append(f"{record['subsystem']:<10}  {record.get('skipped') or record.get('error')}")
+            continue
+        result = f"({record['unit']}) " if 'unit' in record else ""
+        if 'expected' in record:
+            result += f"found {record['found']}/{record['expected']}"
+        elif record.get('failed'):
+            result += f"failed {record['failed']}"
+        mb_per_s = f"{record['mb_per_s']:.2f}" if record['bytes'] else "-"
+        lines.append(f"{record['subsystem']:<10}{record['wall']:>9.3f}{record['files']:>9}"
+                     f"{record['files_per_s']:>11}{mb_per_s:>9}{record['peak_rss_mb']:>9}"
+                     f"{record['workers_peak_rss_mb']:>9}  {result}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MacCMS 文件检查系统基准测试")
+    parser.add_argument("--sites", type=int, default=10, help="站点数量（默认 10）")
+    parser.add_argument("--files", type=int, default=200, help="每个站点的文件数（默认 200）")
+    parser.add_argument("--infected", type=float, default=0.02, help="感染比例（默认 0.02）")
+    parser.add_argument("--large", type=int, default=0, help="每个站点的大型压缩 JS 文件数（默认 0）")
+    parser.add_argument("--large-mb", type=float, default=4, help="大型 JS 文件大小 MB（默认 4）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子（默认 1）")
+    parser.add_argument("--jobs", type=int, default=1, help="JS 检查与锁定的并发数（默认 1）")
+    parser.add_argument("--read-ahead", type=int, default=0,
+                        help="--jobs 1 时 JS/完整检查预读的文件数（默认 0 关闭）")
+    parser.add_argument("--only", default=",".join(SUBSYSTEMS),
+                        help=f"要测试的子系统（默认 {','.join(SUBSYSTEMS)}）")
+    parser.add_argument("--workdir", help="测试目录（默认新建临时目录，结束后删除）")
+    parser.add_argument("--keep", action="store_true", help="保留生成的测试站点")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--child", choices=SUBSYSTEMS, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        run_child(args)
+        return 0
+
+    own_workdir = args.workdir is None
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="safemac-bench-")
+    try:
+        started = time.perf_counter()
+        summary = FleetGenerator(os.path.join(args.workdir, "fleet"), sites=args.sites,
+                                 files_per_site=args.files, infected_ratio=args.infected,
+                                 large_per_site=args.large, large_size=int(args.large_mb * 1048576),
+                                 seed=args.seed).generate()
+        print(f"生成 {len(summary['sites'])} 个站点，{summary['files']} 个文件，"
+              f"{summary['bytes'] / 1048576:.1f} MB，用时 {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        records = []
+        for name in args.only.split(','):
+            name = name.strip()
+            if name not in BENCHMARKS:
+                print(f"未知的子系统: {name}", file=sys.stderr)
+                return 2
+            records.extend(run_subsystem(name, args))
+
+        if args.json:
+            print(json.dumps({'fleet': {key: value for key, value in summary.items() if key != 'sites'},
+                              'jobs': args.jobs, 'results': records}, indent=1))
+        else:
+            print(format_table(records))
+        return 0
+    finally:
+        if own_workdir and not args.keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+        elif args.keep:
+            print(f"测试站点保留在: {args.workdir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
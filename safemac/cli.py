@@ -5,10 +5,29 @@ MacCMS File Checking System CLI
 Command Line Interface for the MacCMS security tool
 """
 
+import argparse
+import contextlib
+import json
 import os
+import shlex
+import socket
 import sys
+import time
 from .core import MacCMSSiteScanner, MacCMSVirusChecker, MacCMSFileLocker
-from .utils import Colors, print_colored, print_header, confirm_action, get_script_dir, read_site_list
+from .core.allowlist import HashAllowlist, DEFAULT_EXTENSIONS
+from .core.history import FindingsHistory
+from .core.pipeline import SiteCheckPipeline, CHECKS
+from .core.watcher import SiteWatcher
+from .core.fleet import FleetWorker, FleetCoordinator, FleetError, load_fleet, fleet_report
+from .utils import (Colors, print_colored, print_header, confirm_action, get_script_dir, read_site_list,
+                    read_site_file, ensure_dir_exists, ResultStream, Metrics)
+
+
+# Exit codes for headless batch runs
+EXIT_OK = 0          # completed, nothing suspicious found
+EXIT_FINDINGS = 1    # completed, suspicious files were found
+EXIT_FAILURE = 2     # some sites or files could not be processed
+EXIT_USAGE = 3       # bad arguments, missing site list, unsupported system
 
 
 class MacCMSSecurityTool:
@@ -123,8 +142,497 @@ class MacCMSSecurityTool:
                 print()
 
 
+class BatchRunner:
+    """Headless subcommands for cron-driven fleet runs
+
+    Human-readable progress goes to stderr; stdout carries one JSON
+    object per line (see ResultStream) and the process exit code tells
+    the caller whether anything was found or failed.
+    """
+    
+    def __init__(self, args, stream):
+        self.args = args
+        self.stream = stream
+        self.script_dir = get_script_dir()
+        self.data_dir = os.path.join(self.script_dir, "data")
+        # Shared by every component of the run, written out at the end
+        self.metrics = Metrics(enabled=bool(args.metrics_json or args.metrics_textfile))
+        # Sites given by a coordinator, used instead of the site list
+        self.sites = None
+        # (reader, writer) binary streams a stdio worker talks over
+        self.channel = None
+    
+    def load_sites(self):
+        """Read the site list from --sites-file or data/site.txt"""
+        if self.sites is not None:
+            return list(self.sites)
+        if self.args.sites_file:
+            return read_site_file(self.args.sites_file)
+        return read_site_list(self.data_dir)
+    
+    def run(self):
+        """Dispatch to the selected subcommand and return an exit code"""
+        handler = getattr(self, "run_" + self.args.command.replace('-', '_'))
+        start = time.time()
+        code = handler()
+        self.stream.emit('summary', command=self.args.command, exit_code=code,
+                         elapsed=round(time.time() - start, 3), events=dict(self.stream.counts))
+        self.write_metrics(code)
+        return code
+    
+    def write_metrics(self, code):
+        """Write the run's metrics to --metrics-json / --metrics-textfile"""
+        if not self.metrics.enabled:
+            return
+        self.metrics.incr('runs', command=self.args.command, exit_code=code)
+        try:
+            if self.args.metrics_json:
+                self.metrics.write_json(self.args.metrics_json, command=self.args.command, exit_code=code,
+                                        host=socket.gethostname())
+            if self.args.metrics_textfile:
+                self.metrics.write_textfile(self.args.metrics_textfile, command=self.args.command)
+        except OSError as e:
+            print_colored(f"写入运行指标失败: {e}", Colors.YELLOW)
+    
+    def job_count(self):
+        """Worker count from --jobs, 0 meaning the CPU count, None when not given"""
+        if self.args.jobs == 0:
+            return os.cpu_count() or 1
+        return self.args.jobs
+    
+    def run_scan_sites(self):
+        """Discover MacCMS sites and write the site list"""
+        scanner = MacCMSSiteScanner()
+        if self.args.jobs is not None:
+            scanner.jobs = self.job_count()
+        sites = scanner.scan_all_sites()
+        
+        if self.args.sites_file:
+            ensure_dir_exists(os.path.dirname(os.path.abspath(self.args.sites_file)))
+            with open(self.args.sites_file, 'w', encoding='utf-8') as f:
+                for site in sites:
+                    f.write(f"{site}\n")
+        
+        for site in sites:
+            self.stream.emit('site', command='scan-sites', site=site)
+        return EXIT_OK if sites else EXIT_FAILURE
+    
+    def run_allowlist_build(self):
+        """Add every file of trusted clean installs to the allowlist"""
+        checker = MacCMSVirusChecker()
+        allowlist = HashAllowlist(self.args.output or checker.allowlist_file).load()
+        extensions = tuple(ext if ext.startswith('.') else '.' + ext
+                           for ext in (self.args.ext or DEFAULT_EXTENSIONS))
+        
+        for root in self.args.paths:
+            if not os.path.isdir(root):
+                print_colored(f"目录不存在: {root}", Colors.RED)
+                return EXIT_USAGE
+            print_colored(f"正在计算已知干净文件的哈希: {root}", Colors.YELLOW)
+            added, seen = allowlist.add_tree(root, label=self.args.label, extensions=extensions)
+            print_colored(f"  共 {seen} 个文件，新增 {added} 个", Colors.GREEN)
+            self.stream.emit('allowlist', path=root, files=seen, added=added)
+        
+        allowlist.save()
+        print_colored(f"白名单已保存到: {allowlist.allowlist_file}（共 {len(allowlist)} 个哈希）", Colors.GREEN)
+        return EXIT_OK
+    
+    def run_check(self):
+        """Run the selected virus checks over every site"""
+        sites = self.load_sites()
+        if not sites:
+            print_colored("错误: 未找到站点列表文件或站点列表为空", Colors.RED)
+            return EXIT_USAGE
+        
+        checker = MacCMSVirusChecker()
+        if checker.rules_error:
+            return EXIT_USAGE
+        checker.assume_yes = self.args.yes
+        checker.result_handler = self.stream.emit
+        checker.metrics = self.metrics
+        checker.profile_rules = self.args.profile_rules
+        if self.args.jobs is not None:
+            checker.jobs = self.job_count()
+        checker.use_scan_cache = not self.args.no_cache
+        checker.force_rescan = self.args.force_rescan
+        checker.use_allowlist = not self.args.no_allowlist
+        checker.findings_top_k = self.args.top_k
+        checker.findings_jsonl = self.args.findings_jsonl
+        if self.args.max_size is not None:
+            checker.js_max_size = int(self.args.max_size * 1024 * 1024)
+        checker.js_size_policy = self.args.size_policy.replace('-', '_')
+        checker.js_head_tail_bytes = self.args.head_tail_kb * 1024
+        checker.js_skip_binary = self.args.skip_binary
+        checker.obfuscation_scoring = not self.args.no_obfuscation_score
+        checker.obfuscation_threshold = self.args.obfuscation_threshold
+        checker.obfuscation_top = self.args.obfuscation_top
+        checker.read_ahead = self.args.read_ahead
+        checker.read_threads = self.args.read_threads
+        checker.mount_read_limits = dict(self.args.mount_limit)
+        checker.mount_read_default = self.args.mount_default
+        checker.use_history = self.args.history or bool(self.args.history_db)
+        if self.args.history_db:
+            checker.history_file = self.args.history_db
+        
+        checks = {
+            'active': checker.check_php_active_system,
+            'addons': checker.check_php_addons_hijack,
+            'js': checker.check_javascript_virus,
+            'php': checker.check_php_webshell,
+        }
+        
+        found = 0
+        if len(self.args.checks) > 1 and not self.args.separate:
+            # One traversal per site feeds every selected check
+            with self.metrics.time('check', check='full'):
+                found = sum(SiteCheckPipeline(checker, self.args.checks).run(sites).values())
+        else:
+            for name in self.args.checks:
+                with self.metrics.time('check', check=name):
+                    found += checks[name](sites) or 0
+        
+        if self.stream.counts.get('error'):
+            return EXIT_FAILURE
+        return EXIT_FINDINGS if found else EXIT_OK
+    
+    def run_history(self):
+        """Answer trend and diff questions from the findings history"""
+        db_file = self.args.history_db or MacCMSVirusChecker().history_file
+        if not os.path.exists(db_file):
+            print_colored(f"错误: 历史数据库不存在: {db_file}（使用 check --history 记录）", Colors.RED)
+            return EXIT_USAGE
+        
+        with FindingsHistory(db_file) as history:
+            query = self.args.query
+            if query == 'runs':
+                rows = history.runs(limit=self.args.limit)
+            elif query == 'sites':
+                if not self.args.pattern:
+                    print_colored("错误: history sites 需要 --pattern", Colors.RED)
+                    return EXIT_USAGE
+                rows = history.sites_with_pattern(self.args.pattern, days=self.args.days)
+            elif query == 'trend':
+                rows = history.trend(pattern=self.args.pattern, limit=self.args.limit)
+            else:
+                runs = self.args.runs or list(reversed(history.latest_runs(2)))
+                if len(runs) != 2:
+                    print_colored("错误: 需要两次运行才能比较（--runs OLD NEW）", Colors.RED)
+                    return EXIT_USAGE
+                changes = history.diff(runs[0], runs[1])
+                for change, items in changes.items():
+                    for row in items:
+                        self.stream.emit('history', query='diff', change=change,
+                                         old_run=runs[0], new_run=runs[1], **row)
+                print_colored(f"运行 {runs[0]} -> {runs[1]}: 新增 {len(changes['new'])} 条命中，"
+                              f"已消除 {len(changes['resolved'])} 条", Colors.BLUE)
+                return EXIT_FINDINGS if changes['new'] else EXIT_OK
+        
+        for row in rows:
+            self.stream.emit('history', query=query, **row)
+        print_colored(f"共 {len(rows)} 条记录", Colors.BLUE)
+        return EXIT_OK
+    
+    def run_watch(self):
+        """Check created or modified site files as they change"""
+        sites = self.load_sites()
+        if not sites:
+            print_colored("错误: 未找到站点列表文件或站点列表为空", Colors.RED)
+            return EXIT_USAGE
+        
+        checker = MacCMSVirusChecker()
+        if checker.rules_error:
+            return EXIT_USAGE
+        checker.assume_yes = self.args.yes
+        checker.result_handler = self.stream.emit
+        checker.metrics = self.metrics
+        
+        watcher = SiteWatcher(checker, sites)
+        watcher.debounce = self.args.debounce
+        found = watcher.run(duration=self.args.duration)
+        if found is None:
+            return EXIT_USAGE
+        if self.stream.counts.get('error'):
+            return EXIT_FAILURE
+        return EXIT_FINDINGS if found else EXIT_OK
+    
+    def run_worker(self):
+        """Serve check requests from a coordinator over stdin/stdout or a Unix socket"""
+        worker = FleetWorker(self.run_check_request)
+        if self.args.socket:
+            try:
+                ok = worker.serve_socket(self.args.socket, once=self.args.once)
+            except OSError as e:
+                print_colored(f"无法监听套接字 {self.args.socket}: {e}", Colors.RED)
+                return EXIT_FAILURE
+        else:
+            reader, writer = self.channel
+            try:
+                ok = worker.serve(reader, writer)
+            except OSError as e:
+                print_colored(f"协调端连接中断: {e}", Colors.RED)
+                return EXIT_FAILURE
+        return EXIT_OK if ok else EXIT_FAILURE
+    
+    def run_check_request(self, check_args, sites, events):
+        """Run one coordinator "check" request, returns the done-frame fields"""
+        args, error = parse_check_args(check_args)
+        if error:
+            print_colored(error, Colors.RED)
+            return {'exit_code': EXIT_USAGE, 'error': error}
+        
+        runner = BatchRunner(args, events)
+        runner.sites = sites
+        runner.metrics.enabled = True
+        sites = runner.load_sites()
+        runner.sites = sites
+        code = runner.run()
+        return {'exit_code': code, 'sites': len(sites), 'metrics': runner.metrics.to_dict()}
+    
+    def run_coordinate(self):
+        """Run the check on every host of a fleet file and merge the results"""
+        try:
+            hosts, check_args = load_fleet(self.args.fleet_file)
+        except FleetError as e:
+            print_colored(f"错误: {e}", Colors.RED)
+            return EXIT_USAGE
+        check_args += shlex.split(self.args.check_args or '')
+        for host in hosts:
+            _, error = parse_check_args(check_args + host['check_args'])
+            if error:
+                print_colored(f"主机 {host['name']}: {error}", Colors.RED)
+                return EXIT_USAGE
+        
+        started = time.perf_counter()
+        coordinator = FleetCoordinator(hosts, check_args, self.stream, self.metrics, parallel=self.args.parallel)
+        reports = coordinator.run()
+        report = fleet_report(reports, time.perf_counter() - started)
+        
+        if self.args.report:
+            try:
+                ensure_dir_exists(os.path.dirname(os.path.abspath(self.args.report)))
+                with open(self.args.report, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+                print_colored(f"多主机报告已保存到: {self.args.report}", Colors.GREEN)
+            except OSError as e:
+                print_colored(f"写入多主机报告失败: {e}", Colors.YELLOW)
+        
+        totals = report['totals']
+        print_colored(f"共 {totals['hosts']} 台主机（失败 {totals['failed']} 台），{totals['sites']} 个站点，"
+                      f"发现 {totals['findings']} 个问题", Colors.BLUE)
+        if not all(report.ok for report in reports):
+            return EXIT_FAILURE
+        return EXIT_FINDINGS if any(report.exit_code == EXIT_FINDINGS for report in reports) else EXIT_OK
+    
+    def run_lock(self):
+        """Lock the selected sites"""
+        return self._run_locker('lock')
+    
+    def run_unlock(self):
+        """Unlock the selected sites"""
+        return self._run_locker('unlock')
+    
+    def run_relock(self):
+        """Lock only what is new or changed since the last lock"""
+        return self._run_locker('relock')
+    
+    def _run_locker(self, operation):
+        locker = MacCMSFileLocker()
+        locker.metrics = self.metrics
+        if operation == 'unlock':
+            locker.use_manifest = not self.args.full
+            locker.unlock_only = self.args.only or None
+        if not locker.check_chattr_support():
+            print_colored("错误: 当前系统不支持 chattr 命令", Colors.RED)
+            return EXIT_USAGE
+        
+        sites = self.load_sites()
+        if not sites:
+            print_colored("错误: 未找到站点列表文件或站点列表为空", Colors.RED)
+            return EXIT_USAGE
+        
+        if not self.args.yes:
+            print_colored(f"请使用 --yes 确认对 {len(sites)} 个站点执行 {operation} 操作", Colors.RED)
+            return EXIT_USAGE
+        
+        results = locker.process_sites_in_parallel(sites, operation, max_workers=self.job_count())
+        for site, result in results.items():
+            total = result.total()
+            self.stream.emit('site', command=operation, site=site, ok=result.ok,
+                             elapsed=round(result.elapsed, 3), units=result.units,
+                             changed=total.changed, skipped=total.skipped, failed=total.failed,
+                             error=result.error, errors=total.errors)
+        
+        return EXIT_OK if all(result.ok for result in results.values()) else EXIT_FAILURE
+
+
+def mount_limit(value):
+    """Parse a DIR=N read limit for --mount-limit"""
+    path, sep, limit = value.rpartition('=')
+    if not sep or not path or not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"应为 目录=并发数，例如 /www/wwwroot=4: {value}")
+    return path, int(limit)
+
+
+def parse_check_args(check_args):
+    """Parse the options of a "check" run, returns (args, error)"""
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            args = build_parser().parse_args(['check'] + list(check_args))
+    except SystemExit:
+        return None, f"无效的检查参数: {' '.join(check_args)}"
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        return None, f"未知的检查类型: {', '.join(unknown)}"
+    return args, None
+
+
+def build_parser():
+    """Build the argument parser for headless subcommands"""
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="MacCMS 文件检查系统 - 无交互批处理模式（不带参数运行进入交互菜单）")
+    
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--sites-file", help="站点列表文件（默认 data/site.txt）")
+    common.add_argument("--jobs", type=int,
+                        help="并发数（0 = CPU 核心数；默认 check 为 1，scan-sites 为 4，lock/unlock/relock 为 CPU 核心数的 4 倍且不超过 32）")
+    common.add_argument("--yes", action="store_true",
+                        help="对所有确认提示回答“是”（隔离/覆盖/锁定）")
+    common.add_argument("--metrics-json", metavar="FILE",
+                        help="运行结束时把各阶段耗时和计数写入此 JSON 文件")
+    common.add_argument("--metrics-textfile", metavar="FILE",
+                        help="运行结束时写入 node_exporter textfile（Prometheus 格式，如 /var/lib/node_exporter/safemac.prom）")
+    
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("scan-sites", parents=[common], help="扫描并更新站点列表")
+    
+    check = subparsers.add_parser("check", parents=[common], help="运行病毒检查")
+    check.add_argument("--checks", default="active,addons,js,php",
+                       type=lambda value: [item.strip() for item in value.split(',') if item.strip()],
+                       help="要运行的检查: active,addons,js,php（默认全部）")
+    check.add_argument("--separate", action="store_true",
+                       help="逐项分别运行各检查（默认多项检查合并为每个站点只遍历一次的完整检查）")
+    check.add_argument("--no-cache", action="store_true", help="不使用增量扫描缓存")
+    check.add_argument("--force-rescan", action="store_true", help="忽略缓存，重新扫描所有文件")
+    check.add_argument("--no-allowlist", action="store_true", help="不跳过白名单中的已知干净文件")
+    check.add_argument("--top-k", type=int, default=None,
+                       help="每个特征日志只保留命中次数最多的 N 个文件（默认全部）")
+    check.add_argument("--findings-jsonl", action="store_true",
+                       help="同时在站点日志目录写入 findings.jsonl")
+    check.add_argument("--history", action="store_true",
+                       help="把 JS 检查结果记录到历史数据库（默认 data/history.db）")
+    check.add_argument("--history-db", help="历史数据库文件（指定后自动启用 --history）")
+    check.add_argument("--max-size", type=float, default=None, metavar="MB",
+                       help="超过此大小（MB）的 JS/HTML 文件按 --size-policy 处理（默认不限制）")
+    check.add_argument("--size-policy", choices=("skip", "head-tail", "scan"), default="skip",
+                       help="超大文件的处理方式: skip 跳过，head-tail 只扫描首尾，scan 完整扫描（默认 skip）")
+    check.add_argument("--head-tail-kb", type=int, default=1024,
+                       help="head-tail 策略下首部和尾部各扫描的大小 KB（默认 1024）")
+    check.add_argument("--skip-binary", action="store_true",
+                       help="跳过开头含有 NUL 字节的二进制文件")
+    check.add_argument("--no-obfuscation-score", action="store_true",
+                       help="不计算混淆评分（熵、转义序列比例、符号比例、最长行）")
+    check.add_argument("--obfuscation-threshold", type=float, default=60,
+                       help="混淆评分不低于此值（0-100）的文件单独报告（默认 60）")
+    check.add_argument("--obfuscation-top", type=int, default=50,
+                       help="每个站点的 obfuscation_rank.txt 保留评分最高的 N 个文件（默认 50，0 为全部）")
+    check.add_argument("--read-ahead", type=int, default=0, metavar="N",
+                       help="单进程扫描（--jobs 1）时提前读取 N 个文件，读取与匹配重叠，适合 NFS 等慢速存储（默认 0 关闭）")
+    check.add_argument("--read-threads", type=int, default=8,
+                       help="预读使用的读取线程数，即同时进行的读取总数上限（默认 8）")
+    check.add_argument("--mount-limit", type=mount_limit, action="append", default=[], metavar="DIR=N",
+                       help="DIR 所在挂载点同时最多 N 个读取，可重复（如 /www/wwwroot=4）")
+    check.add_argument("--mount-default", type=int, default=None, metavar="N",
+                       help="未用 --mount-limit 指定的挂载点同时最多 N 个读取（默认只受 --read-threads 限制）")
+    check.add_argument("--profile-rules", action="store_true",
+                       help="在运行指标中记录每条 JS 规则的匹配耗时（每条规则单独再匹配一次，较慢）")
+    
+    history = subparsers.add_parser("history", parents=[common], help="查询历次检查结果的趋势和差异")
+    history.add_argument("query", choices=("runs", "sites", "trend", "diff"),
+                         help="runs: 最近的运行；sites: 命中某特征的站点；trend: 每次运行的命中数；diff: 两次运行的差异")
+    history.add_argument("--history-db", help="历史数据库文件（默认 data/history.db）")
+    history.add_argument("--pattern", help="特征名称，如 hex_string")
+    history.add_argument("--days", type=int, default=30, help="sites 查询的天数范围（默认 30）")
+    history.add_argument("--limit", type=int, default=20, help="runs/trend 返回的运行次数（默认 20）")
+    history.add_argument("--runs", type=int, nargs=2, metavar=("OLD", "NEW"),
+                         help="diff 比较的两次运行（默认最近两次）")
+    
+    watch = subparsers.add_parser("watch", parents=[common], help="实时监控站点目录，只检查新建或修改的文件")
+    watch.add_argument("--debounce", type=float, default=2.0,
+                       help="文件停止变化多少秒后再检查（默认 2）")
+    watch.add_argument("--duration", type=float, default=None,
+                       help="监控指定秒数后退出（默认一直运行，按 Ctrl+C 退出）")
+    
+    subparsers.add_parser("lock", parents=[common], help="锁定站点核心文件并记录锁定清单")
+    unlock = subparsers.add_parser("unlock", parents=[common], help="解锁站点文件（默认只解锁清单中的条目）")
+    unlock.add_argument("--full", action="store_true", help="忽略锁定清单，解锁站点内所有文件")
+    unlock.add_argument("--only", action="append", metavar="REL_PATH",
+                        help="只解锁站点内此相对路径下的条目，可重复指定")
+    subparsers.add_parser("relock", parents=[common], help="只锁定锁定清单之后新增或修改的文件")
+    
+    allowlist = subparsers.add_parser("allowlist-build", parents=[common],
+                                      help="从可信的干净安装目录生成/扩充已知干净文件白名单")
+    allowlist.add_argument("paths", nargs="+", metavar="CLEAN_DIR", help="干净的 MacCMS/依赖库目录")
+    allowlist.add_argument("--label", help="记录在白名单中的来源名称（默认目录名）")
+    allowlist.add_argument("--ext", action="append", help="要记录的文件扩展名，可重复（默认 .js .html .php）")
+    allowlist.add_argument("--output", help="白名单文件（默认 data/allowlist.json）")
+    
+    worker = subparsers.add_parser("worker", parents=[common],
+                                   help="作为多主机检查的工作进程，从 stdin/stdout 或 Unix 套接字接收检查请求")
+    worker.add_argument("--socket", metavar="PATH", help="监听此 Unix 套接字，而不是使用 stdin/stdout")
+    worker.add_argument("--once", action="store_true", help="与 --socket 一起使用，处理完一个连接后退出")
+    
+    coordinate = subparsers.add_parser("coordinate", parents=[common],
+                                       help="按主机清单在多台主机上运行检查并汇总结果")
+    coordinate.add_argument("fleet_file", metavar="FLEET_FILE", help="主机清单 JSON 文件")
+    coordinate.add_argument("--check-args", default="",
+                            help="传给每台主机 check 的参数，如 \"--checks js,php --jobs 4\"")
+    coordinate.add_argument("--report", metavar="FILE", help="把汇总报告（含每台主机的吞吐量）写入此 JSON 文件")
+    coordinate.add_argument("--parallel", type=int, default=0,
+                            help="同时检查的主机数（0 = 全部，默认 0）")
+    
+    return parser
+
+
+def run_batch(argv):
+    """Run a headless subcommand and return its exit code"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    if not args.command:
+        parser.print_help(sys.stderr)
+        return EXIT_USAGE
+    
+    if args.command == "check":
+        unknown = [name for name in args.checks if name not in CHECKS]
+        if unknown:
+            parser.error(f"未知的检查类型: {', '.join(unknown)}")
+    
+    if args.command == "worker":
+        # stdout carries frames only: keep the real one for the channel and
+        # point fd 1 at stderr, so nothing else can write into it
+        sys.stdout.flush()
+        channel = (sys.stdin.buffer, os.fdopen(os.dup(sys.stdout.fileno()), 'wb'))
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        runner = BatchRunner(args, ResultStream(sys.stderr))
+        runner.channel = channel
+        with contextlib.redirect_stdout(sys.stderr):
+            return runner.run()
+    
+    # Keep stdout for the JSON result stream, human output goes to stderr
+    stream = ResultStream(sys.stdout)
+    with contextlib.redirect_stdout(sys.stderr):
+        return BatchRunner(args, stream).run()
+
+
 def main():
     """Main entry point"""
+    if len(sys.argv) > 1:
+        try:
+            sys.exit(run_batch(sys.argv[1:]))
+        except KeyboardInterrupt:
+            sys.exit(130)
+    
     try:
         tool = MacCMSSecurityTool()
         tool.run()
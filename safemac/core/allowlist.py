@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Known-Good Allowlist
+SHA-256 database of clean release files (stock MacCMS, jQuery, layer, ...)
+"""
+
+import hashlib
+import json
+import os
+from ..utils import ensure_dir_exists, TreeWalker, join_rel
+
+
+ALLOWLIST_FORMAT = 1
+
+# File types recorded by default when building from a clean install
+DEFAULT_EXTENSIONS = ('.js', '.html', '.php')
+
+
+def sha256_file(file_path, block_size=1024 * 1024):
+    """Hash a file in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashAllowlist:
+    """Known-clean files indexed by size, then by SHA-256
+
+    The size index lets almost every file be rejected from its stat result
+    alone; only files whose size matches a known-clean file are hashed.
+    """
+
+    def __init__(self, allowlist_file):
+        self.allowlist_file = allowlist_file
+        # size -> {sha256: label}
+        self.by_size = {}
+
+    def load(self):
+        """Load the allowlist, leaving it empty if missing or unreadable"""
+        try:
+            with open(self.allowlist_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+
+        if data.get('format') == ALLOWLIST_FORMAT:
+            self.by_size = {int(size): dict(hashes) for size, hashes in data.get('files', {}).items()}
+        return self
+
+    def save(self):
+        """Write the allowlist atomically"""
+        ensure_dir_exists(os.path.dirname(self.allowlist_file))
+        tmp_file = f"{self.allowlist_file}.tmp"
+        files = {str(size): hashes for size, hashes in sorted(self.by_size.items())}
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'format': ALLOWLIST_FORMAT, 'algorithm': 'sha256', 'files': files},
+                      f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.allowlist_file)
+
+    def __len__(self):
+        return sum(len(hashes) for hashes in self.by_size.values())
+
+    def version(self):
+        """Stable digest of the allowlist contents"""
+        payload = json.dumps({str(size): sorted(hashes) for size, hashes in self.by_size.items()},
+                             sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def may_contain(self, size):
+        """Cheap pre-check: is there any known-clean file of this size?"""
+        return size in self.by_size
+
+    def lookup(self, file_path, size=None):
+        """Return the label of a known-clean file, or None"""
+        if size is None:
+            size = os.path.getsize(file_path)
+        hashes = self.by_size.get(size)
+        if not hashes:
+            return None
+        return hashes.get(sha256_file(file_path))
+
+    def lookup_content(self, content):
+        """Return the label of known-clean file bytes already in memory, or None"""
+        hashes = self.by_size.get(len(content))
+        if not hashes:
+            return None
+        return hashes.get(hashlib.sha256(content).hexdigest())
+
+    def add_file(self, file_path, label):
+        """Record a file as known-clean, returns True if it was new"""
+        size = os.path.getsize(file_path)
+        digest = sha256_file(file_path)
+        hashes = self.by_size.setdefault(size, {})
+        if digest in hashes:
+            return False
+        hashes[digest] = label
+        return True
+
+    def add_tree(self, root, label=None, extensions=DEFAULT_EXTENSIONS):
+        """Record every matching file under a trusted clean install
+
+        Returns (added, seen). Labels default to "<root name>:<rel path>".
+        """
+        label = label or os.path.basename(os.path.abspath(root))
+        added = 0
+        seen = 0
+        for listing in TreeWalker().walk(root):
+            for entry in listing.files:
+                if not entry.name.endswith(tuple(extensions)) or not entry.is_file(follow_symlinks=False):
+                    continue
+                seen += 1
+                if self.add_file(entry.path, f"{label}:{join_rel(listing.rel_path, entry.name)}"):
+                    added += 1
+        return added, seen
@@ -2,15 +2,70 @@
 #!/usr/bin/env python3
 """
 MacCMS File Locker
-Manages file locking/unlocking using chattr +i/-i attributes
+Manages file locking/unlocking using the immutable (chattr +i/-i) attribute
 """
 
 import os
-import subprocess
 import sys
-import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from ..utils import Colors, print_colored, print_header, confirm_action, get_script_dir, read_site_list
+from .immutable import ImmutableFlagEngine, FlagResult
+from .lock_manifest import LockManifest
+from ..utils import (Colors, print_colored, print_header, confirm_action, get_script_dir, read_site_list,
+                     TreeWalker, join_rel, Metrics)
+
+
+class SiteLockResult:
+    """Outcome of locking or unlocking one site
+
+    groups maps each lock/exclude rule to its FlagResult; elapsed is the
+    wall time from the first work unit starting to the last one finishing.
+    Truthy when the operation succeeded, like the old bool return value.
+    """
+    
+    def __init__(self, site, operation):
+        self.site = site
+        self.operation = operation
+        self.groups = {}
+        self.units = 0
+        self.error = None
+        self.manifest = None
+        self.manifest_used = False
+        # (rel_path, size, mtime_ns, ctime_ns, immutable) for every entry
+        # left in the requested state, used to update the lock manifest
+        self.entries = []
+        self.started = None
+        self.finished = None
+    
+    @property
+    def elapsed(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+    
+    @property
+    def ok(self):
+        return self.error is None and all(result.ok for result in self.groups.values())
+    
+    def __bool__(self):
+        return self.ok
+    
+    def total(self):
+        """Counts over every group merged into one FlagResult"""
+        total = FlagResult()
+        for result in self.groups.values():
+            total.merge(result)
+        return total
+    
+    def add_unit(self, results, started, finished, entries=()):
+        """Merge the per-group results of one finished work unit"""
+        for group, result in results.items():
+            self.groups.setdefault(group, FlagResult()).merge(result)
+        self.entries.extend(entries)
+        self.units += 1
+        self.started = started if self.started is None else min(self.started, started)
+        self.finished = finished if self.finished is None else max(self.finished, finished)
 
 
 class MacCMSFileLocker:
@@ -50,88 +105,322 @@ class MacCMSFileLocker:
             "public/static/upload",
             ".well-known"  # SSL certificate verification directory
         ]
+        
+        # Sets/clears FS_IMMUTABLE_FL in-process via ioctl
+        self.flag_engine = ImmutableFlagEngine()
+        
+        # Worker pool for lock/unlock. Each site is split into work units:
+        # one per directory at depth shard_depth (e.g. vendor/topthink) plus
+        # one for everything above that depth
+        self.max_workers = min(32, (os.cpu_count() or 1) * 4)
+        self.shard_depth = 2
+        
+        # Lock manifests: lock records what it locked, unlock only touches
+        # recorded entries (optionally only those under unlock_only) and
+        # relock only locks entries that are new or changed since
+        self.manifest_dir = os.path.join(self.data_dir, "lock_manifest")
+        self.use_manifest = True
+        self.unlock_only = None
+        self.manifest_chunk_size = 2000
+        
+        # Run timers and flag operation counters, collected when enabled
+        self.metrics = Metrics()
     
     def check_chattr_support(self):
-        """Check if chattr command is available"""
-        try:
-            # Test chattr with no arguments - shows usage in stderr, exit code 1 is expected
-            result = subprocess.run(['chattr'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            # chattr shows usage when run without arguments
-            return b'Usage:' in result.stderr or b'usage:' in result.stderr
-        except FileNotFoundError:
-            return False
-        except Exception:
-            return False
+        """Check if the immutable attribute ioctls are available"""
+        return self.flag_engine.is_available()
+    
+    def _match_rule(self, rel_path, rules):
+        """Return the longest rule that rel_path equals or lies under"""
+        best = None
+        for rule in rules:
+            if rel_path == rule or rel_path.startswith(rule + '/'):
+                if best is None or len(rule) > len(best):
+                    best = rule
+        return best
+    
+    def _is_route_dir(self, rel_path):
+        """Check whether a directory leads to a lock or exclude directory"""
+        prefix = rel_path + '/'
+        return any(rule.startswith(prefix) for rule in self.lock_dirs + self.exclude_dirs)
+    
+    def _plan_lock_entry(self, rel_path, is_dir):
+        """Decide what lock_site does with an entry: (group, immutable) or None"""
+        if not rel_path:
+            return None
+        
+        writable_rule = self._match_rule(rel_path, self.exclude_dirs)
+        if writable_rule is not None:
+            return writable_rule, False
+        
+        lock_rule = self._match_rule(rel_path, self.lock_dirs)
+        if lock_rule is not None:
+            return lock_rule, True
+        
+        # PHP files in the site root
+        if not is_dir and '/' not in rel_path and rel_path.endswith('.php'):
+            return '*.php', True
+        return None
     
-    def execute_shell_command(self, command):
-        """Execute a shell command and return True if successful"""
+    def _descend_for_lock(self, rel_path):
+        """Only enter directories that are, or lead to, lock/exclude targets"""
+        return (self._match_rule(rel_path, self.lock_dirs + self.exclude_dirs) is not None
+                or self._is_route_dir(rel_path))
+    
+    def _report_errors(self, result):
+        """Print the first few per-file errors of a FlagResult"""
+        for error in result.errors:
+            print_colored(f"      {error}", Colors.RED)
+    
+    def _operation_plan(self, operation):
+        """Return (decide, descend) callbacks for apply_tree"""
+        if operation in ('lock', 'relock'):
+            return self._plan_lock_entry, self._descend_for_lock
+        # Unlock clears the flag on every directory and file, root included
+        return (lambda rel_path, is_dir: ('all', False)), (lambda rel_path: True)
+    
+    def plan_site_units(self, site_path, operation, manifest=None):
+        """Split a site into work units
+
+        Tree units are subtree rel paths: '' for everything above
+        shard_depth and one per directory at shard_depth. An unlock driven
+        by a manifest instead gets ('paths', [rel_path, ...]) chunks of the
+        recorded entries, so nothing else in the site is visited.
+        """
+        if operation == 'unlock' and manifest is not None:
+            paths = manifest.locked_paths(self.unlock_only)
+            return [('paths', paths[i:i + self.manifest_chunk_size])
+                    for i in range(0, len(paths), self.manifest_chunk_size)]
+        
+        _, descend = self._operation_plan(operation)
+        units = ['']
+        if self.shard_depth < 1:
+            return units
+        
+        for listing in TreeWalker(max_depth=self.shard_depth - 1).walk(site_path):
+            listing.dirs[:] = [entry for entry in listing.dirs
+                               if descend(join_rel(listing.rel_path, entry.name))]
+            if listing.depth == self.shard_depth - 1:
+                units.extend(join_rel(listing.rel_path, entry.name) for entry in listing.dirs)
+        return units
+    
+    def run_site_unit(self, site_path, operation, unit, manifest=None):
+        """Apply the operation to one work unit
+
+        Returns (results, started, finished, entries) as taken by
+        SiteLockResult.add_unit.
+        """
+        decide, descend = self._operation_plan(operation)
+        started = time.time()
+        entries = []
+        
+        if isinstance(unit, tuple):
+            # Manifest-driven unlock of an explicit list of entries
+            def record_path(path, st):
+                entries.append((os.path.relpath(path, site_path), st.st_size, st.st_mtime_ns, st.st_ctime_ns, False))
+            
+            result = self.flag_engine.apply_paths([os.path.join(site_path, rel_path) for rel_path in unit[1]],
+                                                  False, record=record_path)
+            return {'all': result}, started, time.time(), entries
+        
+        prefix = unit
+        
+        def site_rel(rel_path):
+            return join_rel(prefix, rel_path) if prefix and rel_path else (prefix or rel_path)
+        
+        def record(group, rel_path, st, immutable):
+            entries.append((site_rel(rel_path), st.st_size, st.st_mtime_ns, st.st_ctime_ns, immutable))
+        
+        skip = None
+        if operation == 'relock' and manifest is not None and self.use_manifest:
+            def skip(rel_path, st):
+                return manifest.is_unchanged_lock(site_rel(rel_path), st)
+        
+        if unit == '':
+            # Stop at shard_depth, those directories are units of their own
+            shard_depth = self.shard_depth
+            
+            def unit_descend(rel_path):
+                if shard_depth >= 1 and rel_path.count('/') + 1 >= shard_depth:
+                    return False
+                return descend(rel_path)
+            
+            results = self.flag_engine.apply_tree(site_path, decide, descend=unit_descend,
+                                                  skip=skip, record=record)
+        else:
+            results = self.flag_engine.apply_tree(
+                os.path.join(site_path, unit),
+                lambda rel_path, is_dir: decide(site_rel(rel_path), is_dir),
+                descend=lambda rel_path: descend(site_rel(rel_path)),
+                skip=skip, record=record)
+        
+        return results, started, time.time(), entries
+    
+    def _load_manifest(self, site_path, operation):
+        """Load the site's lock manifest
+
+        It is loaded even when use_manifest is off, so a full unlock still
+        records that nothing is locked any more.
+        """
+        manifest = LockManifest(self.manifest_dir, site_path)
+        if operation in ('unlock', 'relock') and not manifest.exists():
+            return None
+        with self.metrics.time('phase', phase='manifest_load'):
+            return manifest.load()
+    
+    def _finish_site(self, site_result):
+        """Update the lock manifest once every unit of a site has finished"""
+        self._record_metrics(site_result)
+        manifest = site_result.manifest
+        if manifest is None or site_result.error is not None:
+            return
+        
+        if site_result.operation in ('lock', 'relock'):
+            manifest.replace_locked((rel_path, size, mtime_ns, ctime_ns)
+                                    for rel_path, size, mtime_ns, ctime_ns, immutable in site_result.entries
+                                    if immutable)
+        elif site_result.manifest_used:
+            manifest.mark_unlocked(entry[0] for entry in site_result.entries)
+        else:
+            manifest.mark_all_unlocked()
+        
         try:
-            # 使用 universal_newlines 而不是 text 参数（Python 3.6.8 兼容）
-            subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          universal_newlines=True, check=True, shell=True)
-            return True
-        except subprocess.CalledProcessError:
-            return False
-        except Exception as e:
-            print_colored(f"    执行命令出错: {str(e)}", Colors.RED)
-            return False
+            with self.metrics.time('phase', phase='manifest_save'):
+                manifest.save()
+        except OSError as e:
+            print_colored(f"    保存锁定清单失败: {e}", Colors.YELLOW)
     
-    def lock_site(self, site_path):
-        """Lock core files and directories for a MacCMS site"""
-        site_dir = Path(site_path)
+    def _record_metrics(self, site_result):
+        """Count a finished site's flag operations and apply time"""
+        metrics = self.metrics
+        if not metrics.enabled:
+            return
+        operation = site_result.operation
+        metrics.incr('sites', operation=operation, result='ok' if site_result.ok else 'failed')
+        if site_result.units:
+            metrics.add_time('phase', site_result.elapsed, phase=operation)
+        total = site_result.total()
+        metrics.incr('flag_operations', total.changed, operation=operation, result='changed')
+        metrics.incr('flag_operations', total.skipped, operation=operation, result='unchanged')
+        metrics.incr('flag_operations', total.failed, operation=operation, result='failed')
+    
+    def _start_site(self, site_path, operation):
+        """Check a site and plan its work units, returns (SiteLockResult, units)"""
+        site_result = self._check_site(site_path, operation)
+        if site_result.error is not None:
+            return site_result, []
         
-        if not site_dir.exists():
-            print_colored(f"站点目录不存在: {site_path}", Colors.RED)
-            return False
+        manifest = self._load_manifest(site_path, operation)
+        site_result.manifest = manifest
+        with self.metrics.time('phase', phase='plan'):
+            if operation == 'unlock' and manifest is not None and self.use_manifest:
+                site_result.manifest_used = True
+                return site_result, self.plan_site_units(site_path, operation, manifest)
+            return site_result, self.plan_site_units(site_path, operation)
+    
+    def _check_site(self, site_path, operation):
+        """Return a SiteLockResult with error set if the site cannot be processed"""
+        result = SiteLockResult(site_path, operation)
+        if not os.path.isdir(site_path):
+            result.error = f"站点目录不存在: {site_path}"
+        elif not self.flag_engine.is_supported(site_path):
+            result.error = f"文件系统不支持 chattr 属性，跳过: {site_path}"
+        return result
+    
+    def process_site(self, site_path, operation):
+        """Lock, relock or unlock one site unit by unit in the calling thread"""
+        result, units = self._start_site(site_path, operation)
+        for unit in units:
+            result.add_unit(*self.run_site_unit(site_path, operation, unit, result.manifest))
+        self._finish_site(result)
+        self.report_site(result)
+        return result
+    
+    def report_site(self, site_result):
+        """Print the outcome of locking or unlocking a site"""
+        if site_result.error is not None:
+            print_colored(site_result.error, Colors.RED)
+            return
+        
+        if site_result.operation in ('lock', 'relock'):
+            self._report_lock(site_result)
+        else:
+            self._report_unlock(site_result)
+        print_colored(f"  用时 {site_result.elapsed:.2f} 秒（{site_result.units} 个工作单元）", Colors.BLUE)
+    
+    def _report_lock(self, site_result):
+        site_path = site_result.site
+        results = site_result.groups
         
         print_colored(f"处理站点: {site_path}", Colors.YELLOW)
-        print_colored("  正在锁定核心文件和目录（chattr +i）...", Colors.YELLOW)
+        if site_result.operation == 'relock':
+            print_colored("  正在重新锁定新增或修改的文件（chattr +i，跳过清单中未变化的条目）...", Colors.YELLOW)
+        else:
+            print_colored("  正在锁定核心文件和目录（chattr +i）...", Colors.YELLOW)
         
         # Lock core directories
         for dir_name in self.lock_dirs:
-            target_dir = site_dir / dir_name
-            if target_dir.exists():
-                cmd = f"find {target_dir} -type f -o -type d | xargs chattr +i 2>/dev/null"
-                if self.execute_shell_command(cmd):
-                    print_colored(f"    已锁定: {dir_name} 目录及其所有内容", Colors.GREEN)
+            if dir_name in results:
+                result = results[dir_name]
+                if result.ok:
+                    print_colored(f"    已锁定: {dir_name} 目录及其所有内容 ({result.summary()})", Colors.GREEN)
                 else:
-                    print_colored(f"    锁定失败: {dir_name}", Colors.RED)
+                    print_colored(f"    锁定失败: {dir_name} ({result.summary()})", Colors.RED)
+                    self._report_errors(result)
         
         # Lock PHP files in root directory
-        for pattern in self.lock_files:
-            if pattern == "*.php":
-                cmd = f"find {site_dir} -maxdepth 1 -name '*.php' | xargs chattr +i 2>/dev/null"
-                self.execute_shell_command(cmd)
-                print_colored(f"    已锁定: 根目录PHP文件", Colors.GREEN)
-            else:
-                file_path = site_dir / pattern
-                if file_path.exists():
-                    cmd = f"chattr +i {file_path} 2>/dev/null"
-                    if self.execute_shell_command(cmd):
-                        print_colored(f"    已锁定: {pattern}", Colors.GREEN)
+        result = results.get('*.php', FlagResult())
+        if result.ok:
+            print_colored(f"    已锁定: 根目录PHP文件 ({result.summary()})", Colors.GREEN)
+        else:
+            print_colored(f"    锁定失败: 根目录PHP文件 ({result.summary()})", Colors.RED)
+            self._report_errors(result)
 
         # Ensure exclude directories are unlocked
         for exclude_dir in self.exclude_dirs:
-            target_dir = site_dir / exclude_dir
-            if target_dir.exists():
-                cmd = f"find {target_dir} -type f -o -type d | xargs chattr -i 2>/dev/null"
-                if self.execute_shell_command(cmd):
+            if exclude_dir in results:
+                result = results[exclude_dir]
+                if result.ok:
                     print_colored(f"    保持可写: {exclude_dir}", Colors.BLUE)
                     
                     # Special handling for .well-known directory
                     if exclude_dir == ".well-known":
-                        self._configure_well_known_security(target_dir)
+                        self._configure_well_known_security(Path(site_path) / exclude_dir)
+                else:
+                    print_colored(f"    解锁失败: {exclude_dir} ({result.summary()})", Colors.RED)
+                    self._report_errors(result)
         
-        return True
+        if None in results:
+            print_colored(f"    部分目录无法读取 ({results[None].failed} 个)", Colors.RED)
+            self._report_errors(results[None])
+    
+    def _report_unlock(self, site_result):
+        print_colored(f"处理站点: {site_result.site}", Colors.YELLOW)
+        if site_result.manifest_used:
+            print_colored("  正在解锁锁定清单中记录的文件和目录（chattr -i）...", Colors.YELLOW)
+        else:
+            print_colored("  正在解锁所有文件和目录（chattr -i）...", Colors.YELLOW)
+        
+        result = site_result.total()
+        if result.ok and site_result.manifest_used:
+            print_colored(f"    已解锁清单中的文件和目录 ({result.summary()})", Colors.GREEN)
+        elif result.ok:
+            print_colored(f"    已解锁所有文件和目录 ({result.summary()})", Colors.GREEN)
+        else:
+            print_colored(f"    解锁过程中出现一些错误 ({result.summary()})", Colors.YELLOW)
+            self._report_errors(result)
+    
+    def lock_site(self, site_path):
+        """Lock core files and directories for a MacCMS site"""
+        return self.process_site(site_path, 'lock').ok
     
-    def _configure_well_known_security(self, well_known_dir):
+    def _configure_well_known_security(self, well_known_dir, php_files=None):
         """Configure security for .well-known directory"""
         # Check for PHP files in .well-known directory and warn about them
-        php_files = []
-        for root, dirs, files in os.walk(well_known_dir):
-            for file in files:
-                if file.endswith('.php'):
-                    php_files.append(os.path.join(root, file))
+        if php_files is None:
+            php_files = []
+            for listing in TreeWalker().walk(well_known_dir):
+                php_files.extend(entry.path for entry in listing.files if entry.name.endswith('.php'))
         
         if php_files:
             print_colored(f"    警告: 发现 .well-known 目录中有 PHP 文件:", Colors.RED)
@@ -163,23 +452,11 @@ if ( $uri ~ "^/\\.well-known/.*\\.(php|jsp|py|js|css|lua|ts|go|zip|tar\\.gz|rar|
     
     def unlock_site(self, site_path):
         """Unlock all files and directories for a MacCMS site"""
-        site_dir = Path(site_path)
-        
-        if not site_dir.exists():
-            print_colored(f"站点目录不存在: {site_path}", Colors.RED)
-            return False
-        
-        print_colored(f"处理站点: {site_path}", Colors.YELLOW)
-        print_colored("  正在解锁所有文件和目录（chattr -i）...", Colors.YELLOW)
-        
-        # Simple one-line command to recursively unlock all files and directories
-        cmd = f"find {site_dir} -type f -o -type d | xargs chattr -i 2>/dev/null"
-        if self.execute_shell_command(cmd):
-            print_colored("    已解锁所有文件和目录", Colors.GREEN)
-        else:
-            print_colored("    解锁过程中出现一些错误", Colors.YELLOW)
-        
-        return True
+        return self.process_site(site_path, 'unlock').ok
+    
+    def relock_site(self, site_path):
+        """Lock only files that are new or changed since the manifest was written"""
+        return self.process_site(site_path, 'relock').ok
     
     def select_sites(self, sites):
         """Allow user to select which sites to operate on"""
@@ -213,21 +490,49 @@ if ( $uri ~ "^/\\.well-known/.*\\.(php|jsp|py|js|css|lua|ts|go|zip|tar\\.gz|rar|
             print_colored("\n操作已取消", Colors.YELLOW)
             return []
     
-    def process_sites_in_parallel(self, sites, operation):
-        """Process multiple sites in parallel using threads"""
-        threads = []
-
-        for site in sites:
-            if operation == 'lock':
-                thread = threading.Thread(target=self.lock_site, args=(site,))
-            else:  # unlock
-                thread = threading.Thread(target=self.unlock_site, args=(site,))
-            threads.append(thread)
-            thread.start()
+    def process_sites_in_parallel(self, sites, operation, max_workers=None):
+        """Process multiple sites on a bounded worker pool
 
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
+        Every site is split into work units (see plan_site_units) and all
+        units share one pool of at most max_workers threads, so a single
+        huge site is spread across workers too. A site's report is printed
+        as soon as its last unit finishes. Returns a dict mapping each site
+        to its SiteLockResult.
+        """
+        site_results = {}
+        pending = {}
+        workers = max_workers if max_workers and max_workers > 0 else self.max_workers
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for site in sites:
+                site_result, units = self._start_site(site, operation)
+                site_results[site] = site_result
+                if site_result.error is not None or not units:
+                    self._finish_site(site_result)
+                    self.report_site(site_result)
+                    continue
+                
+                pending[site] = len(units)
+                for unit in units:
+                    future = executor.submit(self.run_site_unit, site, operation, unit,
+                                             site_result.manifest)
+                    futures[future] = site
+            
+            for future in as_completed(futures):
+                site = futures[future]
+                site_result = site_results[site]
+                try:
+                    site_result.add_unit(*future.result())
+                except Exception as e:
+                    site_result.error = f"处理站点出错 {site}: {e}"
+                
+                pending[site] -= 1
+                if pending[site] == 0:
+                    self._finish_site(site_result)
+                    self.report_site(site_result)
+        
+        return site_results
 
     def lock_sites(self):
         """Interactive site locking"""
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Findings Writer
+Collects suspicious-file hits in memory and writes each site's logs once
+"""
+
+import heapq
+import json
+import os
+from ..utils import ensure_dir_exists
+
+
+class FindingsWriter:
+    """In-memory findings for one site, written in a single pass
+
+    Hits are kept per pattern, highest count first (files with the same
+    count stay in scan order). With top_k set only the top_k files of each
+    pattern are kept, through a bounded heap, so memory stays flat on
+    heavily infected sites. write() creates one "<pattern>.txt" file per
+    pattern with at least one hit and, with jsonl=True, a findings.jsonl
+    file holding one record per suspicious file. Files skipped or only
+    partly scanned by the size policy are listed in scan_decisions.txt
+    (and in findings.jsonl). Obfuscation scores added with add_score are
+    ranked in obfuscation_rank.txt, highest first, keeping the score_top
+    best through the same kind of bounded heap.
+    """
+
+    jsonl_name = "findings.jsonl"
+    decisions_name = "scan_decisions.txt"
+    rank_name = "obfuscation_rank.txt"
+
+    def __init__(self, site_log_dir, pattern_names, top_k=None, jsonl=False, score_top=None):
+        self.site_log_dir = site_log_dir
+        self.pattern_names = list(pattern_names)
+        self.top_k = top_k if top_k and top_k > 0 else None
+        self.jsonl = jsonl
+        # pattern -> list of (hits, -sequence, line); a min-heap when top_k is set
+        self.by_pattern = {name: [] for name in self.pattern_names}
+        self.records = []
+        # (file_path, decision) for files not scanned in full
+        self.decisions = []
+        # min-heap of (score, -sequence, line), at most score_top entries
+        self.score_top = score_top if score_top and score_top > 0 else None
+        self.scores = []
+        self._sequence = 0
+
+    def add_decision(self, file_path, decision):
+        """Record that a file was skipped or partly scanned, and why"""
+        self.decisions.append((str(file_path), decision))
+        if self.jsonl:
+            self.records.append({'file': str(file_path), 'decision': decision})
+
+    def add_score(self, file_path, stats):
+        """Record a file's obfuscation stats for the site's ranking"""
+        self._sequence += 1
+        entry = (stats['score'], -self._sequence,
+                 f"{stats['score']:5.1f} entropy={stats['entropy']:.2f} escapes={stats['escape_ratio']:.3f} "
+                 f"symbols={stats['symbol_ratio']:.3f} longest_line={stats['longest_line']}: {file_path}\n")
+        if self.score_top is None:
+            self.scores.append(entry)
+        elif len(self.scores) < self.score_top:
+            heapq.heappush(self.scores, entry)
+        else:
+            heapq.heappushpop(self.scores, entry)
+
+    def add(self, file_path, pattern_hits, stats=None):
+        """Record one suspicious file and its per-pattern hit counts"""
+        self._sequence += 1
+        name = os.path.basename(str(file_path))
+
+        for pattern_name, hits in pattern_hits.items():
+            if hits <= 0:
+                continue
+            entry = (hits, -self._sequence, f"{hits} {name}: {file_path}\n")
+            entries = self.by_pattern.setdefault(pattern_name, [])
+            if self.top_k is None:
+                entries.append(entry)
+            elif len(entries) < self.top_k:
+                heapq.heappush(entries, entry)
+            else:
+                heapq.heappushpop(entries, entry)
+
+        if self.jsonl:
+            record = {'file': str(file_path), 'hits': dict(pattern_hits)}
+            if stats is not None:
+                record['stats'] = stats
+            self.records.append(record)
+
+    def lines(self, pattern_name):
+        """Log lines for a pattern, highest hit count first"""
+        entries = sorted(self.by_pattern.get(pattern_name, ()), reverse=True)
+        return [line for _, _, line in entries]
+
+    def write(self):
+        """Write every non-empty pattern log (and the JSONL file) once"""
+        ensure_dir_exists(self.site_log_dir)
+        written = []
+
+        for pattern_name in self.by_pattern:
+            lines = self.lines(pattern_name)
+            if not lines:
+                continue
+            log_file = os.path.join(self.site_log_dir, f"{pattern_name}.txt")
+            with open(log_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            written.append(log_file)
+
+        if self.decisions:
+            decisions_file = os.path.join(self.site_log_dir, self.decisions_name)
+            with open(decisions_file, 'w', encoding='utf-8') as f:
+                f.writelines(f"{decision}: {file_path}\n" for file_path, decision in self.decisions)
+            written.append(decisions_file)
+
+        if self.scores:
+            rank_file = os.path.join(self.site_log_dir, self.rank_name)
+            with open(rank_file, 'w', encoding='utf-8') as f:
+                f.writelines(line for _, _, line in sorted(self.scores, reverse=True))
+            written.append(rank_file)
+
+        if self.jsonl and self.records:
+            jsonl_file = os.path.join(self.site_log_dir, self.jsonl_name)
+            with open(jsonl_file, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in self.records)
+            written.append(jsonl_file)
+
+        return written
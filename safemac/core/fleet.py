@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Fleet Coordinator
+Runs checks on many hosts through workers that speak the frame protocol
+"""
+
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .. import __version__
+from ..utils import (Colors, print_colored, print_header, read_site_file,
+                     PROTOCOL_VERSION, FrameError, FrameEventStream, read_frame, write_frame)
+
+
+class FleetError(Exception):
+    """The fleet file is missing or invalid"""
+
+
+def load_fleet(fleet_file):
+    """Load a fleet file, returns (hosts, check_args)
+
+    Every host is a dict with a unique "name" and either "command" (argv
+    list or shell-style string starting a worker, e.g. over ssh) or
+    "socket" (path of a worker's Unix socket). "sites" lists the sites to
+    check, or "sites_file" names a site list relative to the fleet file;
+    with neither the worker uses its own site list. "check_args" holds
+    extra "check" options, both per host and for the whole fleet.
+    """
+    try:
+        with open(fleet_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise FleetError(f"无法读取主机清单 {fleet_file}: {e}")
+
+    if not isinstance(data, dict) or not isinstance(data.get('hosts'), list) or not data['hosts']:
+        raise FleetError("主机清单需要非空的 hosts 列表")
+
+    base_dir = os.path.dirname(os.path.abspath(fleet_file))
+    hosts = []
+    names = set()
+    for index, entry in enumerate(data['hosts']):
+        if not isinstance(entry, dict):
+            raise FleetError(f"第 {index + 1} 个主机不是对象")
+        name = entry.get('name')
+        if not isinstance(name, str) or not name or name in names:
+            raise FleetError(f"第 {index + 1} 个主机缺少 name 或与其他主机重名")
+        names.add(name)
+        if ('command' in entry) == ('socket' in entry):
+            raise FleetError(f"主机 {name}: command 和 socket 必须且只能指定一个")
+
+        host = {'name': name, 'sites': None, 'check_args': as_args(entry.get('check_args'), name)}
+        if 'command' in entry:
+            host['command'] = as_args(entry['command'], name)
+            if not host['command']:
+                raise FleetError(f"主机 {name}: command 为空")
+        else:
+            host['socket'] = entry['socket']
+
+        if 'sites' in entry:
+            if not isinstance(entry['sites'], list):
+                raise FleetError(f"主机 {name}: sites 应为列表")
+            host['sites'] = [str(site) for site in entry['sites'] if str(site).strip()]
+        elif 'sites_file' in entry:
+            sites_file = os.path.join(base_dir, entry['sites_file'])
+            if not os.path.isfile(sites_file):
+                raise FleetError(f"主机 {name}: 站点列表不存在 {sites_file}")
+            host['sites'] = read_site_file(sites_file)
+        hosts.append(host)
+
+    return hosts, as_args(data.get('check_args'), "check_args")
+
+
+def as_args(value, owner):
+    """Normalise an argv given as a list or a shell-style string"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return shlex.split(value)
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    raise FleetError(f"{owner}: 参数应为列表或字符串")
+
+
+class FleetWorker:
+    """Serves check requests from a coordinator over the frame protocol
+
+    run_check(check_args, sites, events) runs one "check" request (sites
+    None meaning the worker's own site list), sending its result events
+    through events, and returns the extra fields of the "done" frame:
+    exit_code, sites and metrics.
+
+    Messages from the coordinator:
+      {"type": "check", "id": ..., "args": [...], "sites": [...] or null}
+      {"type": "bye"}
+    Messages to the coordinator:
+      {"type": "hello", "protocol": ..., "host": ..., "pid": ..., "version": ...}
+      {"type": "event", "id": ..., "event": {...}}   one per result event
+      {"type": "done", "id": ..., "exit_code": ..., "elapsed": ..., ...}
+      {"type": "error", "id": ..., "message": ...}
+    """
+
+    def __init__(self, run_check):
+        self.run_check = run_check
+
+    def hello(self):
+        return {'type': 'hello', 'protocol': PROTOCOL_VERSION, 'host': socket.gethostname(),
+                'pid': os.getpid(), 'version': __version__}
+
+    def serve(self, reader, writer):
+        """Answer requests until "bye" or end of stream; False on a broken stream"""
+        write_frame(writer, self.hello())
+        while True:
+            try:
+                message = read_frame(reader)
+            except FrameError as e:
+                print_colored(f"协调端数据无效: {e}", Colors.RED)
+                return False
+            if message is None or message.get('type') == 'bye':
+                return True
+            if message.get('type') == 'check':
+                self.handle_check(message, writer)
+            else:
+                write_frame(writer, {'type': 'error', 'id': message.get('id'),
+                                     'message': f"unknown message type: {message.get('type')}"})
+
+    def handle_check(self, message, writer):
+        request_id = message.get('id')
+        events = FrameEventStream(writer, request_id)
+        started = time.time()
+        try:
+            result = self.run_check(message.get('args') or [], message.get('sites'), events)
+        except Exception as e:
+            result = {'exit_code': None, 'error': str(e)}
+        done = {'type': 'done', 'id': request_id, 'elapsed': round(time.time() - started, 3)}
+        done.update(result)
+        write_frame(writer, done)
+
+    def serve_socket(self, path, once=False):
+        """Serve coordinators connecting to a Unix socket, one at a time"""
+        if os.path.exists(path):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        ok = True
+        try:
+            server.bind(path)
+            os.chmod(path, 0o600)
+            server.listen(1)
+            print_colored(f"等待协调端连接: {path}", Colors.BLUE)
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    reader = conn.makefile('rb')
+                    writer = conn.makefile('wb')
+                    try:
+                        ok = self.serve(reader, writer)
+                    except OSError as e:
+                        print_colored(f"协调端连接中断: {e}", Colors.YELLOW)
+                        ok = False
+                    finally:
+                        reader.close()
+                        try:
+                            writer.close()
+                        except OSError:
+                            pass
+                if once:
+                    return ok
+        finally:
+            server.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class HostReport:
+    """Outcome of one host's check run, with its throughput
+
+    elapsed is the coordinator's wall time for the host (connecting
+    included), worker_elapsed the worker's own time for the check, which
+    the rates are based on. files counts the files listed for checking
+    and bytes the bytes actually read (cache hits read nothing).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.remote_host = None
+        self.exit_code = None
+        self.error = None
+        self.sites = 0
+        self.events = {}
+        self.metrics = None
+        self.elapsed = 0.0
+        self.worker_elapsed = 0.0
+
+    @property
+    def ok(self):
+        # Exit codes 0 and 1: completed, without or with findings
+        return self.error is None and self.exit_code in (0, 1)
+
+    def counter(self, name):
+        """Total of a worker counter over all its labels"""
+        if not self.metrics:
+            return 0
+        return sum(counter['value'] for counter in self.metrics.get('counters', ()) if counter['name'] == name)
+
+    def to_dict(self):
+        files = self.counter('files_listed')
+        size = self.counter('bytes_read')
+        seconds = self.worker_elapsed
+        return {
+            'host': self.name,
+            'remote_host': self.remote_host,
+            'ok': self.ok,
+            'exit_code': self.exit_code,
+            'error': self.error,
+            'sites': self.sites,
+            'files': files,
+            'bytes': size,
+            'findings': self.events.get('finding', 0),
+            'errors': self.events.get('error', 0),
+            'elapsed': round(self.elapsed, 3),
+            'worker_elapsed': round(seconds, 3),
+            'files_per_s': round(files / seconds, 1) if seconds else None,
+            'mb_per_s': round(size / 1048576 / seconds, 2) if seconds else None,
+        }
+
+
+class FleetCoordinator:
+    """Sends check requests to the workers of many hosts and merges the results
+
+    Each host gets one thread: its worker is started (or its socket
+    connected), sent one "check" request and its event frames are re-emitted
+    on the coordinator's result stream with a "host" field, as they arrive.
+    A worker's stderr is passed through line by line, prefixed with the
+    host name. Worker metrics are merged into the coordinator's metrics
+    with a host label. run() returns one HostReport per host.
+    """
+
+    def __init__(self, hosts, check_args=(), stream=None, metrics=None, parallel=0):
+        self.hosts = hosts
+        self.check_args = list(check_args)
+        self.stream = stream
+        self.metrics = metrics
+        self.parallel = parallel
+        # Seconds to wait for a worker process to exit after "bye"
+        self.exit_timeout = 30
+        self._print_lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        if self.stream is not None:
+            self.stream.emit(event, **fields)
+
+    def connect(self, host):
+        """Open a host's worker, returns (reader, writer, close)"""
+        if 'socket' in host:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(host['socket'])
+            except OSError:
+                conn.close()
+                raise
+            reader = conn.makefile('rb')
+            writer = conn.makefile('wb')
+
+            def close():
+                for stream in (writer, reader):
+                    try:
+                        stream.close()
+                    except OSError:
+                        pass
+                conn.close()
+            return reader, writer, close
+
+        proc = subprocess.Popen(host['command'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        pump = threading.Thread(target=self.pass_stderr, args=(host['name'], proc.stderr), daemon=True)
+        pump.start()
+
+        def close():
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            try:
+                proc.wait(timeout=self.exit_timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            pump.join()
+        return proc.stdout, proc.stdin, close
+
+    def pass_stderr(self, name, stream):
+        """Copy a worker's stderr to ours, one prefixed line at a time"""
+        for line in iter(stream.readline, b''):
+            text = line.decode('utf-8', 'replace').rstrip('\n')
+            with self._print_lock:
+                sys.stderr.write(f"[{name}] {text}\n")
+                sys.stderr.flush()
+        stream.close()
+
+    def run_host(self, host):
+        """Run the check on one host, returns its HostReport"""
+        report = HostReport(host['name'])
+        started = time.perf_counter()
+        close = None
+        try:
+            reader, writer, close = self.connect(host)
+            hello = read_frame(reader)
+            if hello is None or hello.get('type') != 'hello':
+                raise FrameError("worker closed the connection without sending hello")
+            if hello.get('protocol') != PROTOCOL_VERSION:
+                raise FrameError(f"protocol {hello.get('protocol')} is not {PROTOCOL_VERSION}")
+            report.remote_host = hello.get('host')
+
+            write_frame(writer, {'type': 'check', 'id': 1, 'sites': host['sites'],
+                                 'args': self.check_args + host['check_args']})
+            while True:
+                message = read_frame(reader)
+                if message is None:
+                    raise FrameError("worker closed the connection before finishing")
+                kind = message.get('type')
+                if kind == 'event':
+                    self.forward(report, dict(message.get('event') or {}))
+                elif kind == 'done':
+                    report.exit_code = message.get('exit_code')
+                    report.error = message.get('error')
+                    report.sites = message.get('sites') or 0
+                    report.metrics = message.get('metrics')
+                    report.worker_elapsed = message.get('elapsed') or 0.0
+                    break
+                elif kind == 'error':
+                    raise FrameError(message.get('message') or "worker error")
+            write_frame(writer, {'type': 'bye'})
+        except (OSError, ValueError, FrameError) as e:
+            report.error = str(e)
+        finally:
+            if close is not None:
+                try:
+                    close()
+                except OSError:
+                    pass
+            report.elapsed = time.perf_counter() - started
+
+        if self.metrics is not None:
+            self.metrics.merge(report.metrics, host=report.name)
+            self.metrics.add_time('host', report.elapsed, host=report.name)
+        self.emit('host', **report.to_dict())
+        self.print_host(report)
+        return report
+
+    def forward(self, report, record):
+        """Re-emit one worker event with the host it came from"""
+        event = record.pop('event', 'unknown')
+        report.events[event] = report.events.get(event, 0) + 1
+        # The worker's own summary is folded into the host report instead
+        if event != 'summary':
+            record['host'] = report.name
+            self.emit(event, **record)
+
+    def print_host(self, report):
+        data = report.to_dict()
+        with self._print_lock:
+            if report.ok:
+                color = Colors.RED if data['findings'] else Colors.GREEN
+                print_colored(f"[{report.name}] 完成: {data['sites']} 个站点，{data['files']} 个文件，"
+                              f"发现 {data['findings']} 个问题，耗时 {data['worker_elapsed']} 秒", color)
+            else:
+                print_colored(f"[{report.name}] 失败: {report.error or f'退出码 {report.exit_code}'}", Colors.RED)
+
+    def run(self):
+        """Check every host, returns their HostReports in fleet order"""
+        print_header("MacCMS 多主机检查")
+        workers = self.parallel if self.parallel and self.parallel > 0 else len(self.hosts)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            reports = list(executor.map(self.run_host, self.hosts))
+        print()
+        print(format_fleet_table(reports))
+        print()
+        return reports
+
+
+def fleet_report(reports, elapsed):
+    """Merge host reports into one fleet report dict"""
+    hosts = [report.to_dict() for report in reports]
+    files = sum(host['files'] for host in hosts)
+    size = sum(host['bytes'] for host in hosts)
+    return {
+        'generated': round(time.time(), 3),
+        'elapsed': round(elapsed, 3),
+        'hosts': hosts,
+        'totals': {
+            'hosts': len(hosts),
+            'failed': sum(1 for host in hosts if not host['ok']),
+            'sites': sum(host['sites'] for host in hosts),
+            'files': files,
+            'bytes': size,
+            'findings': sum(host['findings'] for host in hosts),
+            'errors': sum(host['errors'] for host in hosts),
+            # Fleet-wide rate: every host's work over the coordinator's wall time
+            'files_per_s': round(files / elapsed, 1) if elapsed else None,
+            'mb_per_s': round(size / 1048576 / elapsed, 2) if elapsed else None,
+        },
+    }
+
+
+def format_fleet_table(reports):
+    """Plain-text table of the host reports"""
+    header = (f"{'host':<20} {'result':>8} {'sites':>6} {'files':>8} {'MB':>9} "
+              f"{'findings':>8} {'wall s':>8} {'files/s':>9} {'MB/s':>8}")
+    lines = [header, "-" * len(header)]
+    for report in reports:
+        data = report.to_dict()
+        result = 'ok' if report.ok else 'failed'
+        rate = data['files_per_s'] if data['files_per_s'] is not None else '-'
+        mb_rate = data['mb_per_s'] if data['mb_per_s'] is not None else '-'
+        lines.append(f"{report.name:<20} {result:>8} {data['sites']:>6} {data['files']:>8} "
+                     f"{data['bytes'] / 1048576:>9.2f} {data['findings']:>8} {data['elapsed']:>8.2f} "
+                     f"{rate:>9} {mb_rate:>8}")
+    return "\n".join(lines)
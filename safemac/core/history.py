@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Findings History
+SQLite store of JavaScript check results across runs
+"""
+
+import os
+import sqlite3
+import time
+from ..utils import ensure_dir_exists
+
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    command TEXT
+);
+CREATE TABLE IF NOT EXISTS sites (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS site_runs (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    site_id INTEGER NOT NULL REFERENCES sites(id),
+    files INTEGER NOT NULL,
+    suspicious INTEGER NOT NULL,
+    PRIMARY KEY (run_id, site_id)
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    site_id INTEGER NOT NULL REFERENCES sites(id),
+    path TEXT NOT NULL,
+    UNIQUE (site_id, path)
+);
+CREATE TABLE IF NOT EXISTS hits (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    pattern TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run_id, file_id, pattern)
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS hits_pattern_run ON hits (pattern, run_id);
+CREATE INDEX IF NOT EXISTS hits_file ON hits (file_id);
+"""
+
+
+class FindingsHistory:
+    """Runs, sites, files and per-pattern hits in one SQLite database
+
+    Each site is written in a single transaction (site row, file rows and
+    hit rows through executemany), so a run costs a handful of commits no
+    matter how many findings it produces. Only files with at least one hit
+    are stored; a file missing from a later run of the same site counts
+    as resolved.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = None
+
+    def open(self):
+        """Open (and create if needed) the database"""
+        if self.db_file != ':memory:':
+            ensure_dir_exists(os.path.dirname(os.path.abspath(self.db_file)))
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self.open() if self.conn is None else self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Writing
+
+    def begin_run(self, command='check'):
+        """Start a run and return its id"""
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (started, command) VALUES (?, ?)",
+                                       (time.time(), command))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+
+    def _site_id(self, site):
+        self.conn.execute("INSERT OR IGNORE INTO sites (path) VALUES (?)", (site,))
+        return self.conn.execute("SELECT id FROM sites WHERE path = ?", (site,)).fetchone()[0]
+
+    def record_site(self, run_id, site, files, findings):
+        """Store one site's results in a single transaction
+
+        findings is a list of (file_path, {pattern: hits}); zero counts are
+        not stored.
+        """
+        with self.conn:
+            site_id = self._site_id(site)
+            self.conn.execute("INSERT OR REPLACE INTO site_runs (run_id, site_id, files, suspicious) "
+                              "VALUES (?, ?, ?, ?)", (run_id, site_id, files, len(findings)))
+            if not findings:
+                return
+
+            paths = [str(file_path) for file_path, _ in findings]
+            self.conn.executemany("INSERT OR IGNORE INTO files (site_id, path) VALUES (?, ?)",
+                                  [(site_id, path) for path in paths])
+            file_ids = {}
+            for path, file_id in self.conn.execute("SELECT path, id FROM files WHERE site_id = ?", (site_id,)):
+                file_ids[path] = file_id
+
+            rows = []
+            for path, (_, pattern_hits) in zip(paths, findings):
+                for pattern, count in pattern_hits.items():
+                    if count > 0:
+                        rows.append((run_id, file_ids[path], pattern, count))
+            self.conn.executemany("INSERT OR REPLACE INTO hits (run_id, file_id, pattern, count) "
+                                  "VALUES (?, ?, ?, ?)", rows)
+
+    # Queries
+
+    def _query(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def latest_runs(self, limit=2):
+        """Ids of the most recent runs, newest first"""
+        return [row[0] for row in self.conn.execute("SELECT id FROM runs ORDER BY id DESC LIMIT ?", (limit,))]
+
+    def runs(self, limit=20):
+        """Recent runs with their site, suspicious-file and hit totals"""
+        return self._query("""
+            SELECT r.id AS run, r.started, r.finished, r.command,
+                   (SELECT COUNT(*) FROM site_runs sr WHERE sr.run_id = r.id) AS sites,
+                   (SELECT COALESCE(SUM(sr.suspicious), 0) FROM site_runs sr WHERE sr.run_id = r.id) AS suspicious,
+                   (SELECT COALESCE(SUM(h.count), 0) FROM hits h WHERE h.run_id = r.id) AS hits
+            FROM runs r ORDER BY r.id DESC LIMIT ?""", (limit,))
+
+    def sites_with_pattern(self, pattern, days=30):
+        """Sites with hits of pattern in runs started in the last days"""
+        since = time.time() - days * 86400
+        return self._query("""
+            SELECT s.path AS site, COUNT(DISTINCT h.file_id) AS files, SUM(h.count) AS hits,
+                   COUNT(DISTINCT h.run_id) AS runs, MAX(r.started) AS last_seen
+            FROM hits h
+            JOIN runs r ON r.id = h.run_id
+            JOIN files f ON f.id = h.file_id
+            JOIN sites s ON s.id = f.site_id
+            WHERE h.pattern = ? AND r.started >= ?
+            GROUP BY s.id ORDER BY hits DESC""", (pattern, since))
+
+    def trend(self, pattern=None, limit=20):
+        """Per-run suspicious files and hits, optionally for one pattern"""
+        join = "LEFT JOIN hits h ON h.run_id = r.id"
+        params = (limit,)
+        if pattern:
+            join += " AND h.pattern = ?"
+            params = (pattern, limit)
+        return self._query(f"""
+            SELECT r.id AS run, r.started,
+                   COUNT(DISTINCT h.file_id) AS files, COALESCE(SUM(h.count), 0) AS hits
+            FROM runs r {join}
+            GROUP BY r.id ORDER BY r.id DESC LIMIT ?""", params)
+
+    def diff(self, old_run, new_run):
+        """(file, pattern) hits that appeared and hits that were resolved
+
+        A new pattern on a file that was already flagged counts as new.
+        Only sites scanned in both runs are compared, so a partial run does
+        not report every other site as resolved.
+        """
+        common = """
+            SELECT f.id FROM files f JOIN site_runs a ON a.site_id = f.site_id AND a.run_id = ?
+            JOIN site_runs b ON b.site_id = f.site_id AND b.run_id = ?"""
+        changed = """
+            SELECT s.path AS site, f.path AS file, h.pattern, h.count
+            FROM hits h JOIN files f ON f.id = h.file_id JOIN sites s ON s.id = f.site_id
+            WHERE h.run_id = ? AND h.file_id IN ({common})
+              AND NOT EXISTS (SELECT 1 FROM hits o
+                              WHERE o.run_id = ? AND o.file_id = h.file_id AND o.pattern = h.pattern)
+            ORDER BY s.path, f.path, h.pattern""".format(common=common)
+        return {
+            'new': self._query(changed, (new_run, old_run, new_run, old_run)),
+            'resolved': self._query(changed, (old_run, old_run, new_run, new_run)),
+        }
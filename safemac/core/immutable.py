@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Immutable Flag Engine
+Sets and clears FS_IMMUTABLE_FL in-process (the chattr +i/-i attribute)
+"""
+
+import array
+import errno
+import os
+import stat
+import struct
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+def _ioc(direction, type_char, number, size):
+    """Linux _IOC() request number encoding"""
+    return (direction << 30) | (size << 16) | (ord(type_char) << 8) | number
+
+
+# FS_IOC_GETFLAGS/SETFLAGS are declared with a long argument, although the
+# kernel only ever reads and writes an int
+_LONG_SIZE = struct.calcsize('l')
+FS_IOC_GETFLAGS = _ioc(2, 'f', 1, _LONG_SIZE)
+FS_IOC_SETFLAGS = _ioc(1, 'f', 2, _LONG_SIZE)
+FS_IMMUTABLE_FL = 0x00000010
+
+# Errors that mean the filesystem has no attribute flags at all
+UNSUPPORTED_ERRNOS = (errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+_OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_NONBLOCK', 0) | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_NOCTTY', 0)
+
+
+class FlagResult:
+    """Per-file success and failure counts for one group of entries"""
+
+    # Number of error messages kept for display
+    max_errors = 5
+
+    def __init__(self):
+        self.changed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    @property
+    def ok(self):
+        return self.failed == 0
+
+    def record_error(self, path, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(f"{path}: {error.strerror or error}")
+
+    def merge(self, other):
+        """Add another result's counts to this one"""
+        self.changed += other.changed
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.errors.extend(other.errors[:max(0, self.max_errors - len(self.errors))])
+        return self
+
+    def summary(self):
+        return f"修改 {self.changed} 个，已是目标状态 {self.skipped} 个，失败 {self.failed} 个"
+
+
+class ImmutableFlagEngine:
+    """Sets or clears the immutable flag with FS_IOC_GETFLAGS/SETFLAGS
+
+    Trees are traversed with os.fwalk and every entry is opened relative
+    to its directory fd, so paths with spaces or odd characters are safe
+    and no external processes are started. Entries whose flag is already
+    in the requested state are counted as skipped and left untouched.
+    """
+
+    def is_available(self):
+        """Check whether the ioctls can be issued on this platform"""
+        return fcntl is not None and hasattr(os, 'fwalk')
+
+    def is_supported(self, path):
+        """Check whether the filesystem holding path supports the flag"""
+        if not self.is_available():
+            return False
+        try:
+            fd = os.open(path, _OPEN_FLAGS)
+        except OSError:
+            return False
+        try:
+            self._get_flags(fd)
+            return True
+        except OSError as e:
+            return e.errno not in UNSUPPORTED_ERRNOS
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _get_flags(fd):
+        buf = array.array('i', [0])
+        fcntl.ioctl(fd, FS_IOC_GETFLAGS, buf, True)
+        return buf[0]
+
+    @staticmethod
+    def _set_flags(fd, flags):
+        fcntl.ioctl(fd, FS_IOC_SETFLAGS, array.array('i', [flags]))
+
+    def set_fd(self, fd, immutable):
+        """Set or clear the flag on an open fd, returns True if it changed"""
+        flags = self._get_flags(fd)
+        if bool(flags & FS_IMMUTABLE_FL) == immutable:
+            return False
+        if immutable:
+            flags |= FS_IMMUTABLE_FL
+        else:
+            flags &= ~FS_IMMUTABLE_FL
+        self._set_flags(fd, flags)
+        return True
+
+    def set_path(self, path, immutable, result, dir_fd=None, display=None, skip=None, record=None):
+        """Set or clear the flag on a regular file or directory
+
+        Symlinks, devices, sockets and fifos are ignored, as chattr does.
+        display is the path used in error messages when path is relative
+        to dir_fd. skip(stat_result) returning True counts the entry as
+        skipped without opening it; record(stat_result) is called for every
+        entry that ends up in the requested state, with its stat taken after
+        any change.
+        """
+        display = display or path
+        try:
+            st = os.stat(path, dir_fd=dir_fd, follow_symlinks=False)
+            if not (stat.S_ISREG(st.st_mode) or stat.S_ISDIR(st.st_mode)):
+                return
+            if skip is not None and skip(st):
+                result.skipped += 1
+                if record is not None:
+                    record(st)
+                return
+            fd = os.open(path, _OPEN_FLAGS, dir_fd=dir_fd)
+        except OSError as e:
+            result.record_error(display, e)
+            return
+
+        try:
+            if self.set_fd(fd, immutable):
+                result.changed += 1
+                # Changing the flag moved the ctime
+                st = os.fstat(fd)
+            else:
+                result.skipped += 1
+            if record is not None:
+                record(st)
+        except OSError as e:
+            result.record_error(display, e)
+        finally:
+            os.close(fd)
+
+    def apply_paths(self, paths, immutable, result=None, record=None):
+        """Set or clear the flag on a list of paths
+
+        record(path, stat_result) is called for every path that ends up in
+        the requested state.
+        """
+        result = result if result is not None else FlagResult()
+        for path in paths:
+            on_done = None
+            if record is not None:
+                on_done = lambda st, path=path: record(path, st)
+            self.set_path(path, immutable, result, record=on_done)
+        return result
+
+    def apply_tree(self, root, decide, descend=None, skip=None, record=None):
+        """Walk root with os.fwalk and apply the flag entry by entry
+
+        decide(rel_path, is_dir) returns (group, immutable) for entries to
+        change, or None to leave an entry alone; rel_path is relative to
+        root ('' for root itself). descend(rel_path) returns False to prune
+        a directory. skip(rel_path, stat_result) returning True leaves an
+        entry untouched without opening it, and record(group, rel_path,
+        stat_result, immutable) is called for every entry that ends up in
+        the requested state (skipped ones included). Returns a dict mapping
+        group -> FlagResult; directories that could not be listed are
+        recorded under the None group.
+        """
+        results = {}
+
+        def apply(group, immutable, path, dir_fd, rel_path):
+            on_skip = None
+            on_done = None
+            if skip is not None:
+                on_skip = lambda st: skip(rel_path, st)
+            if record is not None:
+                on_done = lambda st: record(group, rel_path, st, immutable)
+            self.set_path(path, immutable, results.setdefault(group, FlagResult()),
+                          dir_fd=dir_fd, display=os.path.join(root, rel_path) if rel_path else root,
+                          skip=on_skip, record=on_done)
+
+        def on_error(e):
+            results.setdefault(None, FlagResult()).record_error(e.filename, e)
+
+        # The root itself is handled separately since fwalk only gives its fd
+        choice = decide('', True)
+        if choice is not None:
+            apply(choice[0], choice[1], root, None, '')
+
+        for dirpath, dirnames, filenames, dir_fd in os.fwalk(root, onerror=on_error):
+            rel_dir = os.path.relpath(dirpath, root)
+            rel_dir = '' if rel_dir == '.' else rel_dir
+
+            kept = []
+            for name in dirnames:
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                if descend is not None and not descend(rel_path):
+                    continue
+                choice = decide(rel_path, True)
+                if choice is not None:
+                    apply(choice[0], choice[1], name, dir_fd, rel_path)
+                kept.append(name)
+            dirnames[:] = kept
+
+            for name in filenames:
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                choice = decide(rel_path, False)
+                if choice is not None:
+                    apply(choice[0], choice[1], name, dir_fd, rel_path)
+
+        return results
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Lock Manifest
+Records which entries of a site were locked so unlock/relock can skip the rest
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from ..utils import ensure_dir_exists
+
+
+MANIFEST_FORMAT = 1
+
+
+class LockManifest:
+    """Per-site record of locked entries: rel_path -> [size, mtime_ns, locked, ctime_ns]
+
+    Stored as gzip-compressed JSON under data/lock_manifest/, one file per
+    site. ``locked`` is 1 while the entry should carry the immutable flag
+    and 0 after it has been unlocked. ctime_ns is taken once the flag is
+    set; clearing the flag outside this tool (chattr -i) changes only the
+    ctime. Entries written before ctime_ns was recorded have no fourth
+    field and never count as unchanged.
+    """
+
+    def __init__(self, manifest_dir, site_path):
+        self.site_path = os.path.abspath(site_path)
+        site_key = hashlib.sha1(self.site_path.encode('utf-8')).hexdigest()[:16]
+        self.manifest_file = os.path.join(manifest_dir, f"{site_key}.json.gz")
+        self.entries = {}
+        self.updated = None
+
+    def exists(self):
+        return os.path.exists(self.manifest_file)
+
+    def load(self):
+        """Load the manifest, leaving it empty if missing or unreadable"""
+        try:
+            with gzip.open(self.manifest_file, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+
+        if data.get('format') == MANIFEST_FORMAT and data.get('site') == self.site_path:
+            self.entries = data.get('entries', {})
+            self.updated = data.get('updated')
+        return self
+
+    def save(self):
+        """Write the manifest atomically"""
+        ensure_dir_exists(os.path.dirname(self.manifest_file))
+        self.updated = time.time()
+        tmp_file = f"{self.manifest_file}.tmp"
+        with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+            json.dump({'format': MANIFEST_FORMAT, 'site': self.site_path,
+                       'updated': self.updated, 'entries': self.entries},
+                      f, separators=(',', ':'))
+        os.replace(tmp_file, self.manifest_file)
+
+    def locked_paths(self, prefixes=None):
+        """Rel paths currently recorded as locked, optionally under prefixes"""
+        paths = [rel_path for rel_path, entry in self.entries.items() if entry[2]]
+        if prefixes:
+            prefixes = [prefix.strip('/') for prefix in prefixes]
+            paths = [rel_path for rel_path in paths
+                     if any(rel_path == prefix or rel_path.startswith(prefix + '/')
+                            for prefix in prefixes)]
+        return paths
+
+    def is_unchanged_lock(self, rel_path, stat_result):
+        """Check whether an entry is recorded as locked with the same size/mtime/ctime"""
+        entry = self.entries.get(rel_path)
+        return (entry is not None and len(entry) > 3 and entry[2]
+                and entry[0] == stat_result.st_size and entry[1] == stat_result.st_mtime_ns
+                and entry[3] == stat_result.st_ctime_ns)
+
+    def replace_locked(self, entries):
+        """Replace the manifest with freshly locked (rel_path, size, mtime_ns, ctime_ns) entries"""
+        self.entries = {rel_path: [size, mtime_ns, 1, ctime_ns]
+                        for rel_path, size, mtime_ns, ctime_ns in entries}
+
+    def mark_unlocked(self, rel_paths):
+        """Record that entries no longer carry the immutable flag"""
+        for rel_path in rel_paths:
+            entry = self.entries.get(rel_path)
+            if entry is not None:
+                entry[2] = 0
+
+    def mark_all_unlocked(self):
+        for entry in self.entries.values():
+            entry[2] = 0
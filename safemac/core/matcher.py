@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Signature Matcher
+Precompiled multi-signature matcher that checks every rule in one pass
+"""
+
+import mmap
+import re
+import string
+import time
+import unicodedata
+
+
+# Characters that end a literal run when parsing a regex
+_REGEX_META = set('.^$*+?{}[]()|')
+
+_BYTES_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+
+def is_bytes(content):
+    """Check whether content is a raw buffer rather than str"""
+    return isinstance(content, _BYTES_TYPES)
+
+
+def bytes_pattern(pattern):
+    """Turn a str regex into the bytes regex matching its UTF-8 encoding
+
+    Bytes regexes have no \\u, \\U or \\N{...} escapes, so outside character
+    classes those are rewritten to the \\xNN escapes of their UTF-8 bytes
+    (grouped, so a following quantifier still applies to the whole
+    character). Inside a class they stay and fail to compile, since a
+    class cannot hold a multi-byte character.
+    """
+    out = []
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            end = i + 2
+            value = None
+            if not in_class and escaped in 'uU':
+                end = i + 2 + (4 if escaped == 'u' else 8)
+                digits = pattern[i + 2:end]
+                if len(digits) == end - i - 2 and all(c in string.hexdigits for c in digits):
+                    value = chr(int(digits, 16))
+            elif not in_class and escaped == 'N' and pattern.startswith('{', i + 2):
+                close = pattern.find('}', i + 2)
+                if close != -1:
+                    end = close + 1
+                    try:
+                        value = unicodedata.lookup(pattern[i + 3:close])
+                    except KeyError:
+                        value = None
+            if value is None:
+                out.append(pattern[i:i + 2])
+                i += 2
+                continue
+            out.append('(?:' + ''.join(f'\\x{byte:02x}' for byte in value.encode('utf-8')) + ')')
+            i = end
+            continue
+        if char == '[' and not in_class:
+            in_class = True
+            out.append(char)
+            i += 1
+            # A ] right after [ or [^ is a literal
+            if pattern.startswith('^', i):
+                out.append('^')
+                i += 1
+            if pattern.startswith(']', i):
+                out.append(']')
+                i += 1
+            continue
+        if char == ']' and in_class:
+            in_class = False
+        out.append(char)
+        i += 1
+    return ''.join(out).encode('utf-8')
+
+
+# Escapes followed by a fixed number of hex digits
+_HEX_ESCAPES = {'x': 2, 'u': 4, 'U': 8}
+
+
+def _skip_escape_argument(pattern, escaped, i):
+    """Return the index past the argument of an alphanumeric escape at i"""
+    if escaped in _HEX_ESCAPES:
+        return min(i + _HEX_ESCAPES[escaped], len(pattern))
+    if escaped == 'N' and pattern.startswith('{', i):
+        end = pattern.find('}', i)
+        return end + 1 if end != -1 else len(pattern)
+    if escaped.isdigit():
+        # Octal escapes and group references take up to two more digits
+        while i < len(pattern) and pattern[i].isdigit():
+            i += 1
+    return i
+
+
+def required_literal(pattern):
+    """Return the longest literal every match of a regex must contain
+
+    Only plain characters and escaped punctuation outside groups and
+    character classes are collected, so the result is conservative: None
+    means no literal could be proven (e.g. a top-level alternation).
+    """
+    runs = []
+    current = []
+    depth = 0
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            i += 2
+            if not escaped.isalnum():
+                if depth == 0:
+                    literal = escaped
+            else:
+                # Class escapes end the run; skip the argument of escapes
+                # that spell a character or refer to a group
+                i = _skip_escape_argument(pattern, escaped, i)
+        elif char == '[':
+            # Skip the whole character class
+            i += 1
+            if i < len(pattern) and pattern[i] == '^':
+                i += 1
+            if i < len(pattern) and pattern[i] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif char == '{':
+            # Skip a {m,n} quantifier, its digits are not literal text
+            end = pattern.find('}', i)
+            i = end + 1 if end != -1 else len(pattern)
+        elif char == '(':
+            depth += 1
+            i += 1
+        elif char == ')':
+            depth -= 1
+            i += 1
+        elif char == '|':
+            if depth == 0:
+                return None
+            i += 1
+        else:
+            i += 1
+            if depth == 0 and char not in _REGEX_META:
+                literal = char
+
+        # A following quantifier makes the previous character optional
+        if literal is not None and i < len(pattern) and pattern[i] in '*?{':
+            literal = None
+
+        if literal is not None:
+            current.append(literal)
+        elif current:
+            runs.append(''.join(current))
+            current = []
+
+    if current:
+        runs.append(''.join(current))
+    return max(runs, key=len) if runs else None
+
+
+class SignatureMatcher:
+    """Counts hits for a set of named regex signatures in a single pass
+
+    A literal prefilter runs first: each rule's required literal (see
+    required_literal) is looked up in the lowercased content, and only
+    rules whose literal is present reach the regex stage. Files with no
+    possible hit never run a regex at all. Counts match separate per-rule
+    scans: overlapping matches of different rules are all counted.
+
+    Content may be str or a raw buffer (bytes, bytearray, memoryview,
+    mmap). Buffers are matched with byte patterns compiled from the same
+    rules, so files never need decoding; case-insensitive rules use ASCII
+    case folding, which is all the signatures need.
+    """
+
+    def __init__(self, patterns, case_sensitive=('hex_string',), use_prefilter=True, known_literals=None):
+        # Keep rule order stable so results look like the old per-rule loop
+        self.patterns = dict(patterns)
+        self.names = list(self.patterns.keys())
+        self.case_sensitive = set(case_sensitive)
+        self.use_prefilter = use_prefilter
+
+        # Group names must be identifiers, rule names like 'Mac|Win' are not
+        self._group_names = {f"r{i}": name for i, name in enumerate(self.names)}
+        self._compiled = {}
+        self._regex = self._compile(tuple(self.names))
+
+        # Lowercased literals for the prefilter; rules without one always
+        # go through the regex stage. known_literals maps a pattern source
+        # to its already extracted literal (e.g. from the rule pack cache)
+        known_literals = known_literals or {}
+        self.literals = {}
+        for name in self.names:
+            if not use_prefilter:
+                continue
+            pattern = self.patterns[name]
+            literal = known_literals[pattern] if pattern in known_literals else required_literal(pattern)
+            if literal:
+                self.literals[name] = literal.lower()
+        self._bytes_literals = {name: literal.encode('utf-8') for name, literal in self.literals.items()}
+
+    def candidates(self, content):
+        """Rules that can possibly match content, in rule order"""
+        if not self.literals:
+            return tuple(self.names)
+
+        if isinstance(content, (memoryview, mmap.mmap)):
+            content = bytes(content)
+        lowered = content.lower()
+        literals = self._bytes_literals if isinstance(lowered, bytes) else self.literals
+        return tuple(name for name in self.names
+                     if name not in literals or literals[name] in lowered)
+
+    def _compile(self, names, as_bytes=False):
+        """Compile an alternation of the given rules, cached per rule subset"""
+        key = (tuple(names), as_bytes)
+        if key in self._compiled:
+            return self._compiled[key]
+
+        wanted = set(names)
+        parts = []
+        for i, name in enumerate(self.names):
+            if name not in wanted:
+                continue
+            if name in self.case_sensitive:
+                parts.append(f"(?P<r{i}>{self.patterns[name]})")
+            else:
+                parts.append(f"(?P<r{i}>(?i:{self.patterns[name]}))")
+
+        source = '|'.join(parts)
+        regex = re.compile(bytes_pattern(source) if as_bytes else source) if parts else None
+        self._compiled[key] = regex
+        return regex
+
+    def empty_result(self):
+        """Return a result dict with every rule at zero hits"""
+        return {name: 0 for name in self.names}
+
+    def count(self, content):
+        """Count hits of every rule, as if each rule scanned the content alone
+
+        One search of the combined alternation settles the common case of
+        no hit at all. Once something matches, rules are counted on their
+        own scans from that point on, since a span consumed by one rule in
+        the alternation can hold matches of another (e.g. "base64" inside
+        "atob(base64").
+        """
+        hits = self.empty_result()
+        as_bytes = is_bytes(content)
+        names = self.candidates(content)
+        regex = self._compile(names, as_bytes=as_bytes)
+        if regex is None:
+            return hits
+
+        if len(names) == 1:
+            hits[names[0]] = sum(1 for _ in regex.finditer(content))
+            return hits
+
+        first = regex.search(content)
+        if first is None:
+            return hits
+        # No rule matches before the first match of the alternation
+        for name in names:
+            hits[name] = sum(1 for _ in self._compile((name,), as_bytes=as_bytes).finditer(content, first.start()))
+        return hits
+
+    def profile(self, content):
+        """Time every rule on its own, returns {rule: seconds}
+
+        Each rule's prefilter check and regex run separately here, so this
+        costs roughly one extra scan per rule; use it to find slow rules,
+        not for matching.
+        """
+        timings = {}
+        lowered = None
+        as_bytes = is_bytes(content)
+        for name in self.names:
+            started = time.perf_counter()
+            literal = self.literals.get(name)
+            if literal is not None:
+                if lowered is None:
+                    lowered = bytes(content).lower() if as_bytes else content.lower()
+                if as_bytes:
+                    literal = self._bytes_literals[name]
+            if literal is None or literal in lowered:
+                regex = self._compile((name,), as_bytes=as_bytes)
+                for _ in regex.finditer(content):
+                    pass
+            timings[name] = time.perf_counter() - started
+        return timings
+
+    def presence(self, content):
+        """Report 1 for each rule that matches at least once, stopping early
+
+        Once a rule has matched, the remaining content is searched only for
+        the rules that have not matched yet, and the scan stops as soon as
+        every rule has been seen.
+        """
+        hits = self.empty_result()
+        as_bytes = is_bytes(content)
+        remaining = list(self.candidates(content))
+        regex = self._compile(tuple(remaining), as_bytes=as_bytes)
+        pos = 0
+
+        while regex is not None:
+            match = regex.search(content, pos)
+            if match is None:
+                break
+            hits[self._group_names[match.lastgroup]] = 1
+            remaining.remove(self._group_names[match.lastgroup])
+            regex = self._compile(tuple(remaining), as_bytes=as_bytes)
+            pos = match.start()
+
+        return hits
+
+    def count_windows(self, buffer, window, overlap, presence_only=False, release=None):
+        """Count hits in a bytes-like buffer one bounded window at a time
+
+        Each window is matched in place (no copy) with up to ``overlap``
+        extra bytes of look-ahead, so a match that starts inside the window
+        and crosses its end is still counted exactly once; each rule resumes
+        after its own last match, as in count(). Matches longer
+        than ``overlap`` bytes that straddle a boundary can be truncated.
+        ``release(start, end)`` is called for every finished byte range so
+        the caller can drop it from memory. The literal prefilter runs per
+        window, on a lowercased copy bounded by window + overlap bytes.
+        """
+        hits = self.empty_result()
+        size = len(buffer)
+        if self._regex is None:
+            return hits
+
+        seen = set()
+        # Where each rule's own scan carries on, past its last counted match
+        resume = {}
+        pos = 0
+
+        while pos < size:
+            end = min(pos + window, size)
+            limit = min(end + overlap, size)
+
+            names = self.candidates(buffer[pos:limit]) if self.literals else self.names
+            regex = self._compile(names, as_bytes=True)
+            first = regex.search(buffer, pos, limit) if regex is not None else None
+
+            if first is not None and first.start() < end:
+                # Count each rule on its own scan, like count() does
+                for name in names:
+                    start = max(first.start(), resume.get(name, 0))
+                    for match in self._compile((name,), as_bytes=True).finditer(buffer, start, limit):
+                        if match.start() >= end:
+                            break
+                        hits[name] += 1
+                        seen.add(name)
+                        resume[name] = match.end()
+
+            if release is not None:
+                release(pos, end)
+            pos = end
+
+            if presence_only and len(seen) == len(self.names):
+                break
+
+        if presence_only:
+            hits = {name: 1 if count else 0 for name, count in hits.items()}
+        return hits
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Full Check Pipeline
+Runs every check family over each site with one traversal per site
+"""
+
+import os
+from ..utils import Colors, print_colored, print_header
+
+
+# Check families in the order their results are shown for each site
+CHECKS = ('active', 'addons', 'js', 'php')
+
+
+class SiteCheckPipeline:
+    """Runs the PHP and JavaScript checks site by site in one pass
+
+    Each site is walked once. That walk lists the JS/HTML and PHP files
+    and notes which of the files named by the PHP rules exist, so the
+    path rules need no extra stat and the addons rules read their target
+    once. The JS and PHP files of every site go to one scan engine (and
+    one worker pool) up front, and each site's results are then reported
+    together, so a full check costs about as much as one content scan.
+    Without a content check nothing is walked, and the PHP rules stat
+    their few paths directly.
+    """
+
+    def __init__(self, checker, checks=CHECKS):
+        self.checker = checker
+        self.checks = [name for name in CHECKS if name in checks]
+        # The webshell check walks into upload dirs the other checks skip
+        exclude_dirs = checker.php_scan_exclude_dirs if 'php' in self.checks else checker.scan_exclude_dirs
+        self.excluded = set(path.strip('/') for path in exclude_dirs)
+
+    def is_walked(self, rel_path):
+        """Check whether the site walk lists a site-relative file path"""
+        parts = rel_path.split('/')
+        return not any('/'.join(parts[:i]) in self.excluded for i in range(1, len(parts)))
+
+    def exists_in(self, site, present):
+        """exists(path) for a site, answered from its walk where possible"""
+        if present is None:
+            return os.path.exists
+        prefix = site.rstrip('/') + '/'
+
+        def exists(path):
+            rel_path = path[len(prefix):] if path.startswith(prefix) else None
+            if rel_path is None or not self.is_walked(rel_path):
+                return os.path.exists(path)
+            return rel_path in present
+        return exists
+
+    def run(self, sites):
+        """Run the selected checks over every site, returns findings per check"""
+        checker = self.checker
+        checker.require_rules()
+        print_header("MacCMS 完整检查")
+        totals = {name: 0 for name in self.checks}
+
+        sites = [site for site in sites if site.strip()]
+        if not sites:
+            print_colored("站点列表为空", Colors.YELLOW)
+            return totals
+
+        php_paths = checker.php_rule_paths() if 'active' in self.checks or 'addons' in self.checks else ()
+        run_js = 'js' in self.checks
+        run_php = 'php' in self.checks
+
+        # The single traversal of every site, only needed for the content scans
+        if run_js or run_php:
+            site_walks = []
+            with checker.metrics.time('phase', phase='walk'):
+                for site in sites:
+                    walk = checker.walk_site(site, php_paths, php=run_php)
+                    site_walks.append((site, walk.js if run_js else [], walk.php, walk.present))
+        else:
+            site_walks = [(site, [], [], None) for site in sites]
+        checker.metrics.incr('files_listed', sum(len(js) + len(php) for _, js, php, _ in site_walks))
+
+        log_dir = None
+        if run_js or run_php:
+            log_dir = checker.open_js_log_dir()
+            # Per site, the JS files come first, then the PHP files
+            site_files = [(site, js_files + php_files) for site, js_files, php_files, _ in site_walks]
+            results, cache, history, run_id = checker.start_js_scan(site_files, record=run_js)
+
+        for site, js_files, php_files, present in site_walks:
+            print_colored(f"检查站点: {site}", Colors.YELLOW)
+            exists = self.exists_in(site, present)
+            found = {}
+
+            if 'active' in self.checks:
+                print_colored("[PHP Active/System]", Colors.BLUE)
+                found['php_active_system'] = checker.check_site_active_system(site, exists)
+                totals['active'] += found['php_active_system']
+            if 'addons' in self.checks:
+                print_colored("[PHP Addons]", Colors.BLUE)
+                found['php_addons_hijack'] = checker.check_site_addons_hijack(site, exists)
+                totals['addons'] += found['php_addons_hijack']
+            if run_js:
+                print_colored("[JavaScript]", Colors.BLUE)
+                found['javascript'] = checker.report_js_site(site, js_files, results, log_dir,
+                                                             history, run_id)
+                totals['js'] += found['javascript']
+            if run_php:
+                print_colored("[PHP WebShell]", Colors.BLUE)
+                found['php_webshell'] = checker.report_php_site(site, php_files, results, log_dir)
+                totals['php'] += found['php_webshell']
+
+            checker.emit('site', check='full', site=site, found=found)
+            print()
+
+        if run_js or run_php:
+            extensions = checker.php_extensions
+            if run_js and run_php:
+                covers = None
+            elif run_js:
+                covers = lambda path: not path.endswith(extensions)
+            else:
+                covers = lambda path: path.endswith(extensions)
+            checker.finish_js_scan(site_files, results, cache, history, run_id, covers)
+
+        print_colored(f"完整检查完成，共发现 {sum(totals.values())} 个问题", Colors.GREEN)
+        if log_dir is not None:
+            print_colored(f"详细日志已保存到: {log_dir}", Colors.BLUE)
+        print()
+        return totals
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Read-Ahead Scan Engine
+Overlaps file reads with matching for slow or network-mounted webroots
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def mount_point(directory, cache=None):
+    """Return the mount point holding a directory, caching per directory"""
+    directory = os.path.abspath(directory)
+    if cache is not None and directory in cache:
+        return cache[directory]
+
+    current = directory
+    while not os.path.ismount(current):
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+
+    if cache is not None:
+        cache[directory] = current
+    return current
+
+
+def read_file(file_path):
+    """Read a whole file, returns (content, seconds); runs in a reader thread"""
+    started = time.perf_counter()
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    return content, time.perf_counter() - started
+
+
+class ReadAheadScanEngine:
+    """Runs MacCMSVirusChecker.scan_file in-process with reads done ahead
+
+    An asyncio loop hands blocking reads to a pool of reader threads, so
+    while one file is being matched the next ones are already being
+    fetched. At most `reads` reads run at once, and at most the limit of
+    its mount (mount_limits, keyed by mount point, else mount_default)
+    per mount, so one slow NFS export cannot take every reader. Up to
+    `read_ahead` files and `buffer_bytes` bytes are held ahead of the
+    matcher. The loop runs whenever the matcher waits for its next file,
+    and reads already handed to a thread carry on while it matches. Files
+    scan_file streams or cuts (see MacCMSVirusChecker.wants_content) are
+    not read ahead.
+
+    Results are yielded in input order, like ParallelScanEngine.scan.
+    """
+
+    def __init__(self, checker, reads=8, read_ahead=32, mount_limits=None, mount_default=None,
+                 buffer_bytes=64 * 1024 * 1024):
+        self.checker = checker
+        self.reads = max(1, reads)
+        self.read_ahead = max(1, read_ahead)
+        self.mount_default = mount_default
+        self.buffer_bytes = buffer_bytes
+        self._mounts = {}
+        # Limits may name any directory; they apply to the mount holding it
+        self.mount_limits = {mount_point(path, self._mounts): limit
+                             for path, limit in (mount_limits or {}).items()}
+        # Created inside the loop (asyncio primitives bind to it there)
+        self._semaphores = None
+
+    def semaphores(self, file_path):
+        """Return the (mount, global) semaphores a read of file_path takes"""
+        if self._semaphores is None:
+            self._semaphores = {None: asyncio.Semaphore(self.reads)}
+        mount = mount_point(os.path.dirname(file_path), self._mounts)
+        limit = self.mount_limits.get(mount, self.mount_default)
+        if limit is None:
+            return None, self._semaphores[None]
+        if mount not in self._semaphores:
+            self._semaphores[mount] = asyncio.Semaphore(max(1, limit))
+        return self._semaphores[mount], self._semaphores[None]
+
+    async def read(self, loop, executor, file_path):
+        """Read one file through the executor within its concurrency limits"""
+        mount_slot, global_slot = self.semaphores(file_path)
+        # Take the mount's slot first, so a busy mount does not hold
+        # global slots other mounts could use
+        if mount_slot is not None:
+            async with mount_slot:
+                async with global_slot:
+                    return await loop.run_in_executor(executor, read_file, file_path)
+        async with global_slot:
+            return await loop.run_in_executor(executor, read_file, file_path)
+
+    def scan(self, file_paths, sizes=None):
+        """Yield (pattern_hits, error, decision, stats) for every path, in order"""
+        checker = self.checker
+        metrics = checker.metrics
+        file_paths = [str(path) for path in file_paths]
+        if sizes is None:
+            sizes = [None] * len(file_paths)
+
+        loop = asyncio.new_event_loop()
+        self._semaphores = None
+        executor = ThreadPoolExecutor(max_workers=self.reads)
+        # (index, task or None, size) of every file scheduled ahead
+        ahead = deque()
+        ahead_bytes = 0
+        next_index = 0
+
+        try:
+            for index, file_path in enumerate(file_paths):
+                # Keep the window full; the first file is always let in
+                while next_index < len(file_paths) and len(ahead) < self.read_ahead:
+                    size = sizes[next_index]
+                    if size is None:
+                        try:
+                            size = os.path.getsize(file_paths[next_index])
+                        except OSError:
+                            size = 0
+                    task = None
+                    if checker.wants_content(file_paths[next_index], size):
+                        if ahead and ahead_bytes + size > self.buffer_bytes:
+                            break
+                        task = loop.create_task(self.read(loop, executor, file_paths[next_index]))
+                        ahead_bytes += size
+                    ahead.append((next_index, task, size))
+                    next_index += 1
+
+                _, task, size = ahead.popleft()
+                if task is None:
+                    yield checker.scan_file(file_path)
+                    continue
+
+                ahead_bytes -= size
+                started = time.perf_counter()
+                try:
+                    content, seconds = loop.run_until_complete(task)
+                except Exception:
+                    # Gone or unreadable: let scan_file report it as usual
+                    yield checker.scan_file(file_path)
+                    continue
+                metrics.add_time('phase', time.perf_counter() - started, phase='read_wait')
+                metrics.add_time('phase', seconds, phase='read_ahead')
+                metrics.incr('files_read', mode='read_ahead')
+                metrics.incr('bytes_read', len(content), mode='read_ahead')
+                yield checker.scan_file(file_path, content)
+        finally:
+            # Drop reads not started yet and wait for the running ones
+            tasks = [task for _, task, _ in ahead if task is not None]
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            executor.shutdown(wait=True)
+            loop.close()
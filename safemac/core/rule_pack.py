@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Rule Packs
+Loads, validates and caches the detection rules shipped in data/rules
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+from .matcher import SignatureMatcher, bytes_pattern, required_literal
+from ..utils import ensure_dir_exists
+
+
+RULE_PACK_FORMAT = 1
+
+# Bump when validation or literal extraction changes, so cached packs are redone
+RULE_CACHE_FORMAT = 5
+
+_DEFAULT_FLAGS = re.compile('').flags
+
+# Rule types: path rules fire when a file exists, dir rules fire on any
+# PHP file below one of their directories, regex and literal rules fire on
+# file content
+RULE_TYPES = ('path', 'dir', 'regex', 'literal')
+
+# Checks a rule can belong to, and the rule types each one understands
+RULE_CHECKS = {
+    'php_active_system': ('path',),
+    'php_addons_hijack': ('regex', 'literal'),
+    'javascript': ('regex', 'literal'),
+    'php_webshell': ('regex', 'literal', 'dir'),
+}
+
+# Checks whose content rules run through a SignatureMatcher
+MATCHER_CHECKS = ('javascript', 'php_webshell')
+
+# Remediation actions a rule can ask for
+RULE_ACTIONS = ('none', 'quarantine', 'restore_addons')
+
+
+class RulePackError(ValueError):
+    """Raised when a rule pack is malformed"""
+
+
+class Rule:
+    """One validated detection rule
+
+    Content rules are normalised to a regex source (literals are escaped),
+    so every check can match them the same way.
+    """
+
+    def __init__(self, rule_id, rule_type, check, title=None, paths=(), pattern=None,
+                 case_sensitive=False, action='none', pack=None):
+        self.id = rule_id
+        self.type = rule_type
+        self.check = check
+        self.title = title or rule_id
+        self.paths = list(paths)
+        self.pattern = pattern
+        self.case_sensitive = case_sensitive
+        self.action = action
+        self.pack = pack
+        # Compiled pattern per content type: False for str, True for bytes
+        self._compiled = {}
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'type': self.type, 'check': self.check, 'title': self.title,
+            'paths': self.paths, 'pattern': self.pattern, 'case_sensitive': self.case_sensitive,
+            'action': self.action, 'pack': self.pack,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['type'], data['check'], title=data['title'], paths=data['paths'],
+                   pattern=data['pattern'], case_sensitive=data['case_sensitive'],
+                   action=data['action'], pack=data['pack'])
+
+    def site_paths(self, site):
+        """Absolute paths this rule looks at inside a site"""
+        return [os.path.join(site, *path.split('/')) for path in self.paths]
+
+    def matches(self, content):
+        """Check whether a content rule fires on content (str or raw bytes)"""
+        as_bytes = not isinstance(content, str)
+        regex = self._compiled.get(as_bytes)
+        if regex is None:
+            pattern = bytes_pattern(self.pattern) if as_bytes else self.pattern
+            regex = re.compile(pattern, 0 if self.case_sensitive else re.IGNORECASE)
+            self._compiled[as_bytes] = regex
+        return regex.search(content) is not None
+
+
+def _require(condition, source, message):
+    if not condition:
+        raise RulePackError(f"{source}: {message}")
+
+
+def validate_rule(raw, source, pack=None):
+    """Check one raw rule from a pack and return a Rule"""
+    _require(isinstance(raw, dict), source, "规则必须是对象")
+    rule_id = raw.get('id')
+    _require(isinstance(rule_id, str) and rule_id, source, "缺少规则 id")
+    source = f"{source} [{rule_id}]"
+
+    rule_type = raw.get('type')
+    _require(rule_type in RULE_TYPES, source, f"未知的规则类型: {rule_type}")
+    check = raw.get('check')
+    _require(check in RULE_CHECKS, source, f"未知的检查: {check}")
+    _require(rule_type in RULE_CHECKS[check], source, f"检查 {check} 不支持 {rule_type} 规则")
+    action = raw.get('action', 'none')
+    _require(action in RULE_ACTIONS, source, f"未知的处理动作: {action}")
+
+    paths = raw.get('paths', [])
+    _require(isinstance(paths, list) and all(isinstance(path, str) and path for path in paths),
+             source, "paths 必须是字符串列表")
+    _require(all(not path.startswith('/') and '..' not in path.split('/') for path in paths),
+             source, "paths 必须是站点内的相对路径")
+    _require(rule_type not in ('path', 'dir') or paths, source, f"{rule_type} 规则需要 paths")
+
+    pattern = None
+    case_sensitive = bool(raw.get('case_sensitive', False))
+    if rule_type == 'literal':
+        literal = raw.get('literal')
+        _require(isinstance(literal, str) and literal, source, "literal 规则需要 literal")
+        pattern = re.escape(literal)
+    elif rule_type == 'regex':
+        pattern = raw.get('pattern')
+        _require(isinstance(pattern, str) and pattern, source, "regex 规则需要 pattern")
+        try:
+            compiled = re.compile(pattern)
+            # Files are matched as raw bytes, so the bytes form must compile too
+            re.compile(bytes_pattern(pattern))
+        except re.error as e:
+            raise RulePackError(f"{source}: 正则表达式无效: {e}")
+        # Inline global flags such as (?i) are an error inside the matcher's
+        # alternation (Python 3.11+) or leak into every other rule
+        _require(compiled.flags == _DEFAULT_FLAGS, source,
+                 "pattern 不能使用全局内联标志（如 (?i)），请改用 case_sensitive 或 (?i:...)")
+        try:
+            # The matcher puts every rule in a named group of one alternation;
+            # matching empty bytes compiles its bytes form as well
+            SignatureMatcher({rule_id: pattern}, case_sensitive=(rule_id,) if case_sensitive else (),
+                             use_prefilter=False).count(b'')
+        except re.error as e:
+            raise RulePackError(f"{source}: 正则表达式在匹配器中无效（规则会放入分组，不能使用编号的反向引用和内联标志）: {e}")
+        _require(not compiled.groupindex, source, "pattern 不能使用命名分组")
+        _require(compiled.search('') is None, source, "pattern 不能匹配空字符串")
+
+    if check == 'javascript':
+        _require(not paths, source, "javascript 规则作用于所有 JS/HTML 文件，不能指定 paths")
+    elif check == 'php_addons_hijack':
+        _require(paths, source, "PHP 内容规则需要 paths")
+
+    return Rule(rule_id, rule_type, check, title=raw.get('title'), paths=paths, pattern=pattern,
+                case_sensitive=case_sensitive, action=action, pack=pack)
+
+
+def validate_pack(data, source):
+    """Check a parsed pack and return its rules"""
+    _require(isinstance(data, dict), source, "规则包必须是对象")
+    _require(data.get('format') == RULE_PACK_FORMAT, source, f"不支持的规则包格式: {data.get('format')}")
+    name = data.get('name') or os.path.splitext(os.path.basename(source))[0]
+    raw_rules = data.get('rules')
+    _require(isinstance(raw_rules, list), source, "rules 必须是列表")
+    return [validate_rule(raw, source, pack=name) for raw in raw_rules]
+
+
+class RuleSet:
+    """All rules from the loaded packs, with the derived matcher inputs"""
+
+    def __init__(self, rules, digest=None, literals=None):
+        self.rules = list(rules)
+        self.digest = digest
+        # Matcher pattern source -> prefilter literal (None when there is none)
+        self.literals = dict(literals or {})
+
+    def for_check(self, check):
+        return [rule for rule in self.rules if rule.check == check]
+
+    def content_rules(self, check):
+        return [rule for rule in self.for_check(check) if rule.pattern is not None]
+
+    def patterns(self, check):
+        """Ordered rule id -> regex source for a check's matcher"""
+        return {rule.id: rule.pattern for rule in self.content_rules(check)}
+
+    def case_sensitive(self, check):
+        return [rule.id for rule in self.content_rules(check) if rule.case_sensitive]
+
+    def js_patterns(self):
+        return self.patterns('javascript')
+
+    def js_case_sensitive(self):
+        return self.case_sensitive('javascript')
+
+
+class RulePackLoader:
+    """Loads every *.json pack in rules_dir, caching the validated result
+
+    The cache file is named after a hash of the pack files, so any edit to
+    a pack is picked up on the next start and an unchanged set of packs is
+    loaded without re-validating or re-analysing a single rule.
+    """
+
+    def __init__(self, rules_dir, cache_dir):
+        self.rules_dir = rules_dir
+        self.cache_dir = cache_dir
+
+    def pack_files(self):
+        return sorted(glob.glob(os.path.join(self.rules_dir, "*.json")))
+
+    def digest(self, contents):
+        sha = hashlib.sha1()
+        sha.update(f"{RULE_PACK_FORMAT}:{RULE_CACHE_FORMAT}".encode('utf-8'))
+        for file_path, data in contents:
+            sha.update(os.path.basename(file_path).encode('utf-8') + b"\0")
+            sha.update(hashlib.sha1(data).digest())
+        return sha.hexdigest()
+
+    def cache_file(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def load(self):
+        """Return the RuleSet for the current packs
+
+        Raises RulePackError when a pack is invalid or no pack exists.
+        """
+        contents = []
+        for file_path in self.pack_files():
+            with open(file_path, 'rb') as f:
+                contents.append((file_path, f.read()))
+        if not contents:
+            raise RulePackError(f"{self.rules_dir}: 未找到规则包")
+
+        digest = self.digest(contents)
+        ruleset = self._load_cache(digest)
+        if ruleset is not None:
+            return ruleset
+
+        rules = []
+        for file_path, data in contents:
+            try:
+                pack = json.loads(data.decode('utf-8'))
+            except ValueError as e:
+                raise RulePackError(f"{file_path}: JSON 格式错误: {e}")
+            rules.extend(validate_pack(pack, file_path))
+
+        seen = set()
+        for rule in rules:
+            if rule.id in seen:
+                raise RulePackError(f"{rule.pack}: 规则 id 重复: {rule.id}")
+            seen.add(rule.id)
+
+        literals = {rule.pattern: required_literal(rule.pattern) for rule in rules
+                    if rule.check in MATCHER_CHECKS and rule.pattern is not None}
+        ruleset = RuleSet(rules, digest, literals)
+        self._save_cache(ruleset)
+        return ruleset
+
+    def _load_cache(self, digest):
+        try:
+            with open(self.cache_file(digest), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') != RULE_CACHE_FORMAT:
+                return None
+            return RuleSet([Rule.from_dict(rule) for rule in data['rules']], digest, data['literals'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_cache(self, ruleset):
+        """Write the compiled rule set, replacing caches of older packs"""
+        try:
+            ensure_dir_exists(self.cache_dir)
+            cache_file = self.cache_file(ruleset.digest)
+            tmp_file = f"{cache_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'format': RULE_CACHE_FORMAT, 'rules': [rule.to_dict() for rule in ruleset.rules],
+                           'literals': ruleset.literals}, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+            for old_file in glob.glob(os.path.join(self.cache_dir, "*.json")):
+                if old_file != cache_file:
+                    os.remove(old_file)
+        except OSError:
+            pass
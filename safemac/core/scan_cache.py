@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Scan Cache
+Persistent per-file verdict cache so rescans skip unchanged files
+"""
+
+import hashlib
+import json
+import os
+from ..utils import ensure_dir_exists
+
+
+CACHE_FORMAT = 2
+
+
+def file_signature(stat_result):
+    """Identity of a file's content as seen by stat: (dev, ino, size, mtime_ns)"""
+    return [stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns]
+
+
+def ruleset_version(settings):
+    """Stable hash of everything that affects a file's pattern hits"""
+    payload = json.dumps(settings, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ScanCache:
+    """Maps file path -> (stat signature, pattern hits, stats) for one ruleset
+
+    The cache is a single JSON file under data/. Entries recorded under a
+    different ruleset version are discarded on load, so changing the
+    signatures always forces a fresh scan.
+    """
+
+    def __init__(self, cache_file, ruleset):
+        self.cache_file = cache_file
+        self.ruleset = ruleset
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Load the cache file, ignoring it if missing, corrupt or stale"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+
+        if data.get('format') == CACHE_FORMAT and data.get('ruleset') == self.ruleset:
+            self.entries = data.get('entries', {})
+        else:
+            self.dirty = True
+        return self
+
+    def lookup(self, file_path, signature):
+        """Return cached (pattern_hits, stats) if the file is unchanged, else None"""
+        entry = self.entries.get(file_path)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        return None
+
+    def store(self, file_path, signature, pattern_hits, stats=None):
+        """Record the pattern hits (and obfuscation stats) for a file"""
+        self.entries[file_path] = [signature, pattern_hits, stats]
+        self.dirty = True
+
+    def discard(self, file_path):
+        """Forget a single file"""
+        if self.entries.pop(file_path, None) is not None:
+            self.dirty = True
+
+    def prune_site(self, site_path, seen_paths, covers=None):
+        """Evict entries under a site that were not listed in this run
+
+        covers, when given, limits eviction to the paths it accepts, so a
+        check that lists only some file types keeps the others' entries.
+        """
+        prefix = site_path.rstrip('/') + '/'
+        stale = [path for path in self.entries
+                 if path.startswith(prefix) and path not in seen_paths
+                 and (covers is None or covers(path))]
+        for path in stale:
+            del self.entries[path]
+        if stale:
+            self.dirty = True
+        return len(stale)
+
+    def clear(self):
+        """Drop every entry, forcing a full rescan"""
+        self.entries = {}
+        self.dirty = True
+
+    def save(self):
+        """Write the cache back atomically if anything changed"""
+        if not self.dirty:
+            return
+
+        ensure_dir_exists(os.path.dirname(self.cache_file))
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'format': CACHE_FORMAT, 'ruleset': self.ruleset,
+                       'entries': self.entries}, f, separators=(',', ':'))
+        os.replace(tmp_file, self.cache_file)
+        self.dirty = False
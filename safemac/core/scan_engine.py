@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Scan Engine
+Spreads JavaScript/HTML and PHP file analysis across a pool of worker processes
+"""
+
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Per-process checker used by pool workers, built on the first task and
+# rebuilt whenever a task brings different settings
+_worker_checker = None
+_worker_settings = None
+
+
+def _get_worker_checker(settings):
+    """Return this worker process's checker for the parent's scan settings"""
+    global _worker_checker, _worker_settings
+    if _worker_checker is None or settings != _worker_settings:
+        from .virus_checker import MacCMSVirusChecker
+        _worker_checker = MacCMSVirusChecker()
+        _worker_checker.apply_scan_settings(settings)
+        _worker_settings = settings
+    return _worker_checker
+
+
+def _scan_in_worker(settings, file_path):
+    """Scan one file in a worker process, returns (pattern_hits, error, decision, stats, metrics)
+
+    settings travel with every task (ProcessPoolExecutor has no
+    initializer before Python 3.7). metrics holds what this file added to
+    the worker's timers and counters, or None when metrics are disabled.
+    """
+    checker = _get_worker_checker(settings)
+    metrics = checker.metrics
+    if not metrics.enabled:
+        return checker.scan_file(file_path) + (None,)
+    metrics.reset()
+    pattern_hits, error, decision, stats = checker.scan_file(file_path)
+    return pattern_hits, error, decision, stats, metrics.to_dict()
+
+
+def default_job_count():
+    """Number of worker processes to use when none is configured"""
+    return os.cpu_count() or 1
+
+
+class ParallelScanEngine:
+    """Runs MacCMSVirusChecker.scan_file over many JS/HTML and PHP files
+
+    Results are yielded in input order, so callers can print and log them
+    exactly as the serial loop would. With jobs <= 1 the files are scanned
+    in the calling process and no pool is started. Worker metrics are
+    merged into the checker's own, so totals match a serial run.
+
+    With a pool, files are handed out largest first so a few huge bundles
+    start early instead of leaving one worker busy after the rest are
+    idle. Files of at least large_file_size bytes are sent one at a time,
+    the rest in chunks of chunksize.
+    """
+
+    def __init__(self, checker, jobs=1, chunksize=16, large_file_size=256 * 1024):
+        self.checker = checker
+        self.jobs = jobs if jobs and jobs > 0 else default_job_count()
+        self.chunksize = chunksize
+        self.large_file_size = large_file_size
+
+    @staticmethod
+    def file_size(file_path):
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+
+    def schedule(self, file_paths, sizes=None):
+        """Split indexes into (large, small) lists, each largest first"""
+        if sizes is None:
+            sizes = [self.file_size(file_path) for file_path in file_paths]
+        order = sorted(range(len(file_paths)), key=lambda i: sizes[i], reverse=True)
+        split = 0
+        while split < len(order) and sizes[order[split]] >= self.large_file_size:
+            split += 1
+        return order[:split], order[split:]
+
+    def scan(self, file_paths, sizes=None):
+        """Yield (pattern_hits, error, decision, stats) for every path, in order
+
+        sizes, when given, holds the already known size of each path.
+        """
+        file_paths = [str(path) for path in file_paths]
+
+        if self.jobs <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                yield self.checker.scan_file(file_path)
+            return
+
+        large, small = self.schedule(file_paths, sizes)
+        scan = functools.partial(_scan_in_worker, self.checker.get_scan_settings())
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            # Both maps are submitted up front, large files first
+            batches = [
+                (large, executor.map(scan, [file_paths[i] for i in large], chunksize=1)),
+                (small, executor.map(scan, [file_paths[i] for i in small], chunksize=self.chunksize)),
+            ]
+
+            # Results arrive in schedule order; hand them out in input order
+            done = {}
+            next_index = 0
+            for indexes, results in batches:
+                for index, result in zip(indexes, results):
+                    if result[-1] is not None:
+                        self.checker.metrics.merge(result[-1])
+                    done[index] = result[:-1]
+                    while next_index in done:
+                        yield done.pop(next_index)
+                        next_index += 1
@@ -7,8 +7,9 @@ Scans common web server paths and detects MacCMS installations
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from ..utils import Colors, print_colored, get_script_dir, ensure_dir_exists, write_site_list
+from ..utils import Colors, print_colored, get_script_dir, ensure_dir_exists, write_site_list, TreeWalker
 
 
 class MacCMSSiteScanner:
@@ -44,32 +45,79 @@ class MacCMSSiteScanner:
             "api.php",
             "install.php"
         ]
+        
+        # How deep below each scan root to look for sites (None = no limit)
+        self.max_depth = None
+        
+        # Scan roots walked concurrently
+        self.jobs = 4
     
-    def is_maccms_site(self, directory):
-        """Check if a directory contains a MacCMS installation"""
+    def is_maccms_site(self, directory, names=None):
+        """Check if a directory contains a MacCMS installation
+
+        names is the set of entry names already listed for the directory;
+        when given, no extra stat calls are made.
+        """
         dir_path = Path(directory)
-        if not dir_path.exists() or not dir_path.is_dir():
-            return False
+        if names is None:
+            if not dir_path.exists() or not dir_path.is_dir():
+                return False
+            
+            def has(name):
+                return (dir_path / name).exists()
+        else:
+            def has(name):
+                return name in names
         
         score = 0
         
         # Special case for demo directory (for testing)
-        if dir_path.name == "demo" and (dir_path / "application").exists():
+        if dir_path.name == "demo" and has("application"):
             return True
         
         # Check for characteristic directories
         for feature_dir in self.maccms_dirs:
-            if (dir_path / feature_dir).exists():
+            if has(feature_dir):
                 score += 1
         
         # Check for characteristic files
         for feature_file in self.maccms_files:
-            if (dir_path / feature_file).exists():
+            if has(feature_file):
                 score += 1
         
         # If at least 2 features match, consider it MacCMS
         return score >= 2
     
+    def get_scan_roots(self):
+        """Return (roots, skipped): existing scan paths with nested ones removed
+
+        Paths are resolved first, so /home swallows /home/www and
+        /home/wwwroot and each tree is walked exactly once. skipped maps
+        each dropped path to the root that already covers it.
+        """
+        resolved = {}
+        for base_path in self.common_paths:
+            if os.path.isdir(base_path):
+                resolved.setdefault(base_path, os.path.realpath(base_path))
+        
+        # Shortest real paths first, so ancestors are kept before descendants
+        kept = {}
+        skipped = {}
+        for base_path, real_path in sorted(resolved.items(), key=lambda item: len(item[1])):
+            covering = None
+            for root_path, root_real in kept.items():
+                if real_path == root_real or real_path.startswith(root_real.rstrip('/') + '/'):
+                    covering = root_path
+                    break
+            if covering is None:
+                kept[base_path] = real_path
+            else:
+                skipped[base_path] = covering
+        
+        # Keep the configured order for the roots that remain
+        roots = [base_path for base_path in resolved if base_path in kept]
+        return roots, skipped
+    
     def find_sites_in_path(self, base_path):
         """Find MacCMS sites in a given base path"""
         sites = []
@@ -79,16 +127,20 @@ class MacCMSSiteScanner:
         
         try:
             # Look for directories containing MacCMS characteristic directories
-            for root, dirs, files in os.walk(base_path):
+            for listing in TreeWalker(max_depth=self.max_depth).walk(base_path):
+                dir_names = {entry.name for entry in listing.dirs}
+                
                 # Check if any of the MacCMS directories exist in current directory
                 has_maccms_feature = any(
-                    feature_dir in dirs for feature_dir in self.maccms_dirs
+                    feature_dir in dir_names for feature_dir in self.maccms_dirs
                 )
                 
-                if has_maccms_feature and self.is_maccms_site(root):
-                    sites.append(root)
-                    # Don't scan subdirectories of found MacCMS sites
-                    dirs.clear()
+                if has_maccms_feature:
+                    names = dir_names.union(entry.name for entry in listing.files)
+                    if self.is_maccms_site(listing.path, names):
+                        sites.append(listing.path)
+                        # Don't scan subdirectories of found MacCMS sites
+                        listing.dirs.clear()
         
         except PermissionError:
             print_colored(f"权限不足，跳过: {base_path}", Colors.YELLOW)
@@ -105,15 +157,22 @@ class MacCMSSiteScanner:
         ensure_dir_exists(self.data_dir)
         
         all_sites = []
+        roots, skipped = self.get_scan_roots()
         
-        for base_path in self.common_paths:
-            if os.path.exists(base_path):
+        for base_path in dict.fromkeys(self.common_paths):
+            if base_path in skipped:
+                print_colored(f"已包含在 {skipped[base_path]} 中，跳过: {base_path}", Colors.YELLOW)
+            elif base_path in roots:
                 print_colored(f"扫描路径: {base_path}", Colors.YELLOW)
-                sites = self.find_sites_in_path(base_path)
-                all_sites.extend(sites)
             else:
                 print_colored(f"路径不存在，跳过: {base_path}", Colors.YELLOW)
         
+        # Independent roots are walked concurrently
+        if roots:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(roots)))) as executor:
+                for sites in executor.map(self.find_sites_in_path, roots):
+                    all_sites.extend(sites)
+        
         # Remove duplicates and sort
         unique_sites = sorted(list(set(all_sites)))
         
@@ -6,13 +6,33 @@ Comprehensive virus detection for MacCMS installations
 Combines PHP and JavaScript virus detection functionality
 """
 
+import mmap
 import os
-import re
 import sys
 from datetime import datetime
+from collections import namedtuple
 from pathlib import Path
+from .allowlist import HashAllowlist
+from .findings import FindingsWriter
+from .history import FindingsHistory
+from .matcher import SignatureMatcher
+from .obfuscation import ObfuscationStats, SCORE_VERSION, content_stats
+from .pipeline import SiteCheckPipeline
+from .rule_pack import RulePackLoader, RulePackError, RuleSet
+from .scan_cache import ScanCache, file_signature, ruleset_version
+from .read_ahead import ReadAheadScanEngine
+from .scan_engine import ParallelScanEngine
 from ..utils import (Colors, print_colored, print_header, confirm_action, 
-                     get_script_dir, read_site_list, ensure_dir_exists, pause_for_user)
+                     get_script_dir, read_site_list, ensure_dir_exists, pause_for_user,
+                     TreeWalker, Metrics, join_rel)
+
+
+# Files found by one walk of a site (see MacCMSVirusChecker.walk_site)
+SiteFiles = namedtuple('SiteFiles', ['js', 'php', 'present'])
+
+# scan_file result for a file gone between listing and scanning; every
+# scan result has this shape: (pattern_hits, error, decision, stats)
+MISSING_FILE = (None, None, None, None)
 
 
 class MacCMSVirusChecker:
@@ -36,192 +56,796 @@ return array (
   ),
 );'''
         
-        # JavaScript virus patterns
-        self.js_virus_patterns = {
-            'navigator.platform': r'navigator\.platform',
-            'base64': r'base64',
-            'hex_string': r'\\\\x[0-9a-fA-F]{2}',
-            'appendChild': r'appendChild',
-            'Mac|Win': r'Mac\|Win'
+        # Detection rules come from the rule packs in data/rules; the
+        # validated packs are cached in data/rule_cache, keyed by pack hash
+        self.rules_dir = os.path.join(self.data_dir, "rules")
+        self.rule_cache_dir = os.path.join(self.data_dir, "rule_cache")
+        self.rules_error = None
+        self.rules = self.load_rules()
+        
+        # JavaScript virus patterns (rule id -> regex) from the packs
+        self.js_virus_patterns = self.rules.js_patterns()
+        self.js_case_sensitive = self.rules.js_case_sensitive()
+        # Prefilter literal of every matcher rule (JS and PHP), keyed by
+        # pattern source
+        self.js_literals = dict(self.rules.literals)
+        
+        # Precompiled matcher for the patterns above, built on first use so
+        # edits to js_virus_patterns after construction are still honoured
+        self._js_matcher = None
+        
+        # PHP webshell content rules (rule id -> regex), run on every file
+        # with a php_extensions suffix. php_rule_dirs maps rule id -> site
+        # directories: dir rules fire on any PHP file below them, content
+        # rules with paths only count inside them
+        self.php_webshell_patterns = self.rules.patterns('php_webshell')
+        self.php_case_sensitive = self.rules.case_sensitive('php_webshell')
+        self.php_rule_dirs = {rule.id: [path.strip('/') for path in rule.paths]
+                              for rule in self.rules.for_check('php_webshell') if rule.paths}
+        self.php_extensions = ('.php', '.phtml', '.php3', '.php4', '.php5', '.php7', '.pht', '.phar')
+        self._php_matcher = None
+        
+        # The PHP walk also enters upload directories (PHP there is itself
+        # suspicious) and only skips these logs and caches
+        self.php_scan_exclude_dirs = [
+            "runtime/log",
+            "runtime/cache",
+        ]
+        
+        # When True only report whether each pattern occurs (1/0) and stop
+        # scanning a file as soon as every pattern has been seen once
+        self.js_presence_only = False
+        
+        # Files larger than js_stream_threshold are scanned through mmap in
+        # windows of js_stream_window bytes (plus js_stream_overlap bytes of
+        # look-ahead), so peak memory does not grow with the file size
+        self.js_stream_threshold = 8 * 1024 * 1024
+        self.js_stream_window = 1024 * 1024
+        self.js_stream_overlap = 4096
+        
+        # Size policy for files above js_max_size bytes (None = no limit):
+        # 'scan' scans them whole, 'skip' skips them and 'head_tail' only
+        # scans the first and last js_head_tail_bytes. With js_skip_binary
+        # files whose first js_sniff_bytes contain a NUL byte are skipped
+        # as binary. Every decision is recorded in the site's findings
+        self.js_max_size = None
+        self.js_size_policy = 'skip'
+        self.js_head_tail_bytes = 1024 * 1024
+        self.js_skip_binary = False
+        self.js_sniff_bytes = 8192
+        
+        # Obfuscation scoring (entropy, escapes, symbols, line length) of
+        # every fully read file; files scoring at least obfuscation_threshold
+        # are reported and the obfuscation_top highest scores of each site
+        # are logged, riskiest first
+        self.obfuscation_scoring = True
+        self.obfuscation_threshold = 60
+        self.obfuscation_top = 50
+        
+        # Worker processes used for JS/HTML analysis (1 = scan in-process,
+        # 0 = one per CPU core)
+        self.jobs = 1
+        
+        # Read-ahead for in-process scans (jobs = 1) of slow or network
+        # mounted webroots: read_ahead files are fetched ahead of matching by
+        # read_threads reader threads, with at most mount_read_limits[mount]
+        # (else mount_read_default, None = no limit) reads per mount at once.
+        # 0 turns read-ahead off
+        self.read_ahead = 0
+        self.read_threads = 8
+        self.mount_read_limits = {}
+        self.mount_read_default = None
+        
+        # Incremental scan cache: unchanged files reuse their stored hits.
+        # force_rescan ignores stored hits (but still refreshes the cache)
+        self.use_scan_cache = True
+        self.force_rescan = False
+        self.scan_cache_file = os.path.join(self.data_dir, "scan_cache.json")
+        
+        # Known-clean files (by size, then SHA-256) are skipped without
+        # running any pattern; build the list with "main.py allowlist-build"
+        self.use_allowlist = True
+        self.allowlist_file = os.path.join(self.data_dir, "allowlist.json")
+        self._allowlist = None
+        
+        # Cache and upload directories (relative to the site root) that the
+        # JS/HTML file search does not descend into
+        self.scan_exclude_dirs = [
+            "runtime",
+            "upload",
+            "uploads",
+            "static/upload",
+            "public/upload",
+            "public/uploads",
+            "public/static/upload"
+        ]
+        
+        # Findings logs: findings_top_k keeps only the worst N files per
+        # pattern (None = all), findings_jsonl also writes findings.jsonl
+        self.findings_top_k = None
+        self.findings_jsonl = False
+        
+        # Optional SQLite history of JS findings across runs (query it with
+        # "main.py history ...")
+        self.use_history = False
+        self.history_file = os.path.join(self.data_dir, "history.db")
+        
+        # Headless operation: assume_yes answers every prompt (None = ask,
+        # True = apply remediation, False = report only) and result_handler
+        # receives every finding as result_handler(event, **fields)
+        self.assume_yes = None
+        self.result_handler = None
+        
+        # Run timers and counters, only collected when a report was asked
+        # for; profile_rules additionally times every rule on its own
+        self.metrics = Metrics()
+        self.profile_rules = False
+    
+    def load_rules(self):
+        """Load the rule packs
+
+        Returns an empty RuleSet and sets rules_error if they are invalid;
+        every check then refuses to run (see require_rules).
+        """
+        try:
+            return RulePackLoader(self.rules_dir, self.rule_cache_dir).load()
+        except (OSError, RulePackError) as e:
+            self.rules_error = str(e)
+            print_colored(f"加载规则包失败: {e}", Colors.RED)
+            return RuleSet([])
+    
+    def require_rules(self):
+        """Refuse to scan with invalid rule packs instead of reporting clean sites"""
+        if self.rules_error is not None:
+            raise RulePackError(f"规则包无效，拒绝运行检查: {self.rules_error}")
+    
+    def confirm(self, prompt):
+        """Ask for confirmation unless running headless"""
+        if self.assume_yes is None:
+            return confirm_action(prompt)
+        return self.assume_yes
+    
+    def emit(self, event, **fields):
+        """Forward a result event to result_handler, if one is set"""
+        if self.result_handler is not None:
+            self.result_handler(event, **fields)
+    
+    def get_scan_settings(self):
+        """Return the settings a worker process needs to scan like this checker"""
+        return {
+            'js_virus_patterns': dict(self.js_virus_patterns),
+            'js_case_sensitive': list(self.js_case_sensitive),
+            'js_literals': dict(self.js_literals),
+            'php_webshell_patterns': dict(self.php_webshell_patterns),
+            'php_case_sensitive': list(self.php_case_sensitive),
+            'php_extensions': tuple(self.php_extensions),
+            'js_presence_only': self.js_presence_only,
+            'js_stream_threshold': self.js_stream_threshold,
+            'js_stream_window': self.js_stream_window,
+            'js_stream_overlap': self.js_stream_overlap,
+            'js_max_size': self.js_max_size,
+            'js_size_policy': self.js_size_policy,
+            'js_head_tail_bytes': self.js_head_tail_bytes,
+            'js_skip_binary': self.js_skip_binary,
+            'js_sniff_bytes': self.js_sniff_bytes,
+            'obfuscation_scoring': self.obfuscation_scoring,
+            'use_allowlist': self.use_allowlist,
+            'allowlist_file': self.allowlist_file,
+            'profile_rules': self.profile_rules,
+            'metrics_enabled': self.metrics.enabled,
         }
     
+    def apply_scan_settings(self, settings):
+        """Apply settings produced by get_scan_settings"""
+        for key, value in settings.items():
+            if key == 'metrics_enabled':
+                self.metrics.enabled = value
+            else:
+                setattr(self, key, value)
+    
+    def get_allowlist(self):
+        """Return the loaded known-good allowlist, or None if disabled or empty"""
+        if not self.use_allowlist:
+            return None
+        if self._allowlist is None or self._allowlist.allowlist_file != self.allowlist_file:
+            self._allowlist = HashAllowlist(self.allowlist_file).load()
+        return self._allowlist if len(self._allowlist) else None
+    
+    def open_scan_cache(self):
+        """Load the scan cache for the current ruleset, or None if disabled"""
+        if not self.use_scan_cache:
+            return None
+        
+        allowlist = self.get_allowlist()
+        ruleset = ruleset_version({
+            'js_virus_patterns': self.js_virus_patterns,
+            'js_case_sensitive': sorted(self.js_case_sensitive),
+            'js_presence_only': self.js_presence_only,
+            'php_webshell_patterns': self.php_webshell_patterns,
+            'php_case_sensitive': sorted(self.php_case_sensitive),
+            'js_size_policy': [self.js_max_size, self.js_size_policy, self.js_head_tail_bytes,
+                               self.js_skip_binary, self.js_sniff_bytes],
+            'obfuscation_scoring': SCORE_VERSION if self.obfuscation_scoring else None,
+            'allowlist': allowlist.version() if allowlist is not None else None,
+        })
+        cache = ScanCache(self.scan_cache_file, ruleset).load()
+        if self.force_rescan:
+            cache.clear()
+        return cache
+    
+    def scan_files_cached(self, engine, file_paths, cache):
+        """Yield (pattern_hits, error, decision, stats) per file, skipping unchanged files
+
+        Files whose (device, inode, size, mtime_ns) match the cache are not
+        opened; everything else goes through the scan engine and the fresh
+        result is stored back. Only complete scans are cached, so files
+        skipped or partly scanned by the size policy are decided again (and
+        recorded again) on every run.
+        """
+        if cache is None:
+            yield from engine.scan(file_paths)
+            return
+        
+        # Stat every file first; only the ones that changed get scanned
+        plan = []
+        for file_path in file_paths:
+            file_path = str(file_path)
+            try:
+                signature = file_signature(os.stat(file_path))
+            except OSError:
+                cache.discard(file_path)
+                plan.append((file_path, None, None))
+                continue
+            plan.append((file_path, signature, cache.lookup(file_path, signature)))
+        
+        to_scan = [(file_path, signature) for file_path, signature, cached in plan
+                   if signature is not None and cached is None]
+        scanned = engine.scan([file_path for file_path, _ in to_scan],
+                              sizes=[signature[2] for _, signature in to_scan])
+        
+        for file_path, signature, cached in plan:
+            if signature is None:
+                yield None, None, None, None
+            elif cached is not None:
+                pattern_hits, stats = cached
+                yield pattern_hits, None, None, stats
+            else:
+                pattern_hits, error, decision, stats = next(scanned)
+                if pattern_hits is not None and error is None and decision is None:
+                    cache.store(file_path, signature, pattern_hits, stats)
+                yield pattern_hits, error, decision, stats
+        
+        scanned.close()
+    
+    def open_history(self):
+        """Open the history database and start a run, returns (history, run_id)
+
+        Returns (None, None) when history is disabled or unusable.
+        """
+        if not self.use_history:
+            return None, None
+        try:
+            history = FindingsHistory(self.history_file).open()
+            return history, history.begin_run('check')
+        except Exception as e:
+            print_colored(f"打开历史数据库失败，本次不记录历史: {e}", Colors.YELLOW)
+            return None, None
+    
+    def record_history(self, history, run_id, site, files, findings):
+        """Store one site's findings, reporting database errors"""
+        if history is None:
+            return
+        try:
+            history.record_site(run_id, site, files, findings)
+        except Exception as e:
+            print_colored(f"写入历史数据库失败 {site}: {e}", Colors.YELLOW)
+    
+    def get_js_matcher(self):
+        """Return the precompiled matcher for js_virus_patterns"""
+        if (self._js_matcher is None or self._js_matcher.patterns != self.js_virus_patterns
+                or self._js_matcher.case_sensitive != set(self.js_case_sensitive)):
+            self._js_matcher = SignatureMatcher(self.js_virus_patterns, case_sensitive=self.js_case_sensitive,
+                                                known_literals=self.js_literals)
+        return self._js_matcher
+    
+    def get_php_matcher(self):
+        """Return the precompiled matcher for php_webshell_patterns"""
+        if (self._php_matcher is None or self._php_matcher.patterns != self.php_webshell_patterns
+                or self._php_matcher.case_sensitive != set(self.php_case_sensitive)):
+            self._php_matcher = SignatureMatcher(self.php_webshell_patterns,
+                                                 case_sensitive=self.php_case_sensitive,
+                                                 known_literals=self.js_literals)
+        return self._php_matcher
+    
     def check_php_active_system(self, sites):
         """Check for PHP active.php and system.php virus files"""
+        self.require_rules()
         print_header("PHP Active/System 文件检查")
         
         if not sites:
             print_colored("站点列表为空", Colors.YELLOW)
-            return
+            return 0
+        
+        total_found = 0
         
         for site in sites:
             if not site.strip():
                 continue
             
             print_colored(f"检查站点: {site}", Colors.YELLOW)
-            
-            # Files to check
-            active_file = os.path.join(site, "application", "extra", "active.php")
-            system_file = os.path.join(site, "application", "extra", "system.php")
-            
-            found_virus = False
-            
-            # Check active.php
-            if os.path.exists(active_file):
-                print_colored("命中病毒规则: system-active", Colors.RED)
-                print_colored(f"发现可疑文件: {active_file}", Colors.RED)
-                found_virus = True
+            total_found += self.check_site_active_system(site)
+            print()
+        
+        print_colored("PHP Active/System 文件检查完成", Colors.GREEN)
+        return total_found
+    
+    def check_site_active_system(self, site, exists=os.path.exists):
+        """Run the path rules on one site, returns the number of hits
+
+        exists(path) tells whether a file is present; the full check passes
+        one backed by its own traversal so no extra stat is needed.
+        """
+        found = 0
+        
+        # Path rules: the file existing at all is the infection
+        for rule in self.rules.for_check('php_active_system'):
+            for suspect_file in rule.site_paths(site):
+                if not exists(suspect_file):
+                    continue
                 
-                if confirm_action("是否将此文件移动到安全位置？"):
-                    backup_file = active_file.replace('.php', '.lock')
-                    try:
-                        os.rename(active_file, backup_file)
-                        print_colored(f"文件已移动到: {backup_file}", Colors.GREEN)
-                        print_colored(f"如果出现问题，可以将文件 {backup_file} 重命名为 {active_file} 还原", Colors.YELLOW)
-                    except Exception as e:
-                        print_colored(f"移动文件失败: {e}", Colors.RED)
-                print()
-            
-            # Check system.php
-            if os.path.exists(system_file):
-                print_colored("命中病毒规则: system-active", Colors.RED)
-                print_colored(f"发现可疑文件: {system_file}", Colors.RED)
-                found_virus = True
+                print_colored(f"命中病毒规则: {rule.title}", Colors.RED)
+                print_colored(f"发现可疑文件: {suspect_file}", Colors.RED)
+                found += 1
+                action = 'none'
                 
-                if confirm_action("是否将此文件移动到安全位置？"):
-                    backup_file = system_file.replace('.php', '.lock')
+                if rule.action == 'quarantine' and self.confirm("是否将此文件移动到安全位置？"):
+                    backup_file = suspect_file.replace('.php', '.lock')
                     try:
-                        os.rename(system_file, backup_file)
+                        os.rename(suspect_file, backup_file)
+                        action = 'moved'
                         print_colored(f"文件已移动到: {backup_file}", Colors.GREEN)
-                        print_colored(f"如果出现问题，可以将文件 {backup_file} 重命名为 {system_file} 还原", Colors.YELLOW)
+                        print_colored(f"如果出现问题，可以将文件 {backup_file} 重命名为 {suspect_file} 还原", Colors.YELLOW)
                     except Exception as e:
+                        action = 'failed'
                         print_colored(f"移动文件失败: {e}", Colors.RED)
+                self.emit('finding', check='php_active_system', site=site, file=suspect_file,
+                          rule=rule.id, action=action)
                 print()
-            
-            if not found_virus:
-                print_colored("未发现 active/system 病毒文件", Colors.GREEN)
-            
-            print()
         
-        print_colored("PHP Active/System 文件检查完成", Colors.GREEN)
+        if not found:
+            print_colored("未发现 active/system 病毒文件", Colors.GREEN)
+        return found
     
     def check_php_addons_hijack(self, sites):
         """Check for PHP addons.php hijacking"""
+        self.require_rules()
         print_header("PHP Addons 劫持检查")
         
         if not sites:
             print_colored("站点列表为空", Colors.YELLOW)
-            return
+            return 0
+        
+        total_found = 0
         
         for site in sites:
             if not site.strip():
                 continue
             
             print_colored(f"检查站点: {site}", Colors.YELLOW)
+            total_found += self.check_site_addons_hijack(site)
+            print()
+        
+        print_colored("PHP Addons 劫持检查完成", Colors.GREEN)
+        return total_found
+    
+    def check_site_addons_hijack(self, site, exists=os.path.exists):
+        """Run the addons content rules on one site, returns the number of hits
+
+        Each target file is read once, however many rules look at it.
+        """
+        found = 0
+        contents = {}
+        
+        for rule in self.rules.for_check('php_addons_hijack'):
+            # The first existing path is checked (addones.php is the
+            # file name used by the virus sample)
+            candidates = rule.site_paths(site)
+            target_file = next((path for path in candidates if exists(path)), None)
             
-            # Check both possible file names
-            addons_file = os.path.join(site, "application", "extra", "addons.php")
-            addones_file = os.path.join(site, "application", "extra", "addones.php")  # virus sample filename
-            
-            target_file = None
-            if os.path.exists(addons_file):
-                target_file = addons_file
-            elif os.path.exists(addones_file):
-                target_file = addones_file
+            if not target_file:
+                names = " 或 ".join(os.path.basename(path) for path in candidates)
+                print_colored(f"未找到 {names} 文件", Colors.YELLOW)
+                continue
             
-            if target_file:
-                try:
-                    with open(target_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
+            try:
+                content = contents.get(target_file)
+                if content is None:
+                    with open(target_file, 'rb') as f:
+                        content = contents[target_file] = f.read()
+                
+                if rule.matches(content):
+                    print_colored(f"命中病毒规则: {rule.title}", Colors.RED)
+                    print_colored(f"发现可疑文件: {target_file}", Colors.RED)
+                    print()
+                    found += 1
+                    action = 'none'
                     
-                    # Check if file contains ThinkPHP (possible hijack signature)
-                    if 'ThinkPHP' in content:
-                        print_colored("命中病毒规则: addons劫持", Colors.RED)
-                        print_colored(f"发现可疑文件: {target_file}", Colors.RED)
-                        print()
-                        
+                    if rule.action == 'restore_addons':
                         print_colored("注意: 如果覆盖，会导致插件被禁用，安装插件的用户勿用。", Colors.YELLOW)
-                        if confirm_action("是否用干净文件覆盖？"):
+                        if self.confirm("是否用干净文件覆盖？"):
                             # Backup original file
                             backup_file = target_file.replace('.php', '.lock')
                             try:
                                 # Create backup
-                                with open(backup_file, 'w', encoding='utf-8') as f:
+                                with open(backup_file, 'wb') as f:
                                     f.write(content)
                                 print_colored(f"原文件已备份到: {backup_file}", Colors.GREEN)
-                                
+                            
                                 # Write clean content
                                 with open(target_file, 'w', encoding='utf-8') as f:
                                     f.write(self.clean_addons_content)
+                                contents.pop(target_file, None)
+                                action = 'overwritten'
                                 print_colored("已用干净文件覆盖", Colors.GREEN)
                                 print_colored(f"如果出现问题，可以删除文件 {target_file}，然后将 {backup_file} 重命名为 {target_file} 还原", Colors.YELLOW)
                             except Exception as e:
+                                action = 'failed'
                                 print_colored(f"处理文件失败: {e}", Colors.RED)
-                    else:
-                        print_colored("addons.php 文件正常", Colors.GREEN)
-                
-                except Exception as e:
-                    print_colored(f"读取文件失败 {target_file}: {e}", Colors.RED)
-            else:
-                print_colored("未找到 addons.php 或 addones.php 文件", Colors.YELLOW)
+                    self.emit('finding', check='php_addons_hijack', site=site, file=target_file,
+                              rule=rule.id, action=action)
+                else:
+                    print_colored(f"{os.path.basename(target_file)} 文件正常", Colors.GREEN)
             
-            print()
+            except Exception as e:
+                print_colored(f"读取文件失败 {target_file}: {e}", Colors.RED)
+                self.emit('error', check='php_addons_hijack', site=site, file=target_file, error=str(e))
         
-        print_colored("PHP Addons 劫持检查完成", Colors.GREEN)
+        return found
     
-    def find_js_and_html_files(self, site_path):
-        """Find JavaScript and HTML files in a site"""
+    def php_rule_paths(self):
+        """Site-relative paths named by the PHP path and addons rules"""
+        paths = set()
+        for check in ('php_active_system', 'php_addons_hijack'):
+            for rule in self.rules.for_check(check):
+                paths.update(rule.paths)
+        return paths
+    
+    def walk_site(self, site_path, wanted_paths=(), php=False):
+        """Traverse a site once, returns SiteFiles(js, php, present)
+
+        js are the JS/HTML files the JS check covers, php the files the PHP
+        webshell check covers (only listed with php=True, which makes the
+        walk enter upload directories too) and present the subset of the
+        site-relative wanted_paths seen on the way.
+        """
         js_files = []
         html_files = []
+        php_files = []
+        present = set()
+        wanted_paths = set(wanted_paths)
+        js_excluded = set(path.strip('/') for path in self.scan_exclude_dirs)
+        
+        def on_error(e):
+            print_colored(f"搜索文件时出错: {e}", Colors.RED)
+        
+        walker = TreeWalker(exclude_dirs=self.php_scan_exclude_dirs if php else self.scan_exclude_dirs,
+                            on_error=on_error)
+        
+        # One walk: all .js files, plus .html files anywhere below a template dir
+        for listing in walker.walk(site_path):
+            parts = listing.rel_path.split('/') if listing.rel_path else []
+            in_template = 'template' in parts
+            js_dir = not any('/'.join(parts[:i]) in js_excluded for i in range(1, len(parts) + 1))
+            for entry in listing.files:
+                if js_dir and entry.name.endswith('.js'):
+                    js_files.append(Path(entry.path))
+                elif js_dir and in_template and entry.name.endswith('.html'):
+                    html_files.append(Path(entry.path))
+                elif php and entry.name.endswith(self.php_extensions):
+                    php_files.append(Path(entry.path))
+                if wanted_paths and join_rel(listing.rel_path, entry.name) in wanted_paths:
+                    present.add(join_rel(listing.rel_path, entry.name))
+        
+        return SiteFiles(js_files + html_files, php_files, present)
+    
+    def find_js_and_html_files(self, site_path):
+        """Find JavaScript and HTML files in a site"""
+        return self.walk_site(site_path).js
+    
+    def find_php_files(self, site_path):
+        """Find the PHP files the webshell check covers, upload dirs included"""
+        return self.walk_site(site_path, php=True).php
+    
+    def is_js_target(self, rel_path):
+        """Check whether a site-relative file path is covered by the JS check"""
+        parts = rel_path.split('/')
+        excluded = set(path.strip('/') for path in self.scan_exclude_dirs)
+        if any('/'.join(parts[:i]) in excluded for i in range(1, len(parts))):
+            return False
+        if parts[-1].endswith('.js'):
+            return True
+        return parts[-1].endswith('.html') and 'template' in parts[:-1]
+    
+    def is_php_target(self, rel_path):
+        """Check whether a site-relative file path is covered by the PHP webshell check"""
+        parts = rel_path.split('/')
+        excluded = set(path.strip('/') for path in self.php_scan_exclude_dirs)
+        if any('/'.join(parts[:i]) in excluded for i in range(1, len(parts))):
+            return False
+        return parts[-1].endswith(self.php_extensions)
+    
+    def size_decision(self, size):
+        """Size policy for a file of size bytes: None (scan whole), 'skip' or 'head_tail'"""
+        if self.js_max_size is None or size <= self.js_max_size or self.js_size_policy == 'scan':
+            return None
+        return self.js_size_policy
+    
+    def is_binary(self, file_path):
+        """Check the first js_sniff_bytes of a file for NUL bytes"""
+        with open(file_path, 'rb') as f:
+            return b'\0' in f.read(self.js_sniff_bytes)
+    
+    def new_stats(self, size):
+        """Return an ObfuscationStats to feed, or None when scoring is off"""
+        return ObfuscationStats(size) if self.obfuscation_scoring else None
+    
+    def scan_js_file(self, file_path, presence_only=None, content=None):
+        """Scan a file for virus patterns, returns (pattern_hits, error, decision, stats)
+
+        Never prints, so it can run in a worker process; pattern_hits is
+        None when the file has disappeared since it was listed. decision is
+        None for a complete scan, otherwise 'skipped_size',
+        'skipped_binary' or 'head_tail' (see js_max_size). stats holds the
+        obfuscation statistics and score of the bytes read (see
+        ObfuscationStats), or None when scoring is off or nothing was read.
+        content, when given, is the file's bytes already read ahead (see
+        wants_content) and the file is not opened again.
+        """
+        if presence_only is None:
+            presence_only = self.js_presence_only
+        metrics = self.metrics
         
         try:
-            site_dir = Path(site_path)
+            if content is not None:
+                size = len(content)
+            elif not os.path.exists(file_path):
+                return MISSING_FILE
+            else:
+                size = os.path.getsize(file_path)
+            
+            # Byte-identical to a known-clean release file: nothing to match
+            allowlist = self.get_allowlist()
+            if allowlist is not None and allowlist.may_contain(size):
+                with metrics.time('phase', phase='allowlist'):
+                    if content is None:
+                        known = allowlist.lookup(file_path, size) is not None
+                    else:
+                        known = allowlist.lookup_content(content) is not None
+                if known:
+                    metrics.incr('allowlist_hits')
+                    return self.get_js_matcher().empty_result(), None, None, None
+            
+            policy = self.size_decision(size)
+            if policy == 'skip':
+                metrics.incr('size_decisions', decision='skipped_size')
+                return self.get_js_matcher().empty_result(), None, 'skipped_size', None
+            
+            # Small files are sniffed from the content they are read into
+            if self.js_skip_binary and (policy is not None or size > self.js_stream_threshold):
+                if self.is_binary(file_path):
+                    metrics.incr('size_decisions', decision='skipped_binary')
+                    return self.get_js_matcher().empty_result(), None, 'skipped_binary', None
+            
+            if policy == 'head_tail':
+                stats = self.new_stats(min(size, 2 * self.js_head_tail_bytes))
+                with metrics.time('phase', phase='head_tail'):
+                    pattern_hits = self.analyze_head_tail(file_path, size, presence_only, stats=stats)
+                metrics.incr('files_read', mode='head_tail')
+                metrics.incr('bytes_read', min(size, 2 * self.js_head_tail_bytes), mode='head_tail')
+                metrics.incr('size_decisions', decision='head_tail')
+                return pattern_hits, None, 'head_tail', stats and stats.result()
+            
+            if content is None and size > self.js_stream_threshold:
+                stats = self.new_stats(size)
+                with metrics.time('phase', phase='stream'):
+                    pattern_hits = self.analyze_large_file(file_path, presence_only, stats=stats)
+                metrics.incr('files_read', mode='stream')
+                metrics.incr('bytes_read', size, mode='stream')
+                return pattern_hits, None, None, stats and stats.result()
+            
+            if content is None:
+                with metrics.time('phase', phase='read'):
+                    # Signatures are matched on the raw bytes, nothing is decoded
+                    with open(file_path, 'rb') as f:
+                        content = f.read()
+                metrics.incr('files_read', mode='read')
+                metrics.incr('bytes_read', size, mode='read')
             
-            # Find all .js files
-            js_files = list(site_dir.rglob('*.js'))
+            if self.js_skip_binary and content.find(b'\0', 0, self.js_sniff_bytes) != -1:
+                metrics.incr('size_decisions', decision='skipped_binary')
+                return self.get_js_matcher().empty_result(), None, 'skipped_binary', None
             
-            # Find HTML files specifically in template directories
-            for template_dir in site_dir.rglob('template'):
-                if template_dir.is_dir():
-                    html_files.extend(template_dir.rglob('*.html'))
+            # Check all virus patterns in a single pass
+            matcher = self.get_js_matcher()
+            with metrics.time('phase', phase='match'):
+                pattern_hits = matcher.presence(content) if presence_only else matcher.count(content)
+            if metrics.enabled:
+                for name, hits in pattern_hits.items():
+                    if hits:
+                        metrics.incr('rule_hits', hits, rule=name)
+                if self.profile_rules:
+                    for name, seconds in matcher.profile(content).items():
+                        metrics.add_time('rule_match', seconds, rule=name)
+            return pattern_hits, None, None, self.score_content(content)
         
         except Exception as e:
-            print_colored(f"搜索文件时出错: {e}", Colors.RED)
-        
-        return js_files + html_files
+            metrics.incr('scan_errors')
+            return {}, str(e), None, None
     
-    def analyze_js_file(self, file_path):
-        """Analyze a JavaScript or HTML file for virus patterns"""
-        pattern_hits = {}
+    def score_content(self, content):
+        """Obfuscation statistics of a file's bytes, or None when scoring is off"""
+        if not self.obfuscation_scoring:
+            return None
+        with self.metrics.time('phase', phase='score'):
+            return content_stats(content)
+    
+    def scan_file(self, file_path, content=None):
+        """Scan a JS/HTML or PHP file with the matching rules (see scan_js_file)"""
+        if str(file_path).endswith(self.php_extensions):
+            return self.scan_php_file(file_path, content)
+        return self.scan_js_file(file_path, content=content)
+    
+    def wants_content(self, file_path, size):
+        """Check whether scan_file reads a file whole, so it can be read ahead
+
+        Files the size policy skips or cuts, and files streamed through
+        mmap, are left for scan_file to open itself.
+        """
+        if size > self.js_stream_threshold:
+            return False
+        return str(file_path).endswith(self.php_extensions) or self.size_decision(size) is None
+    
+    def scan_php_file(self, file_path, content=None):
+        """Scan a PHP file for webshell patterns, returns (pattern_hits, error, None, stats)
+
+        Like scan_js_file, never prints and takes already read content;
+        known-clean files in the allowlist are skipped and large files are
+        matched through mmap windows.
+        """
+        metrics = self.metrics
+        matcher = self.get_php_matcher()
         
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            if content is not None:
+                size = len(content)
+            elif not os.path.exists(file_path):
+                return MISSING_FILE
+            else:
+                size = os.path.getsize(file_path)
             
-            # Check each virus pattern
-            for pattern_name, pattern_regex in self.js_virus_patterns.items():
-                if pattern_name == 'hex_string':
-                    # Special handling for hex strings
-                    matches = re.findall(pattern_regex, content)
-                    pattern_hits[pattern_name] = len(matches)
-                else:
-                    matches = re.findall(pattern_regex, content, re.IGNORECASE)
-                    pattern_hits[pattern_name] = len(matches)
+            allowlist = self.get_allowlist()
+            if allowlist is not None and allowlist.may_contain(size):
+                with metrics.time('phase', phase='allowlist'):
+                    if content is None:
+                        known = allowlist.lookup(file_path, size) is not None
+                    else:
+                        known = allowlist.lookup_content(content) is not None
+                if known:
+                    metrics.incr('allowlist_hits')
+                    return matcher.empty_result(), None, None, None
+            
+            if content is None and size > self.js_stream_threshold:
+                stats = self.new_stats(size)
+                with metrics.time('phase', phase='stream'):
+                    pattern_hits = self.analyze_large_file(file_path, matcher=matcher, stats=stats)
+                metrics.incr('files_read', mode='stream')
+                metrics.incr('bytes_read', size, mode='stream')
+                return pattern_hits, None, None, stats and stats.result()
+            
+            if content is None:
+                with metrics.time('phase', phase='read'):
+                    with open(file_path, 'rb') as f:
+                        content = f.read()
+                metrics.incr('files_read', mode='read')
+                metrics.incr('bytes_read', size, mode='read')
+            
+            with metrics.time('phase', phase='php_match'):
+                pattern_hits = matcher.count(content)
+            if metrics.enabled:
+                for name, hits in pattern_hits.items():
+                    if hits:
+                        metrics.incr('rule_hits', hits, rule=name)
+            return pattern_hits, None, None, self.score_content(content)
         
         except Exception as e:
-            print_colored(f"分析文件失败 {file_path}: {e}", Colors.RED)
+            metrics.incr('scan_errors')
+            return {}, str(e), None, None
+    
+    def php_file_hits(self, site, file_path, pattern_hits):
+        """Apply the rule directories to one PHP file's content hits
+
+        Content rules limited to directories lose hits outside them, and
+        every dir rule whose directory holds the file adds one hit.
+        """
+        prefix = site.rstrip('/') + '/'
+        file_path = str(file_path)
+        rel_path = file_path[len(prefix):] if file_path.startswith(prefix) else file_path
+        
+        hits = dict(pattern_hits)
+        for rule_id, dirs in self.php_rule_dirs.items():
+            inside = any(rel_path.startswith(path + '/') for path in dirs)
+            if rule_id in self.php_webshell_patterns:
+                if not inside and hits.get(rule_id):
+                    hits[rule_id] = 0
+            else:
+                hits[rule_id] = 1 if inside else 0
+        return hits
+    
+    def analyze_js_file(self, file_path, presence_only=None):
+        """Analyze a JavaScript or HTML file for virus patterns"""
+        pattern_hits, error, _, _ = self.scan_js_file(file_path, presence_only)
+        
+        if error is not None:
+            print_colored(f"分析文件失败 {file_path}: {error}", Colors.RED)
             return {}
         
-        return pattern_hits
+        return pattern_hits or {}
     
-    def check_javascript_virus(self, sites):
-        """Check for JavaScript virus patterns"""
-        print_header("JavaScript 病毒特征检查")
+    def analyze_head_tail(self, file_path, size, presence_only=False, stats=None):
+        """Scan only the first and last js_head_tail_bytes of a file
+
+        stats, an ObfuscationStats, is fed both parts when given.
+        """
+        matcher = self.get_js_matcher()
+        window = self.js_head_tail_bytes
         
-        if not sites:
-            print_colored("站点列表为空", Colors.YELLOW)
-            return
+        with open(file_path, 'rb') as f:
+            parts = [f.read(window)]
+            if size > window:
+                f.seek(max(window, size - window))
+                parts.append(f.read(window))
         
-        # Create timestamped log directory
+        hits = matcher.empty_result()
+        for part in parts:
+            if stats is not None:
+                stats.end_line().update(part)
+            part_hits = matcher.presence(part) if presence_only else matcher.count(part)
+            for name, count in part_hits.items():
+                hits[name] = max(hits[name], count) if presence_only else hits[name] + count
+        return hits
+    
+    def analyze_large_file(self, file_path, presence_only=False, matcher=None, stats=None):
+        """Scan a large file through mmap in bounded, overlapping windows
+
+        stats, an ObfuscationStats, is fed every window once it has been
+        matched, so the file is still read only once.
+        """
+        matcher = matcher or self.get_js_matcher()
+        
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                release = None
+                if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+                    def release(start, end):
+                        # Drop pages that have been fully scanned from RSS
+                        start -= start % mmap.PAGESIZE
+                        end -= end % mmap.PAGESIZE
+                        if end > start:
+                            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+                
+                if stats is not None:
+                    drop = release
+                    
+                    def release(start, end):
+                        stats.update(mm[start:end])
+                        if drop is not None:
+                            drop(start, end)
+                
+                return matcher.count_windows(mm, self.js_stream_window, self.js_stream_overlap,
+                                             presence_only=presence_only, release=release)
+    
+    def open_js_log_dir(self):
+        """Create and announce this run's timestamped log directory"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         log_dir = os.path.join(self.log_dir, timestamp)
         ensure_dir_exists(log_dir)
@@ -229,90 +853,291 @@ return array (
         print_colored(f"日志目录: {log_dir}", Colors.BLUE)
         print_colored("由于病毒变种很多，只输出可疑特征", Colors.YELLOW)
         print()
+        return log_dir
+    
+    def get_scan_engine(self):
+        """Return the engine for this run: a worker pool, or read-ahead in-process"""
+        engine = ParallelScanEngine(self, jobs=self.jobs)
+        if engine.jobs > 1 or not self.read_ahead:
+            return engine
+        return ReadAheadScanEngine(self, reads=self.read_threads, read_ahead=self.read_ahead,
+                                   mount_limits=self.mount_read_limits,
+                                   mount_default=self.mount_read_default)
+    
+    def start_js_scan(self, site_files, record=True):
+        """Start scanning every listed file, returns (results, cache, history, run_id)
+
+        results yields one (pattern_hits, error, decision) per file, in the
+        order of site_files; consume it through report_js_site (or
+        report_php_site for PHP files). With record=False no history run
+        is started.
+        """
+        cache = self.open_scan_cache()
+        all_files = [file_path for _, files in site_files for file_path in files]
+        engine = self.get_scan_engine()
+        results = self.scan_files_cached(engine, all_files, cache)
+        history, run_id = self.open_history() if record else (None, None)
+        return results, cache, history, run_id
+    
+    def note_obfuscation(self, findings, check, site, file_path, stats):
+        """Rank one file's obfuscation stats, reporting it at or above the threshold
+
+        Returns 1 when the file was reported, else 0. A high score alone is
+        a lead for an analyst, not a finding, so it never changes the
+        suspicious-file count.
+        """
+        findings.add_score(file_path, stats)
+        if stats['score'] < self.obfuscation_threshold:
+            return 0
+        print_colored(f"高混淆度文件 (评分 {stats['score']}): {file_path}", Colors.YELLOW)
+        self.emit('obfuscated', check=check, site=site, file=str(file_path), stats=stats)
+        return 1
+    
+    def report_js_site(self, site, files_to_check, results, log_dir, history=None, run_id=None):
+        """Consume one site's scan results, print and log them, returns suspicious files"""
+        # Create site log directory
+        site_name = os.path.basename(site.rstrip('/'))
+        site_log_dir = os.path.join(log_dir, site_name)
+        ensure_dir_exists(site_log_dir)
         
-        for site in sites:
-            if not site.strip():
+        findings = FindingsWriter(site_log_dir, self.js_virus_patterns.keys(),
+                                  top_k=self.findings_top_k, jsonl=self.findings_jsonl,
+                                  score_top=self.obfuscation_top)
+        
+        if not files_to_check:
+            print_colored("未找到JS文件或template下的HTML文件", Colors.GREEN)
+            self.record_history(history, run_id, site, 0, [])
+            self.emit('site', check='javascript', site=site, files=0, suspicious=0,
+                      log_dir=site_log_dir)
+            return 0
+        
+        suspicious_files = 0
+        obfuscated_files = 0
+        site_findings = []
+        
+        for file_path in files_to_check:
+            pattern_hits, error, decision, stats = next(results)
+            
+            if pattern_hits is None:
                 continue
             
-            print_colored(f"检查站点: {site}", Colors.YELLOW)
+            if stats is not None:
+                obfuscated_files += self.note_obfuscation(findings, 'javascript', site, file_path, stats)
             
-            # Create site log directory
-            site_name = os.path.basename(site.rstrip('/'))
-            site_log_dir = os.path.join(log_dir, site_name)
-            ensure_dir_exists(site_log_dir)
+            if decision is not None:
+                findings.add_decision(file_path, decision)
+                self.emit('decision', check='javascript', site=site, file=str(file_path),
+                          decision=decision)
             
-            # Initialize log files for each pattern
-            pattern_logs = {}
-            for pattern_name in self.js_virus_patterns.keys():
-                log_file = os.path.join(site_log_dir, f"{pattern_name}.txt")
-                pattern_logs[pattern_name] = log_file
-                # Create empty log file
-                with open(log_file, 'w', encoding='utf-8') as f:
-                    pass
+            if error is not None:
+                print_colored(f"分析文件失败 {file_path}: {error}", Colors.RED)
+                self.emit('error', check='javascript', site=site, file=str(file_path), error=error)
+                pattern_hits = {}
             
-            # Find all JS and HTML files
-            files_to_check = self.find_js_and_html_files(site)
+            # Check if any pattern was hit
+            total_hits = sum(pattern_hits.values())
+            has_hit = total_hits > 0
             
-            if not files_to_check:
-                print_colored("未找到JS文件或template下的HTML文件", Colors.GREEN)
+            if has_hit:
                 print()
-                continue
-            
-            suspicious_files = 0
-            
-            for file_path in files_to_check:
-                if not file_path.exists():
-                    continue
+                print_colored(f"可疑文件: {file_path}", Colors.RED)
                 
-                pattern_hits = self.analyze_js_file(file_path)
+                for pattern_name, hits in pattern_hits.items():
+                    print_colored(f"  可疑特征 {pattern_name}: {hits} 次", Colors.YELLOW)
                 
-                # Check if any pattern was hit
-                total_hits = sum(pattern_hits.values())
-                has_hit = total_hits > 0
-                
-                if has_hit:
-                    print()
-                    print_colored(f"可疑文件: {file_path}", Colors.RED)
-                    
-                    for pattern_name, hits in pattern_hits.items():
-                        print_colored(f"  可疑特征 {pattern_name}: {hits} 次", Colors.YELLOW)
-                        
-                        # Log to pattern-specific file if there are hits
-                        if hits > 0:
-                            log_file = pattern_logs[pattern_name]
-                            with open(log_file, 'a', encoding='utf-8') as f:
-                                f.write(f"{hits} {file_path.name}: {file_path}\n")
-                    
-                    print()
-                    suspicious_files += 1
+                findings.add(file_path, pattern_hits, stats)
+                site_findings.append((file_path, pattern_hits))
+                print()
+                suspicious_files += 1
+                self.emit('finding', check='javascript', site=site, file=str(file_path),
+                          hits=pattern_hits, stats=stats)
+        
+        # One sequential write per site, already sorted by hit count
+        try:
+            with self.metrics.time('phase', phase='log_write'):
+                findings.write()
+        except OSError as e:
+            print_colored(f"写入日志失败 {site_log_dir}: {e}", Colors.RED)
+        
+        with self.metrics.time('phase', phase='history'):
+            self.record_history(history, run_id, site, len(files_to_check), site_findings)
+        
+        self.emit('site', check='javascript', site=site, files=len(files_to_check),
+                  suspicious=suspicious_files, log_dir=site_log_dir)
+        
+        if findings.decisions:
+            print_colored(f"按大小/二进制策略跳过或部分扫描 {len(findings.decisions)} 个文件"
+                          f"（见 {findings.decisions_name}）", Colors.BLUE)
+        if obfuscated_files:
+            print_colored(f"{obfuscated_files} 个文件混淆评分不低于 {self.obfuscation_threshold}"
+                          f"（排名见 {findings.rank_name}）", Colors.YELLOW)
+        
+        if suspicious_files == 0:
+            print_colored("未发现可疑JS/HTML文件", Colors.GREEN)
+        else:
+            print_colored(f"在该站点发现 {suspicious_files} 个可疑JS/HTML文件", Colors.RED)
+        return suspicious_files
+    
+    def finish_js_scan(self, site_files, results, cache, history, run_id, covers=None):
+        """Stop the workers and save the history run and scan cache
+
+        covers limits cache pruning to the file types the run listed (see
+        ScanCache.prune_site).
+        """
+        # Shut the worker pool down now that every result has been consumed
+        results.close()
+        
+        if history is not None:
+            try:
+                history.finish_run(run_id)
+                print_colored(f"检查结果已记录到历史数据库（第 {run_id} 次运行）", Colors.BLUE)
+            except Exception as e:
+                print_colored(f"写入历史数据库失败: {e}", Colors.YELLOW)
+            history.close()
+        
+        if cache is not None:
+            # Forget files that have been deleted from the scanned sites
+            for site, files_to_check in site_files:
+                cache.prune_site(site, {str(file_path) for file_path in files_to_check}, covers)
+            try:
+                with self.metrics.time('phase', phase='cache_save'):
+                    cache.save()
+            except OSError as e:
+                print_colored(f"保存扫描缓存失败: {e}", Colors.YELLOW)
+            self.metrics.incr('scan_cache_hits', cache.hits)
+            self.metrics.incr('scan_cache_misses', cache.misses)
+            print_colored(f"扫描缓存: 复用 {cache.hits} 个未变化文件，重新扫描 {cache.misses} 个文件", Colors.BLUE)
+    
+    def check_javascript_virus(self, sites):
+        """Check for JavaScript virus patterns"""
+        self.require_rules()
+        print_header("JavaScript 病毒特征检查")
+        
+        if not sites:
+            print_colored("站点列表为空", Colors.YELLOW)
+            return 0
+        
+        total_found = 0
+        log_dir = self.open_js_log_dir()
+        
+        # List every site's files up front so the pool stays busy across sites
+        site_files = []
+        with self.metrics.time('phase', phase='walk'):
+            for site in sites:
+                if not site.strip():
+                    continue
+                site_files.append((site, self.find_js_and_html_files(site)))
+        self.metrics.incr('files_listed', sum(len(files) for _, files in site_files))
+        
+        results, cache, history, run_id = self.start_js_scan(site_files)
+        
+        for site, files_to_check in site_files:
+            print_colored(f"检查站点: {site}", Colors.YELLOW)
+            total_found += self.report_js_site(site, files_to_check, results, log_dir, history, run_id)
+            print()
+        
+        self.finish_js_scan(site_files, results, cache, history, run_id,
+                            covers=lambda path: not path.endswith(self.php_extensions))
+        
+        print_colored("JavaScript病毒检查完成！", Colors.GREEN)
+        print_colored(f"详细日志已保存到: {log_dir}", Colors.BLUE)
+        print()
+        return total_found
+    
+    def report_php_site(self, site, php_files, results, log_dir):
+        """Consume one site's PHP scan results, print and log them, returns suspicious files"""
+        site_name = os.path.basename(site.rstrip('/'))
+        site_log_dir = os.path.join(log_dir, site_name, 'php_webshell')
+        ensure_dir_exists(site_log_dir)
+        
+        rule_names = list(self.php_webshell_patterns)
+        rule_names += [rule_id for rule_id in self.php_rule_dirs if rule_id not in self.php_webshell_patterns]
+        findings = FindingsWriter(site_log_dir, rule_names,
+                                  top_k=self.findings_top_k, jsonl=self.findings_jsonl,
+                                  score_top=self.obfuscation_top)
+        
+        suspicious_files = 0
+        obfuscated_files = 0
+        for file_path in php_files:
+            pattern_hits, error, _, stats = next(results)
             
-            # Sort and clean up log files
-            for pattern_name, log_file in pattern_logs.items():
-                if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
-                    # Sort file contents by hit count (descending)
-                    with open(log_file, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                    
-                    # Sort by the number at the beginning of each line
-                    lines.sort(key=lambda x: int(x.split()[0]) if x.split() else 0, reverse=True)
-                    
-                    with open(log_file, 'w', encoding='utf-8') as f:
-                        f.writelines(lines)
-                else:
-                    # Remove empty log files
-                    if os.path.exists(log_file):
-                        os.remove(log_file)
+            if pattern_hits is None:
+                continue
             
-            if suspicious_files == 0:
-                print_colored("未发现可疑JS/HTML文件", Colors.GREEN)
-            else:
-                print_colored(f"在该站点发现 {suspicious_files} 个可疑JS/HTML文件", Colors.RED)
+            if stats is not None:
+                obfuscated_files += self.note_obfuscation(findings, 'php_webshell', site, file_path, stats)
+            
+            if error is not None:
+                print_colored(f"分析文件失败 {file_path}: {error}", Colors.RED)
+                self.emit('error', check='php_webshell', site=site, file=str(file_path), error=error)
+                pattern_hits = {}
+            
+            pattern_hits = self.php_file_hits(site, file_path, pattern_hits)
+            if not any(pattern_hits.values()):
+                continue
             
+            print_colored(f"疑似WebShell: {file_path}", Colors.RED)
+            for pattern_name, hits in pattern_hits.items():
+                if hits:
+                    print_colored(f"  命中规则 {pattern_name}: {hits} 次", Colors.YELLOW)
+            findings.add(file_path, pattern_hits, stats)
+            suspicious_files += 1
+            self.emit('finding', check='php_webshell', site=site, file=str(file_path),
+                      hits=pattern_hits, stats=stats)
+        
+        try:
+            with self.metrics.time('phase', phase='log_write'):
+                findings.write()
+        except OSError as e:
+            print_colored(f"写入日志失败 {site_log_dir}: {e}", Colors.RED)
+        
+        self.emit('site', check='php_webshell', site=site, files=len(php_files),
+                  suspicious=suspicious_files, log_dir=site_log_dir)
+        
+        if obfuscated_files:
+            print_colored(f"{obfuscated_files} 个PHP文件混淆评分不低于 {self.obfuscation_threshold}"
+                          f"（排名见 {findings.rank_name}）", Colors.YELLOW)
+        
+        if suspicious_files == 0:
+            print_colored(f"未发现疑似WebShell（检查了 {len(php_files)} 个PHP文件）", Colors.GREEN)
+        else:
+            print_colored(f"在该站点发现 {suspicious_files} 个疑似WebShell文件", Colors.RED)
+        return suspicious_files
+    
+    def check_php_webshell(self, sites):
+        """Check every PHP file, upload directories included, for webshell code"""
+        self.require_rules()
+        print_header("PHP WebShell 检查")
+        
+        sites = [site for site in sites if site.strip()]
+        if not sites:
+            print_colored("站点列表为空", Colors.YELLOW)
+            return 0
+        
+        total_found = 0
+        log_dir = self.open_js_log_dir()
+        
+        site_files = []
+        with self.metrics.time('phase', phase='walk'):
+            for site in sites:
+                site_files.append((site, self.find_php_files(site)))
+        self.metrics.incr('files_listed', sum(len(files) for _, files in site_files))
+        
+        # Only the JS check keeps findings history
+        results, cache, _, _ = self.start_js_scan(site_files, record=False)
+        
+        for site, php_files in site_files:
+            print_colored(f"检查站点: {site}", Colors.YELLOW)
+            total_found += self.report_php_site(site, php_files, results, log_dir)
             print()
         
-        print_colored("JavaScript病毒检查完成！", Colors.GREEN)
+        self.finish_js_scan(site_files, results, cache, None, None,
+                            covers=lambda path: path.endswith(self.php_extensions))
+        
+        print_colored("PHP WebShell检查完成！", Colors.GREEN)
         print_colored(f"详细日志已保存到: {log_dir}", Colors.BLUE)
         print()
+        return total_found
     
     def show_virus_menu(self):
         """Show virus checking menu"""
@@ -320,11 +1145,13 @@ return array (
         print("1. PHP活跃病毒检查 (检查PHP文件中的恶意代码)")
         print("2. PHP插件病毒检查 (检查PHP插件和模板中的病毒)")
         print("3. JavaScript病毒检查 (检查JS和HTML文件中的可疑代码)")
+        print("4. PHP WebShell检查 (检查所有PHP文件，包括上传目录)")
+        print("5. 完整检查 (每个站点只遍历一次，运行以上全部检查)")
         print("0. 返回上级菜单")
         print()
         
         try:
-            choice = input("请输入选项 [0-3]: ").strip()
+            choice = input("请输入选项 [0-5]: ").strip()
             return choice
         except KeyboardInterrupt:
             print_colored("\n操作已取消", Colors.YELLOW)
@@ -337,6 +1164,10 @@ return array (
         """Main virus checking interface"""
         print_header("MacCMS 病毒检查系统")
         
+        if self.rules_error is not None:
+            print_colored("规则包无效，无法运行病毒检查，请先修正 data/rules/ 中的规则包", Colors.RED)
+            return False
+        
         # Check if site.txt exists
         sites = read_site_list(self.data_dir)
         if not sites:
@@ -366,6 +1197,14 @@ return array (
                 self.check_javascript_virus(sites)
                 pause_for_user()
                 print()
+            elif choice == "4":
+                self.check_php_webshell(sites)
+                pause_for_user()
+                print()
+            elif choice == "5":
+                SiteCheckPipeline(self).run(sites)
+                pause_for_user()
+                print()
             elif choice == "0":
                 print_colored("返回主菜单", Colors.GREEN)
                 break
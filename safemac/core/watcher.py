@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+MacCMS Site Watcher
+Real-time checks of created or modified site files through inotify
+"""
+
+import errno
+import os
+import time
+from ..utils import Colors, print_colored, print_header, join_rel, TreeWalker
+from ..utils.inotify import (Inotify, inotify_available, IN_CLOSE_WRITE, IN_MOVED_TO, IN_MODIFY,
+                             IN_CREATE, IN_DELETE_SELF, IN_MOVE_SELF, IN_ONLYDIR, IN_ISDIR,
+                             IN_IGNORED, IN_Q_OVERFLOW)
+
+
+# Events that mean a file may have new content
+FILE_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MODIFY | IN_CREATE
+
+WATCH_MASK = FILE_EVENTS | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+
+class SiteWatcher:
+    """Watches site directories and runs the checks on changed files only
+
+    Every directory of every site (minus the checker's
+    php_scan_exclude_dirs, so upload directories are watched too) gets an
+    inotify watch. A changed file is checked once it has been quiet
+    for `debounce` seconds (or after `max_delay` seconds at most), so bursts
+    such as an upload being written are scanned once. JS/HTML and PHP files
+    go through scan_file; files named by the PHP rules re-run the matching
+    PHP check for their site. If the kernel event queue overflows, files
+    modified since the last complete read are found by mtime and checked,
+    instead of rescanning every site.
+    """
+
+    def __init__(self, checker, sites):
+        self.checker = checker
+        self.sites = [site.rstrip('/') or '/' for site in sites if site.strip()]
+        self.debounce = 2.0
+        self.max_delay = 30.0
+        # Extra seconds subtracted from the overflow cut-off to allow for
+        # coarse filesystem timestamps
+        self.rescan_margin = 2.0
+
+        self.inotify = None
+        # wd -> (site, rel_dir)
+        self.watches = {}
+        # path -> [site, rel_path, first_seen, last_seen] (monotonic times)
+        self.pending = {}
+        self.overflowed = False
+        self.watch_limit_hit = False
+        self.synced_at = None
+
+        self.excluded = set(path.strip('/') for path in checker.php_scan_exclude_dirs)
+        self.php_paths = {}
+        for check in ('php_active_system', 'php_addons_hijack'):
+            for rule in checker.rules.for_check(check):
+                for path in rule.paths:
+                    self.php_paths.setdefault(path, set()).add(check)
+
+        self.files_checked = 0
+        self.findings = 0
+        self.overflows = 0
+
+    def is_relevant(self, rel_path):
+        """Check whether a site-relative file is covered by any check"""
+        return (rel_path in self.php_paths or self.checker.is_js_target(rel_path)
+                or self.checker.is_php_target(rel_path))
+
+    def watch_tree(self, site, rel_root='', queue_files=False):
+        """Add watches for a directory tree inside a site
+
+        With queue_files every relevant file found is queued for checking,
+        which covers files written into a new directory before its watch
+        existed.
+        """
+        root = os.path.join(site, rel_root) if rel_root else site
+        for listing in TreeWalker().walk(root):
+            rel_dir = join_rel(rel_root, listing.rel_path) if listing.rel_path else rel_root
+            listing.dirs[:] = [entry for entry in listing.dirs
+                               if join_rel(rel_dir, entry.name) not in self.excluded]
+            self.add_watch(site, listing.path, rel_dir)
+            if queue_files:
+                for entry in listing.files:
+                    self.queue(site, join_rel(rel_dir, entry.name))
+
+    def add_watch(self, site, path, rel_dir):
+        try:
+            wd = self.inotify.add_watch(path, WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC and not self.watch_limit_hit:
+                self.watch_limit_hit = True
+                print_colored("inotify 监控数量已达上限，请调大 fs.inotify.max_user_watches", Colors.RED)
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.ENOSPC):
+                print_colored(f"无法监控目录 {path}: {e}", Colors.YELLOW)
+            return
+        self.watches[wd] = (site, rel_dir)
+
+    def queue(self, site, rel_path):
+        """Queue a site file for checking, restarting its debounce timer"""
+        if not self.is_relevant(rel_path):
+            return
+        path = os.path.join(site, rel_path)
+        now = time.monotonic()
+        entry = self.pending.get(path)
+        if entry is None:
+            self.pending[path] = [site, rel_path, now, now]
+        else:
+            entry[3] = now
+
+    def handle_event(self, event):
+        if event.mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return
+        watch = self.watches.get(event.wd)
+        if watch is None:
+            return
+        if event.mask & IN_IGNORED:
+            del self.watches[event.wd]
+            return
+        if not event.name:
+            return
+
+        site, rel_dir = watch
+        rel_path = join_rel(rel_dir, event.name)
+        if event.mask & IN_ISDIR:
+            if event.mask & (IN_CREATE | IN_MOVED_TO) and rel_path not in self.excluded:
+                self.watch_tree(site, rel_path, queue_files=True)
+        elif event.mask & FILE_EVENTS:
+            self.queue(site, rel_path)
+
+    def rescan_modified(self, since):
+        """Queue relevant files modified after since (after an overflow)
+
+        Only stats files; watches lost with the overflow (new directories)
+        are re-added on the way.
+        """
+        self.overflows += 1
+        queued = len(self.pending)
+        for site in self.sites:
+            for listing in TreeWalker().walk(site):
+                listing.dirs[:] = [entry for entry in listing.dirs
+                                   if join_rel(listing.rel_path, entry.name) not in self.excluded]
+                self.add_watch(site, listing.path, listing.rel_path)
+                for entry in listing.files:
+                    rel_path = join_rel(listing.rel_path, entry.name)
+                    try:
+                        if self.is_relevant(rel_path) and entry.stat(follow_symlinks=False).st_mtime >= since:
+                            self.queue(site, rel_path)
+                    except OSError:
+                        continue
+        print_colored(f"事件队列溢出，已按修改时间补查 {len(self.pending) - queued} 个文件", Colors.YELLOW)
+        self.checker.emit('watch', state='overflow', queued=len(self.pending) - queued)
+
+    def due(self, entry, now):
+        return min(entry[3] + self.debounce, entry[2] + self.max_delay) <= now
+
+    def next_timeout(self, cap=1.0):
+        if not self.pending:
+            return cap
+        now = time.monotonic()
+        deadline = min(min(entry[3] + self.debounce, entry[2] + self.max_delay)
+                       for entry in self.pending.values())
+        return max(0.0, min(cap, deadline - now))
+
+    def flush(self, force=False):
+        """Check every queued file whose debounce period has passed"""
+        now = time.monotonic()
+        ready = {}
+        for path, entry in list(self.pending.items()):
+            if force or self.due(entry, now):
+                del self.pending[path]
+                ready.setdefault(entry[0], []).append(entry[1])
+
+        for site, rel_paths in ready.items():
+            self.check_site_files(site, sorted(rel_paths))
+
+    def check_site_files(self, site, rel_paths):
+        """Run the checks that cover the given files of one site"""
+        php_checks = set()
+        for rel_path in rel_paths:
+            php_checks.update(self.php_paths.get(rel_path, ()))
+
+        if 'php_active_system' in php_checks:
+            self.findings += self.checker.check_php_active_system([site]) or 0
+        if 'php_addons_hijack' in php_checks:
+            self.findings += self.checker.check_php_addons_hijack([site]) or 0
+
+        for rel_path in rel_paths:
+            if self.checker.is_js_target(rel_path):
+                check = 'javascript'
+            elif self.checker.is_php_target(rel_path):
+                check = 'php_webshell'
+            else:
+                continue
+            file_path = os.path.join(site, rel_path)
+            pattern_hits, error, decision, stats = self.checker.scan_file(file_path)
+            if pattern_hits is None:
+                continue
+            self.files_checked += 1
+            if decision is not None:
+                self.checker.emit('decision', check=check, site=site, file=file_path,
+                                  decision=decision)
+
+            if error is not None:
+                print_colored(f"分析文件失败 {file_path}: {error}", Colors.RED)
+                self.checker.emit('error', check=check, site=site, file=file_path, error=error)
+                continue
+            if stats is not None and stats['score'] >= self.checker.obfuscation_threshold:
+                print_colored(f"高混淆度文件 (评分 {stats['score']}): {file_path}", Colors.YELLOW)
+                self.checker.emit('obfuscated', check=check, site=site, file=file_path, stats=stats)
+            if check == 'php_webshell':
+                pattern_hits = self.checker.php_file_hits(site, file_path, pattern_hits)
+            if sum(pattern_hits.values()) > 0:
+                print_colored(f"可疑文件: {file_path}", Colors.RED)
+                for pattern_name, hits in pattern_hits.items():
+                    print_colored(f"  可疑特征 {pattern_name}: {hits} 次", Colors.YELLOW)
+                self.findings += 1
+                self.checker.emit('finding', check=check, site=site, file=file_path,
+                                  hits=pattern_hits, stats=stats)
+
+    def run(self, duration=None):
+        """Watch until interrupted (or for duration seconds), returns findings"""
+        self.checker.require_rules()
+        print_header("实时监控模式")
+
+        if not inotify_available():
+            print_colored("错误: 当前系统不支持 inotify", Colors.RED)
+            return None
+
+        self.inotify = Inotify()
+        self.synced_at = time.time()
+        try:
+            for site in self.sites:
+                if os.path.isdir(site):
+                    self.watch_tree(site)
+                else:
+                    print_colored(f"站点目录不存在: {site}", Colors.YELLOW)
+
+            print_colored(f"正在监控 {len(self.sites)} 个站点（{len(self.watches)} 个目录），按 Ctrl+C 退出", Colors.GREEN)
+            self.checker.emit('watch', state='started', sites=len(self.sites), directories=len(self.watches))
+
+            stop_at = time.monotonic() + duration if duration else None
+            while stop_at is None or time.monotonic() < stop_at:
+                read_started = time.time()
+                for event in self.inotify.read_events(self.next_timeout()):
+                    self.handle_event(event)
+                if self.overflowed:
+                    self.overflowed = False
+                    self.rescan_modified(self.synced_at - self.rescan_margin)
+                self.synced_at = read_started
+                self.flush()
+            self.flush(force=True)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            self.inotify.close()
+
+        print_colored(f"监控结束: 检查 {self.files_checked} 个文件，发现 {self.findings} 个问题", Colors.GREEN)
+        self.checker.emit('watch', state='stopped', files=self.files_checked, findings=self.findings,
+                          overflows=self.overflows)
+        return self.findings
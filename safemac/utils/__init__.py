@@ -4,11 +4,18 @@ Utility modules for MacCMS Security Tool
 """
 
 from .colors import Colors, print_colored, print_header
-from .filesystem import get_script_dir, ensure_dir_exists, read_site_list, write_site_list
+from .filesystem import get_script_dir, ensure_dir_exists, read_site_list, read_site_file, write_site_list
 from .interactive import get_user_input, confirm_action, pause_for_user
+from .walker import TreeWalker, DirListing, join_rel
+from .results import ResultStream
+from .metrics import Metrics
+from .framing import PROTOCOL_VERSION, FrameError, FrameEventStream, read_frame, write_frame
 
 __all__ = [
     'Colors', 'print_colored', 'print_header',
-    'get_script_dir', 'ensure_dir_exists', 'read_site_list', 'write_site_list', 
-    'get_user_input', 'confirm_action', 'pause_for_user'
+    'get_script_dir', 'ensure_dir_exists', 'read_site_list', 'read_site_file', 'write_site_list',
+    'get_user_input', 'confirm_action', 'pause_for_user',
+    'TreeWalker', 'DirListing', 'join_rel',
+    'ResultStream', 'Metrics',
+    'PROTOCOL_VERSION', 'FrameError', 'FrameEventStream', 'read_frame', 'write_frame'
 ]
\ No newline at end of file
@@ -23,7 +23,11 @@ def ensure_dir_exists(directory):
 
 def read_site_list(data_dir):
     """Read the site list from data/site.txt"""
-    site_file = os.path.join(data_dir, "site.txt")
+    return read_site_file(os.path.join(data_dir, "site.txt"))
+
+
+def read_site_file(site_file):
+    """Read a site list file, one site path per line"""
     sites = []
     
     if os.path.exists(site_file):
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Frame protocol utilities for the MacCMS security tool
+Length-prefixed JSON messages over pipes, ssh sessions or Unix sockets
+"""
+
+import json
+import struct
+from .results import ResultStream
+
+
+# Bump when messages change in a way older peers cannot read
+PROTOCOL_VERSION = 1
+
+# Every frame is a 4-byte big-endian length followed by that many bytes
+# of UTF-8 JSON holding one object
+_HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024
+
+
+class FrameError(Exception):
+    """A frame was truncated, too large or not a JSON object"""
+
+
+def write_frame(stream, message):
+    """Write one message to a binary stream and flush it"""
+    payload = json.dumps(message, ensure_ascii=False, default=str).encode('utf-8')
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    stream.write(_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks), size
+
+
+def read_frame(stream):
+    """Read one message from a binary stream, None at a clean end of stream"""
+    header, missing = _read_exact(stream, _HEADER.size)
+    if missing == _HEADER.size:
+        return None
+    if missing:
+        raise FrameError("stream ended inside a frame header")
+
+    size, = _HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise FrameError(f"frame too large: {size} bytes")
+    payload, missing = _read_exact(stream, size)
+    if missing:
+        raise FrameError("stream ended inside a frame")
+
+    try:
+        message = json.loads(payload.decode('utf-8'))
+    except ValueError as e:
+        raise FrameError(f"invalid frame: {e}")
+    if not isinstance(message, dict):
+        raise FrameError("frame is not a JSON object")
+    return message
+
+
+class FrameEventStream(ResultStream):
+    """ResultStream that sends each event as an "event" frame
+
+    Lets a worker run the normal batch subcommands while its events travel
+    back to the coordinator over the frame protocol.
+    """
+
+    def __init__(self, stream, request_id=None):
+        super().__init__(stream)
+        self.request_id = request_id
+
+    def write(self, record):
+        write_frame(self.stream, {'type': 'event', 'id': self.request_id, 'event': record})
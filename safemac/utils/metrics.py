@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Run metrics for the MacCMS security tool
+Per-phase timers and counters, exported as JSON or a node_exporter textfile
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _NullTimer:
+    """Context manager used while metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Timers and counters for one run, keyed by name plus optional labels
+
+    Disabled metrics turn every call into a no-op, so instrumented code
+    costs nothing unless a report was asked for. Timers accumulate seconds
+    and calls; counters accumulate values. Results from worker processes
+    are folded in with merge(to_dict()).
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.timers = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def add_time(self, name, seconds, calls=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [seconds, calls]
+            else:
+                timer[0] += seconds
+                timer[1] += calls
+
+    def incr(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def time(self, name, **labels):
+        """Context manager adding the time spent in its block to a timer"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._time(name, labels)
+
+    @contextmanager
+    def _time(self, name, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started, **labels)
+
+    def to_dict(self):
+        """Plain, JSON-serialisable form of every timer and counter"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'timers': [{'name': name, 'labels': dict(labels), 'seconds': round(seconds, 6), 'calls': calls}
+                           for (name, labels), (seconds, calls) in sorted(self.timers.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    def merge(self, data, **labels):
+        """Add the timers and counters of another to_dict() result
+
+        labels are added to every merged entry, e.g. host=... to keep the
+        results of several machines apart.
+        """
+        if not self.enabled or not data:
+            return
+        for timer in data.get('timers', ()):
+            self.add_time(timer['name'], timer['seconds'], timer['calls'], **dict(timer['labels'], **labels))
+        for counter in data.get('counters', ()):
+            self.incr(counter['name'], counter['value'], **dict(counter['labels'], **labels))
+
+    def to_prometheus(self, prefix="safemac", **labels):
+        """node_exporter textfile format; labels are added to every sample"""
+        lines = []
+        extra = dict(labels)
+
+        def sample(metric, sample_labels, value):
+            merged = dict(extra)
+            merged.update(sample_labels)
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in sorted(merged.items()))
+            return f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}"
+
+        data = self.to_dict()
+        timers = {}
+        for timer in data['timers']:
+            timers.setdefault(timer['name'], []).append(timer)
+        for name, items in sorted(timers.items()):
+            seconds = f"{prefix}_{name}_seconds_total"
+            calls = f"{prefix}_{name}_calls_total"
+            lines.append(f"# TYPE {seconds} counter")
+            lines.extend(sample(seconds, item['labels'], item['seconds']) for item in items)
+            lines.append(f"# TYPE {calls} counter")
+            lines.extend(sample(calls, item['labels'], item['calls']) for item in items)
+
+        counters = {}
+        for counter in data['counters']:
+            counters.setdefault(counter['name'], []).append(counter)
+        for name, items in sorted(counters.items()):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(sample(metric, item['labels'], item['value']) for item in items)
+
+        lines.append(f"# TYPE {prefix}_last_run_timestamp_seconds gauge")
+        lines.append(sample(f"{prefix}_last_run_timestamp_seconds", {}, round(time.time(), 3)))
+        lines.append(f"# TYPE {prefix}_run_duration_seconds gauge")
+        lines.append(sample(f"{prefix}_run_duration_seconds", {}, round(time.time() - self.started, 3)))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write_atomic(file_path, text):
+        # node_exporter may read the file at any moment: write then rename
+        directory = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_file = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_file, file_path)
+
+    def write_json(self, file_path, **extra):
+        data = self.to_dict()
+        data.update(extra)
+        self._write_atomic(file_path, json.dumps(data, ensure_ascii=False, indent=1) + "\n")
+
+    def write_textfile(self, file_path, **labels):
+        self._write_atomic(file_path, self.to_prometheus(**labels))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Result stream utilities for the MacCMS security tool
+Writes machine-readable JSON Lines events for headless batch runs
+"""
+
+import json
+import sys
+import threading
+import time
+
+
+class ResultStream:
+    """Writes one JSON object per line for every result event
+
+    Each event carries an "event" name and a unix timestamp; writes are
+    serialised so worker threads can emit concurrently.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        """Write a single event line and flush it"""
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(fields)
+
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + 1
+            self.write(record)
+
+    def write(self, record):
+        """Write one event record; called with the lock held"""
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.stream.flush()
+
+    def __call__(self, event, **fields):
+        self.emit(event, **fields)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Directory traversal utilities for the MacCMS security tool
+Single-pass os.scandir walker shared by the scanner, virus checker and locker
+"""
+
+import os
+from collections import namedtuple
+
+
+# One directory visited by TreeWalker.walk. ``dirs`` and ``files`` are lists
+# of os.DirEntry; removing entries from ``dirs`` prunes them (like os.walk).
+DirListing = namedtuple('DirListing', ['path', 'rel_path', 'depth', 'dirs', 'files'])
+
+
+def join_rel(rel_path, name):
+    """Join a walk-relative directory path and an entry name"""
+    return f"{rel_path}/{name}" if rel_path else name
+
+
+class TreeWalker:
+    """Top-down os.scandir traversal that prunes excluded directories
+
+    exclude_dirs are paths relative to the walk root (e.g. "runtime",
+    "public/upload"); matching directories are never listed. Symlinked
+    directories are not followed unless follow_symlinks is set.
+    """
+
+    def __init__(self, exclude_dirs=(), max_depth=None, follow_symlinks=False, on_error=None):
+        self.exclude_dirs = set(path.strip('/') for path in exclude_dirs)
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+        self.on_error = on_error
+
+    def is_excluded(self, rel_path):
+        """Check whether a walk-relative directory path is excluded"""
+        return rel_path in self.exclude_dirs
+
+    def walk(self, root):
+        """Yield a DirListing for every directory under root, top-down"""
+        root = str(root)
+        stack = [(root, '', 0)]
+
+        while stack:
+            path, rel_path, depth = stack.pop()
+            dirs = []
+            files = []
+
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=self.follow_symlinks):
+                                if not self.is_excluded(join_rel(rel_path, entry.name)):
+                                    dirs.append(entry)
+                            else:
+                                files.append(entry)
+                        except OSError:
+                            continue
+            except OSError as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+                continue
+
+            listing = DirListing(path, rel_path, depth, dirs, files)
+            yield listing
+
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+
+            # Push in reverse so directories are visited in listing order
+            for entry in reversed(listing.dirs):
+                stack.append((entry.path, join_rel(rel_path, entry.name), depth + 1))